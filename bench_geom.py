@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+# Benchmark of the per frame cost of the geometry done by a FlowManager as the number
+# of items grows: matching tracked items against detections and checking the
+# position of every item against the counting lines.  Compares loops over the scalar
+# methods of Geom (as the code did with the Cython module) with the set methods
+
+if __name__ == '__main__':
+    import time
+    import argparse
+
+    import numpy as np
+
+    from object_flow.util.geom import Geom
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "-n", "--items", type = int, nargs = '+', default = [10, 50, 100, 200, 500],
+        help="number of items on the frame")
+    ap.add_argument(
+        "-l", "--lines", type = int, default = 4,
+        help="number of counting lines")
+    ap.add_argument(
+        "-r", "--repeat", type = int, default = 20,
+        help="number of frames measured for every number of items")
+    args = vars(ap.parse_args())
+
+    rng = np.random.default_rng(0)
+
+    def random_boxes(n):
+        start = rng.integers(0, 450, (n, 2))
+        size = rng.integers(10, 60, (n, 2))
+        return np.hstack([start, start + size])
+
+    def scalar_frame(tracked, detected, points, lines):
+        iou = np.zeros((len(tracked), len(detected)))
+        for i, t in enumerate(tracked):
+            for j, d in enumerate(detected):
+                iou[i, j] = Geom.iou(t[0], t[1], t[2], t[3], d[0], d[1], d[2], d[3])
+        positions = [[Geom.point_position(l[0], l[1], l[2], l[3], p[0], p[1])
+                      for l in lines] for p in points]
+        return iou, positions
+
+    def array_frame(tracked, detected, points, lines):
+        return (Geom.iou_matrix(tracked, detected),
+                Geom.point_positions(points, lines))
+
+    print("%8s %14s %14s %10s" % ("items", "scalar (ms)", "arrays (ms)", "speedup"))
+    
+    for n in args['items']:
+        tracked = random_boxes(n)
+        # one detection every 20 frames finds about the same items
+        detected = random_boxes(n)
+        points = (tracked[:, :2] + tracked[:, 2:]) // 2
+        lines = rng.integers(0, 500, (args['lines'], 4))
+
+        times = []
+        for frame in (scalar_frame, array_frame):
+            start = time.perf_counter()
+            for i in range(args['repeat']):
+                frame(tracked.tolist(), detected.tolist(), points.tolist(),
+                      lines.tolist())
+            times.append((time.perf_counter() - start) * 1000 / args['repeat'])
+
+        print("%8d %14.3f %14.3f %9.1fx" % (n, times[0], times[1], times[0] / times[1]))
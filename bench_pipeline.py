@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+# Benchmark of the per camera frame rate of the FlowManager loop.  A real FlowManager
+# runs its loop ('_process_frame', 'tracking_done', '_advance', 'boxes_detected',
+# '_consume_retired', ...) with a real Setting, matcher and placement, but it talks
+# to stub trackers and a stub Yolo that take the given time to reply, and reads
+# frames from a stub ring that always has the next frame ready.
+#
+# Messages are delivered by a simulation with a virtual clock: every actor processes
+# one message at a time, the stubs take the given time per message and the
+# FlowManager takes the time it really spends on every message.  Compares the
+# pipelined loop (the next frame is tracked while Yolo detects the current one)
+# with a sequential loop (the next frame waits for the detection of the current one)
+
+import heapq
+import time
+
+import numpy as np
+
+from object_flow.ipc.memo import Memo
+from object_flow.util.util import Util
+from object_flow.util.config import Config
+from object_flow.util.mmap_bboxes import MmapBboxes
+from object_flow.flow.flow_manager import FlowManager
+from object_flow.flow.setting import Setting
+from object_flow.flow.placement import Placement
+from object_flow.flow.matcher import Matcher
+
+#==========================================================================================
+# Delivers the messages between the actors.  Every actor is busy until it finishes
+# processing its last message, messages sent while processing a message leave when
+# it is finished
+#==========================================================================================
+
+class Simulation:
+
+    def __init__(self):
+        self.now = 0.0
+        self.actors = {}
+        self._busy = {}
+        self._queue = []
+        self._sent = []
+        self._seq = 0
+
+    # ---------------------------------------------------------------------------------
+    # Registers an actor: 'service_time(memo)' gives the seconds it takes to process
+    # the memo, None to use the time really spent
+    # ---------------------------------------------------------------------------------
+
+    def add(self, address, actor, service_time):
+        self.actors[address] = (actor, service_time)
+        self._busy[address] = 0.0
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def send(self, sender, address, memo):
+        self._sent.append((sender, address, memo))
+
+    # ---------------------------------------------------------------------------------
+    # Runs 'action' on the actor at 'address', starting at 'start'
+    # ---------------------------------------------------------------------------------
+
+    def run(self, address, start, action, memo = None):
+        actor, service_time = self.actors[address]
+        self.now = max(start, self._busy[address])
+
+        elapsed = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - elapsed
+
+        if service_time != None:
+            elapsed = service_time(memo)
+        self._busy[address] = self.now + elapsed
+
+        for sender, recipient, sent in self._sent:
+            self._seq += 1
+            heapq.heappush(self._queue, (self._busy[address], self._seq, sender,
+                                         recipient, sent))
+        self._sent = []
+
+    # ---------------------------------------------------------------------------------
+    # Delivers the messages in order of time until 'done()'
+    # ---------------------------------------------------------------------------------
+
+    def loop(self, done):
+        while not done() and len(self._queue) > 0:
+            at, seq, sender, address, memo = heapq.heappop(self._queue)
+            actor = self.actors[address][0]
+            self.run(address, at, lambda: actor.receiveMessage(memo, sender), memo)
+
+#==========================================================================================
+# Processes Memos as a Doer does: calls the method and replies to 'ask' memos
+#==========================================================================================
+
+class Stub:
+
+    def __init__(self, simulation, address):
+        self.simulation = simulation
+        self.address = address
+
+    def receiveMessage(self, memo, sender):
+        ret = getattr(self, memo._method)(*memo._args, **memo._kwargs)
+        if memo._memo_type == 'ask':
+            ret = ret if isinstance(ret, tuple) else (ret,)
+            self.simulation.send(self.address, sender,
+                                 Memo(memo._callback, *ret, memo_type = 'reply'))
+
+#==========================================================================================
+# Tracker that moves every item 'speed' pixels down on every frame
+#==========================================================================================
+
+class StubTracker(Stub):
+
+    def __init__(self, simulation, address, tracking, speed):
+        super().__init__(simulation, address)
+        self.tracking = tracking
+        self.speed = speed
+        self.ids = np.zeros(0, dtype = np.int64)
+        self.boxes = np.zeros((0, 4), dtype = np.int64)
+
+    def service_time(self, memo):
+        return self.tracking if memo._method == 'update_tracked_items' else 0.0
+
+    def tracks_list(self, video_name, frame_index, items):
+        self.ids = np.append(self.ids, [item.item_id for item in items])
+        self.boxes = np.append(
+            self.boxes, np.array([(item.startX, item.startY, item.endX, item.endY)
+                                  for item in items], dtype = np.int64).reshape(-1, 4),
+            axis = 0)
+
+    def stop_tracking_items(self, video_name, items_ids):
+        keep = ~np.isin(self.ids, items_ids)
+        self.ids, self.boxes = self.ids[keep], self.boxes[keep]
+
+    def update_tracked_items(self, video_name, frame_index):
+        self.boxes[:, 1::2] += self.speed
+        return (self.address, self.ids.copy(), np.ones(len(self.ids)),
+                self.boxes.astype(np.uint16), len(self.ids),
+                self.tracking / max(len(self.ids), 1))
+
+    def acknowledge(self, video_name, token):
+        return token
+
+#==========================================================================================
+# Yolo that detects 'objects' objects moving 'speed' pixels down on every frame
+#==========================================================================================
+
+class StubYolo(Stub):
+
+    def __init__(self, simulation, address, detection, objects, speed, frames, bboxes):
+        super().__init__(simulation, address)
+        self.detection = detection
+        self.frames = frames
+        self.bboxes = bboxes
+        rng = np.random.default_rng(0)
+        start = rng.integers(0, 600, (objects, 2))
+        self.boxes = np.hstack([start, start + 40])
+        self.speed = speed
+
+    def service_time(self, memo):
+        return self.detection
+
+    def find_bboxes(self, video_name, frame_index):
+        boxes = self.boxes.copy()
+        boxes[:, 1::2] += self.speed * self.frames.frame_numbers[frame_index]
+        records = np.zeros(len(boxes), dtype = MmapBboxes.record_dtype)
+        records['box'] = boxes
+        records['conf'] = 0.9
+        self.bboxes.records = records
+        return frame_index
+
+#==========================================================================================
+# Ring of frames where the next frame is always ready
+#==========================================================================================
+
+class StubFrames:
+
+    def __init__(self, depth):
+        self.buffer_max_size = depth
+        self.frame_numbers = [0] * depth
+        self._frame_number = 0
+        self.consumed = 0
+
+    def next_index(self, index):
+        return (index + 1) % self.buffer_max_size
+
+    def wait_frame(self, index, frame_number, timeout):
+        self._frame_number += 1
+        self.frame_numbers[index] = self._frame_number
+        return self._frame_number
+
+    def consume(self, index):
+        self.consumed += 1
+
+    def set_latency(self, latency):
+        pass
+
+    def published_index(self):
+        return -1
+
+    def stats(self):
+        return {'consumed': self.consumed}
+
+#==========================================================================================
+# Block of detections written by the stub Yolo
+#==========================================================================================
+
+class StubBboxes:
+
+    def __init__(self):
+        self.records = np.zeros(0, dtype = MmapBboxes.record_dtype)
+
+    def clear(self, buf):
+        self.records = np.zeros(0, dtype = MmapBboxes.record_dtype)
+
+    def read_detections(self, buf):
+        return self.records
+
+#==========================================================================================
+# The next frame is only processed after the detection of the current one
+#==========================================================================================
+
+class SequentialFlowManager(FlowManager):
+
+    def _next_frame(self):
+        if self._detection != None and not self._detection['done']:
+            self._detection['next_frame'] = True
+            return
+        super()._next_frame()
+
+    def boxes_detected(self, frame_index):
+        super().boxes_detected(frame_index)
+        if self._detection.get('next_frame', False):
+            super()._next_frame()
+
+# ---------------------------------------------------------------------------------
+# Runs 'frames' frames on a FlowManager of class 'klass' and returns the frame rate
+# and the number of items on the setting at the end
+# ---------------------------------------------------------------------------------
+
+def run(klass, args):
+    simulation = Simulation()
+
+    cfg = Config("config/defaults.json")
+    cfg.video_name = 'bench'
+    cfg.start_time = Util.br_time_raw()
+    cfg.minutes = 24 * 60
+    cfg.data['video_analyser']['skip_detection_frames'] = args['skip']
+
+    frames = StubFrames(8)
+    bboxes = StubBboxes()
+
+    trackers = {}
+    for i in range(args['trackers']):
+        name = 'tracker_' + str(i)
+        tracker = StubTracker(simulation, name, args['tracking'] / 1000, args['speed'])
+        simulation.add(name, tracker, tracker.service_time)
+        trackers[name] = (name, StubTracker)
+
+    yolo = StubYolo(simulation, 'yolo', args['detection'] / 1000, args['objects'],
+                    args['speed'], frames, bboxes)
+    simulation.add('yolo', yolo, yolo.service_time)
+
+    # the FlowManager as left by '__initialize__' and 'initialize_mmap'
+    fm = klass()
+    fm.send = lambda address, memo: simulation.send('flow_manager', address, memo)
+    fm.cfg = cfg
+    fm.video_name = cfg.video_name
+    fm.trackers = trackers
+    fm._yolo = 'yolo'
+    fm._last_detection = -args['skip']
+    fm._matcher = Matcher.create(cfg.data['trackable_objects'])
+    fm._placement = Placement.create(
+        cfg.data['placement']['policy'], list(trackers.keys()),
+        imbalance = cfg.data['placement']['imbalance'],
+        max_moves = cfg.data['placement']['max_moves'])
+    fm._mmap = frames
+    fm._mmap_bbox = bboxes
+    fm.bbox_buf = 0
+    fm._setting = Setting(cfg, frames.buffer_max_size)
+    simulation.add('flow_manager', fm, None)
+
+    simulation.run('flow_manager', 0.0, fm._process_frame)
+    simulation.loop(lambda: fm._total_frames > args['frames'])
+
+    return args['frames'] / simulation.now, len(fm._setting.items), frames.consumed
+
+if __name__ == '__main__':
+    import logging
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "-n", "--frames", type = int, default = 200,
+        help="number of frames to process")
+    ap.add_argument(
+        "-t", "--tracking", type = float, default = 15,
+        help="milliseconds for a tracker to track one frame")
+    ap.add_argument(
+        "-d", "--detection", type = float, default = 25,
+        help="milliseconds to detect objects on one frame")
+    ap.add_argument(
+        "-s", "--skip", type = int, default = 0,
+        help="frames skipped between detections ('skip_detection_frames')")
+    ap.add_argument(
+        "-k", "--trackers", type = int, default = 2,
+        help="number of trackers")
+    ap.add_argument(
+        "-o", "--objects", type = int, default = 20,
+        help="number of objects on every frame")
+    ap.add_argument(
+        "--speed", type = int, default = 2,
+        help="pixels the objects move on every frame")
+    args = vars(ap.parse_args())
+
+    logging.disable(logging.INFO)
+
+    results = {}
+    for name, klass in (('sequential', SequentialFlowManager),
+                        ('pipelined', FlowManager)):
+        results[name], items, consumed = run(klass, args)
+        print("%-10s: %8.2f fps, %8.2f ms per frame, %d items, %d frames consumed" %
+              (name, results[name], 1000 / results[name], items, consumed))
+
+    print("speedup   : %8.2fx" % (results['pipelined'] / results['sequential']))
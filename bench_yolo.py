@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+# Micro-benchmark of the per frame latency of Yolo detection: keras 'predict' (the
+# old path) against the compiled inference function (YoloV3Inference)
+
+if __name__ == '__main__':
+    import time
+    import argparse
+
+    import numpy as np
+    import cv2
+    import tensorflow as tf
+
+    from object_flow.nn.yolov3_tf2.models import YoloV3
+    from object_flow.nn.yolov3_tf2.models import YoloV3Inference
+    from object_flow.nn.yolov3_tf2.dataset import transform_images
+    from object_flow.nn.letterbox import Letterbox
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "-w", "--weights", default=None,
+        help="checkpoint with the yolo weights. Random weights if not given")
+    ap.add_argument(
+        "-n", "--frames", type = int, default = 50,
+        help="number of frames to run through each path")
+    ap.add_argument(
+        "-b", "--batch", type = int, default = 1,
+        help="number of frames in every call to the neural net")
+    args = vars(ap.parse_args())
+
+    yolo = YoloV3(classes=80)
+    if args['weights']:
+        yolo.load_weights(args['weights'])
+
+    inference = YoloV3Inference(yolo, 416)
+
+    # frames with the size produced by the video decoder
+    frames = np.random.randint(0, 255, size=(args['batch'], 281, 500, 3),
+                               dtype=np.uint8)
+
+    def predict_path():
+        imgs = [cv2.cvtColor(cv2.resize(frame, (416, 416)), cv2.COLOR_BGR2RGB)
+                for frame in frames]
+        imgs = transform_images(np.stack(imgs), 416)
+        return yolo.predict(imgs)
+
+    # preallocated input: frames are resized, converted and normalized in place
+    letterbox = Letterbox(500, 281, 416)
+    imgs = np.empty((args['batch'], 416, 416, 3), dtype=np.float32)
+
+    def compiled_path():
+        for b, frame in enumerate(frames):
+            letterbox.transform(frame, imgs[b])
+        return [output.numpy() for output in inference(imgs)]
+
+    for name, path in (('predict', predict_path), ('compiled', compiled_path)):
+        # warm up: first call traces the graph
+        path()
+
+        start = time.perf_counter()
+        for i in range(args['frames']):
+            path()
+        elapsed = time.perf_counter() - start
+
+        print("%-10s: %8.2f ms per call, %8.2f ms per frame" %
+              (name, elapsed * 1000 / args['frames'],
+               elapsed * 1000 / (args['frames'] * args['batch'])))
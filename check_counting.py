@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+# Regression check of the counting of the items crossing the counting lines.  Random
+# scenes (counting lines and items moving, turning back, appearing and leaving) are
+# replayed on three Settings:
+#   * a Setting that counts with the per item code that was replaced by the
+#     LineCounter ('ReferenceSetting' below)
+#   * a Setting that keeps the items as Item objects and counts with the LineCounter
+#   * a Setting that keeps the items on an ItemStore and counts with the LineCounter
+#
+# After every frame the counters of every line and the state of every item in
+# relation to every line must be the same on the three Settings.  Exits with an
+# error on the first difference
+
+import sys
+import copy
+import logging
+
+import numpy as np
+
+from object_flow.util.util import Util
+from object_flow.util.geom import Geom
+from object_flow.util.config import Config
+from object_flow.flow.item import Item
+from object_flow.flow.setting import Setting
+
+#==========================================================================================
+# Setting that counts the items one by one against every line, as it was done before
+# the LineCounter
+#==========================================================================================
+
+class ReferenceSetting(Setting):
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def _should_count(self, obj_line):
+
+        if (not obj_line['counted'] or
+            (self.cfg.frame_number > obj_line['counted_frame'] + 30)):
+            # once an object crosses the counting line it is no longer considered
+            # a split object
+            obj_line['split'] = False
+            obj_line['counted'] = True
+            obj_line['counted_frame'] = self.cfg.frame_number
+            return True
+
+        return False
+
+    # ---------------------------------------------------------------------------------
+    # Top line of the bounding box has crossed the counting line
+    # ---------------------------------------------------------------------------------
+
+    def _top_crossed(self, item, item_line, spec, new_top):
+        top_point = item_line['top_point']
+        first_point = spec['first_point']
+        second_point = spec['second_point']
+
+        if (not Geom.intersect(top_point[0], top_point[1], item.startX,
+                               item.startY, first_point[0], first_point[1],
+                               second_point[0], second_point[1])):
+            return
+
+        if (self._should_count(item_line)):
+            if new_top:
+                spec[spec["exit_side1"]] += 1
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def _has_top_crossed(self, item, key, spec, new_top):
+        item_line = item.lines[key]
+
+        if (spec['count_splits'] == 'True' and item_line['split'] == True and
+            item.dirY == 'South' and item_line['top_line_position'] != new_top):
+            self._top_crossed(item, item_line, spec, new_top)
+
+    # ---------------------------------------------------------------------------------
+    # Bottom line of the bounding box has crossed the counting line
+    # ---------------------------------------------------------------------------------
+
+    def _bottom_crossed(self, item, item_line, spec, new_bottom):
+        bottom_point = item_line['bottom_point']
+        first_point = spec['first_point']
+        second_point = spec['second_point']
+
+        if (not Geom.intersect(bottom_point[0], bottom_point[1], item.endX,
+                               item.endY, first_point[0], first_point[1],
+                               second_point[0], second_point[1])):
+            return
+
+        if (self._should_count(item_line)):
+            if not new_bottom:
+                spec[spec["enter_side1"]] += 1
+            else:
+                spec[spec["exit_side1"]] += 1
+
+    # ---------------------------------------------------------------------------------
+    # Checks if the bottom line has crossed the counting line and the direction was
+    # set
+    # ---------------------------------------------------------------------------------
+
+    def _has_bottom_crossed(self, item, key, spec, new_bottom):
+        item_line = item.lines[key]
+
+        if (item_line["bottom_line_position"] != new_bottom and
+            ((item.dirY != None) or (item.dirX != None))):
+            self._bottom_crossed(item, item_line, spec, new_bottom)
+
+    # ---------------------------------------------------------------------------------
+    # Position of the top and bottom lines of the bounding box in relation to a line
+    # ---------------------------------------------------------------------------------
+
+    def _find_positions(self, item, spec):
+
+        end_points = spec["end_points"]
+        new_top = self._position_item_line(end_points, item.startX, item.startY, 'top')
+        new_bottom = self._position_item_line(end_points, item.endX, item.endY, 'bottom')
+
+        return(new_top, new_bottom)
+
+    # ---------------------------------------------------------------------------------
+    # Count the items crossing the 'counting lines', one item and line at a time
+    # ---------------------------------------------------------------------------------
+
+    def _count(self):
+
+        for key, spec in self.cfg.data["counting_lines"].items():
+            for item_id, item in self.items.items():
+                new_top, new_bottom = self._find_positions(item, spec)
+
+                if (item.lines[key]['bottom_line_position'] != None):
+                    self._has_bottom_crossed(item, key, spec, new_bottom)
+                    self._has_top_crossed(item, key, spec, new_top)
+                else:
+                    if new_top != new_bottom:
+                        item.lines[key]['split'] = True
+
+                item.lines[key]['top_line_position'] = new_top
+                item.lines[key]["bottom_line_position"] = new_bottom
+
+# ---------------------------------------------------------------------------------
+# Configuration with 'num_lines' random counting lines
+# ---------------------------------------------------------------------------------
+
+def scene_config(rng, num_lines, item_store):
+    cfg = Config("config/defaults.json")
+    cfg.video_name = 'check'
+    cfg.start_time = Util.br_time_raw()
+    cfg.minutes = 24 * 60
+    cfg.frame_number = 0
+    cfg.data['trackable_objects']['item_store'] = 'True' if item_store else 'False'
+    cfg.data['entry_lines'] = {}
+
+    lines = {}
+    for i in range(num_lines):
+        lines['line_' + str(i)] = {
+            "end_points": rng.integers(0, 640, 4).tolist(),
+            "side1": 'Positive' if rng.random() < 0.5 else 'Negative',
+            "count_splits": 'True' if rng.random() < 0.5 else 'False'}
+    cfg.data['counting_lines'] = lines
+
+    return cfg
+
+# ---------------------------------------------------------------------------------
+# State of the items of the setting in relation to the lines, one (N, L) array of
+# every state for the items with the given ids
+# ---------------------------------------------------------------------------------
+
+def lines_state(setting, ids):
+    if setting._store != None:
+        rows = setting._store.rows(ids)
+        return {name: getattr(setting._store, name)[rows]
+                for name in ('top_position', 'bottom_position', 'counted_frame',
+                             'split', 'counted')}
+
+    state = setting._lines_state([setting.items[item_id] for item_id in ids])
+    del state['top_point'], state['bottom_point']
+    return state
+
+# ---------------------------------------------------------------------------------
+# Replays a random scene on the three settings and returns the number of items
+# counted, or the first difference found
+# ---------------------------------------------------------------------------------
+
+def check_scene(seed, args):
+    rng = np.random.default_rng(seed)
+    lines_rng = copy.deepcopy(rng)
+
+    settings = {
+        'reference': ReferenceSetting(scene_config(rng, args['lines'], False), 8),
+        'dict': Setting(scene_config(copy.deepcopy(lines_rng), args['lines'], False), 8),
+        'item_store': Setting(scene_config(copy.deepcopy(lines_rng), args['lines'],
+                                           True), 8)}
+
+    # position, size and velocity of every item
+    boxes = {}
+    velocity = {}
+    next_id = 0
+
+    for frame_number in range(1, args['frames'] + 1):
+        for setting in settings.values():
+            setting.cfg.frame_number = frame_number
+
+        # new items
+        for i in range(rng.poisson(args['spawn'])):
+            start = rng.integers(0, 560, 2)
+            boxes[next_id] = np.concatenate([start, start + rng.integers(20, 80, 2)])
+            velocity[next_id] = rng.integers(-8, 9, 2)
+            for setting in settings.values():
+                item = Item(*boxes[next_id].tolist())
+                item.item_id = next_id
+                for key in setting.cfg.data['counting_lines']:
+                    item.init_lines(key, frame_number)
+                setting.add_item(next_id, item)
+            next_id += 1
+
+        # items leaving the scene or turning back
+        for item_id in list(boxes.keys()):
+            if (boxes[item_id] < 0).any() or (boxes[item_id] > 640).any():
+                del boxes[item_id], velocity[item_id]
+                for setting in settings.values():
+                    setting.remove_item(item_id)
+            elif rng.random() < args['turn']:
+                velocity[item_id] = -velocity[item_id]
+
+        ids = np.array(list(boxes.keys()), dtype = np.int64)
+        if len(ids) == 0:
+            continue
+
+        for item_id in ids.tolist():
+            boxes[item_id] = boxes[item_id] + np.tile(velocity[item_id], 2)
+
+        tracked = np.array([boxes[item_id] for item_id in ids.tolist()],
+                           dtype = np.int64).clip(0, 640)
+        confidences = np.ones(len(ids))
+        for setting in settings.values():
+            setting.update_items(frame_number, ids, confidences, tracked)
+            setting._count()
+
+        # compare with the reference
+        reference = settings['reference']
+        counters = [(spec['counter1'], spec['counter2'])
+                    for spec in reference.cfg.data['counting_lines'].values()]
+        state = lines_state(reference, ids.tolist())
+
+        for name, setting in settings.items():
+            other = [(spec['counter1'], spec['counter2'])
+                     for spec in setting.cfg.data['counting_lines'].values()]
+            if other != counters:
+                return "seed %d frame %d: %s counters %s, reference %s" % (
+                    seed, frame_number, name, other, counters)
+
+            other = lines_state(setting, ids.tolist())
+            for key in state:
+                if not np.array_equal(state[key].astype(np.int64),
+                                      other[key].astype(np.int64)):
+                    return "seed %d frame %d: %s differs on '%s'" % (
+                        seed, frame_number, name, key)
+
+    return sum(sum(counter) for counter in counters)
+
+if __name__ == '__main__':
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "-s", "--seeds", type = int, default = 10,
+        help="number of random scenes")
+    ap.add_argument(
+        "-n", "--frames", type = int, default = 300,
+        help="number of frames of every scene")
+    ap.add_argument(
+        "-l", "--lines", type = int, default = 4,
+        help="number of counting lines")
+    ap.add_argument(
+        "--spawn", type = float, default = 1.0,
+        help="average number of items appearing on every frame")
+    ap.add_argument(
+        "--turn", type = float, default = 0.02,
+        help="probability of an item turning back on every frame")
+    args = vars(ap.parse_args())
+
+    logging.disable(logging.INFO)
+
+    total = 0
+    for seed in range(args['seeds']):
+        result = check_scene(seed, args)
+        if isinstance(result, str):
+            print("FAILED: " + result)
+            sys.exit(1)
+        print("seed %3d: %6d items counted" % (seed, result))
+        total += result
+
+    print("ok: %d items counted on %d scenes" % (total, args['seeds']))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import logging
+
+#==========================================================================================
+# RateController decides which of the captured frames of a camera are written on the
+# frames ring, so that the end-to-end latency (time between the capture of a frame
+# and the end of its processing) stays close to a target.
+#
+# The latency is estimated from the ring occupancy (frames waiting to be processed)
+# and the time the FlowManager takes to process one frame.  The fraction of frames
+# that are kept ('keep_ratio') is the rate the pipeline can sustain, corrected by
+# how far the estimated latency is from the target.  Drops are spread evenly by a
+# fractional accumulator: with a keep_ratio of 0.4, two out of every five frames are
+# kept, never five in a row and then nothing.
+#==========================================================================================
+
+class RateController:
+
+    # target latency in seconds used when the configured one is not valid
+    default_target_latency = 1.0
+
+    # ---------------------------------------------------------------------------------
+    # @param target_latency [Float] target end-to-end latency in seconds
+    # @param min_keep_ratio [Float] the controller never keeps less than this
+    # fraction of the frames
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, target_latency, min_keep_ratio = 0.05, gain = 0.5):
+        # the latency error is relative to the target, which must be positive
+        if target_latency <= 0:
+            logging.warning("Invalid target latency %s seconds, using %s seconds",
+                            target_latency, RateController.default_target_latency)
+            target_latency = RateController.default_target_latency
+            
+        self.target_latency = target_latency
+        self.min_keep_ratio = min_keep_ratio
+        self.gain = gain
+
+        self.keep_ratio = 1.0
+        self.latency = 0.0
+        self._accumulator = 0.0
+
+        # frames kept and dropped since the last call to 'stats'
+        self.kept = 0
+        self.dropped = 0
+
+    # ---------------------------------------------------------------------------------
+    # Updates the keep ratio from the measurements of the pipeline.
+    # @param occupancy [Integer] frames waiting on the ring
+    # @param frame_latency [Float] seconds the FlowManager takes per frame
+    # @param fps [Float] capture rate of the camera
+    # ---------------------------------------------------------------------------------
+
+    def update(self, occupancy, frame_latency, fps):
+        if frame_latency <= 0 or fps <= 0:
+            return self.keep_ratio
+
+        # every frame waiting on the ring will take 'frame_latency' to be processed
+        self.latency = (occupancy + 1) * frame_latency
+
+        # fraction of the captured frames that the pipeline can process
+        sustainable = min(1.0, 1.0 / (fps * frame_latency))
+
+        # correct it by the latency error: keep less frames while latency is above
+        # the target and more while it is below
+        error = (self.target_latency - self.latency) / self.target_latency
+        ratio = sustainable * (1.0 + self.gain * error)
+
+        # smooth the changes of the ratio
+        ratio = 0.8 * self.keep_ratio + 0.2 * ratio
+        self.keep_ratio = max(self.min_keep_ratio, min(1.0, ratio))
+
+        return self.keep_ratio
+
+    # ---------------------------------------------------------------------------------
+    # True if the next captured frame should be kept
+    # ---------------------------------------------------------------------------------
+
+    def keep(self):
+        self._accumulator += self.keep_ratio
+        if self._accumulator >= 1.0:
+            self._accumulator -= 1.0
+            self.kept += 1
+            return True
+        self.dropped += 1
+        return False
+
+    # ---------------------------------------------------------------------------------
+    # State of the controller and frames kept and dropped since the last call.  The
+    # counters restart on every call
+    # ---------------------------------------------------------------------------------
+
+    def stats(self):
+        stats = {'keep_ratio': self.keep_ratio,
+                 'latency': self.latency,
+                 'target_latency': self.target_latency,
+                 'kept': self.kept,
+                 'dropped': self.dropped}
+        self.kept = 0
+        self.dropped = 0
+        return stats
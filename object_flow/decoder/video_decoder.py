@@ -18,6 +18,7 @@ import math
 import collections
 from urllib.parse import urlparse
 import time
+import threading
 from datetime import timedelta
 
 import cv2
@@ -27,7 +28,7 @@ from imutils.video import FPS
 import imutils
 
 from object_flow.ipc.doer import Doer
-from object_flow.decoder.drum_beat import DrumBeat
+from object_flow.decoder.rate_controller import RateController
 from object_flow.util.mmap_frames import MmapFrames
 
 #==========================================================================================
@@ -36,6 +37,13 @@ from object_flow.util.mmap_frames import MmapFrames
 
 class VideoDecoder(Doer):
 
+    # seconds the decoder thread waits when the ring is full
+    ring_full_wait = 0.005
+
+    # maximum seconds the decoder thread waits before opening again a stream that
+    # failed.  The wait starts at one frame period and doubles on every failure
+    reopen_max_wait = 5.0
+
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -51,10 +59,13 @@ class VideoDecoder(Doer):
         self._listeners = {}
 
         self._frame_number_buffer = collections.deque()
-        self._drop_frames = False
                 
         self._stream = None
         self._capture_average = None
+
+        # thread decoding ahead of the pipeline, if this mode was selected
+        self._decoder_thread = None
+        self._decoding = False
         
         # TODO: filter initialization should be done in another way... This does not
         # allow for channing filters which would be ideal
@@ -64,11 +75,12 @@ class VideoDecoder(Doer):
     #
     # ----------------------------------------------------------------------------------
 
-    def __initialize__(self, video_name, path, buffer_max_size, width=500):
+    def __initialize__(self, video_name, path, memory_budget, buffer_seconds, width=500,
+                       mmap_backend = 'file', decode_ahead = False,
+                       target_latency = 1000, min_keep_ratio = 0.05):
         
         self.path = path
         self.video_name = video_name
-        self._buffer_max_size = buffer_max_size
         self.scaled_width = width
                 
         # initialize the time counter
@@ -79,28 +91,55 @@ class VideoDecoder(Doer):
         self._open()
         self.frame_size = self.height * self.width * self.depth
 
-        self._mmap = MmapFrames(self.video_name, self.width, self.height, self.depth)
+        # the ring holds at most 'buffer_seconds' of video and fits in the memory
+        # budget of the camera
+        self._buffer_max_size = MmapFrames.ring_depth(self.frame_size, self.fps,
+                                                      memory_budget, buffer_seconds)
+        logging.info("%s: frames ring with %d frames (%d MB)", self.video_name,
+                     self._buffer_max_size,
+                     self._buffer_max_size * self.frame_size // (1024 * 1024))
+
+        self._mmap = MmapFrames(self.video_name, self.width, self.height, self.depth,
+                                mmap_backend, self._buffer_max_size)
         self._mmap.open_write()
         self._mmap.set0()
-        
-        # start the drum_beat process
-        self._drum_beat_address = self.hire(
-            'DrumBeat', DrumBeat, self.video_name, timedelta(milliseconds=30),
-            group = 'drum_beat')
+
+        # live cameras drop frames to keep the latency close to 'target_latency'
+        # milliseconds.  Video files are never dropped: decoding waits for the
+        # pipeline instead
+        self._controller = RateController(target_latency / 1000, min_keep_ratio)
+
+        # frame period of the camera
+        self._beat_period = 1 / MmapFrames.valid_fps(self.fps)
+
+        if decode_ahead:
+            # a thread of this process owns the stream and decodes continuously
+            logging.info("%s: decoding ahead in a separate thread", self.video_name)
+            self._decoding = True
+            self._decoder_thread = threading.Thread(
+                target = self._decode_ahead, name = self.video_name + "_decoder",
+                daemon = True)
+            self._decoder_thread.start()
+        else:
+            # the decoder beats its own drum: a timer of this actor captures a frame
+            # every frame period of the camera
+            self._next_beat = time.perf_counter()
+            logging.info("%s: capturing a frame every %.1f milliseconds",
+                         self.video_name, self._beat_period * 1000)
+            self.wakeup()
         
     # ----------------------------------------------------------------------------------
-    #
+    # The decoder created the frames ring, so it also removes it
     # ----------------------------------------------------------------------------------
 
-    def __hired__(self, hiree_name, hiree_group, hiree_address):
-        if hiree_group == 'drum_beat':
-            logging.info("%s: Drum beat hired", self.video_name)
-
-            # starts the drum_beat.  DrumBeat call 'capture_next_frame' for
-            # every listener
-            self.post(self._drum_beat_address, 'add_listener', self.video_name,
-                      self.myAddress)
-            
+    def terminate(self):
+        super().terminate()
+        if self._decoder_thread != None:
+            self._decoding = False
+            self._decoder_thread.join()
+        self._mmap.close()
+        self._mmap.unlink()
+        
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -151,60 +190,46 @@ class VideoDecoder(Doer):
     #
     # ----------------------------------------------------------------------------------
 
-    def manage_buffer(self, processing_average):
-        if (processing_average != None and self._capture_average != None):
-            per_diff = int(math.ceil(processing_average / self._capture_average))
-            logging.debug("%s: speed difference is %d", self.video_name,
-                          per_diff)
-            if per_diff > 2:
-                self._drop_frames = True
-                self._drop_by = per_diff
-                
+    # CALLBACK METHODS
+
     # ----------------------------------------------------------------------------------
-    #
+    # Drum beat: captures a frame and schedules the next beat.  Beats are scheduled
+    # on a fixed grid of frame periods, so that the time spent capturing does not
+    # slow down the beat
     # ----------------------------------------------------------------------------------
 
-    # CALLBACK METHODS
+    def wakeup(self):
+        self.capture_next_frame()
 
+        now = time.perf_counter()
+        self._next_beat += self._beat_period
+        # we are late by more than one beat: do not try to catch up
+        if self._next_beat < now:
+            self._next_beat = now
+        self.wakeupAfter(timedelta(seconds = self._next_beat - now))
+        
     # ----------------------------------------------------------------------------------
-    # This method is called by drum_beat.  DrumBeat conducts the capturing of frames.
-    # When working with video files, DrumBeat will delay frame capturing to the
-    # processing rate. With life files, DrumBeat will beat at 30 frames per second.
+    # Captures the next frame of the stream.  When working with video files,
+    # frames are only captured if there is room on the ring, so capturing is delayed
+    # to the processing rate.  With live files, a frame is captured every beat
     # ----------------------------------------------------------------------------------
 
     def capture_next_frame(self):
-        # (grabbed, frame) = self._stream.read()
+        # video files are decoded at the pace of the pipeline: skip this beat if
+        # there is no room on the ring
+        if not self.live_cam and not self._mmap.can_write():
+            return
+        
         grabbed = self._stream.grab()
-        (grabbed, frame) = self._stream.retrieve()
         self.frame_number += 1
        
         if not grabbed:
             logging.warning("%s: could not grab video stream", self.video_name)
             self._open()
         else:
-            # resize image
-            frame = cv2.resize(frame, self.dim, interpolation = cv2.INTER_AREA)
-            
-            if self._adjust_gamma:
-                frame = cv2.LUT(frame, self._gamma_table)
-
-            if self.frame_number % 100 == 0:
-                now = time.perf_counter()
-                self._capture_average = (now - self.init_time) / 100
-                logging.debug(
-                    "%s: buffer size is %d", self.video_name, len(self._frame_number_buffer))
-                logging.debug(
-                    "%s: average time video capture per frame for the last 100 frames is: %f",
-                    self.video_name, self._capture_average)
-                self.init_time = now
-
-            if (self._drop_frames):
-                if ((self.frame_number % self._drop_by) == 0):
-                    logging.info("%s: adding frame %d", self.video_name,
-                                 self.frame_number)
-                    self._mmap.write_frame(frame, self.frame_number)
-            else:
-                self._mmap.write_frame(frame, self.frame_number)
+            self._capture_statistics()
+            if self._keep_frame():
+                self._add_to_mmap()
                 
     # ----------------------------------------------------------------------------------
     #
@@ -213,12 +238,106 @@ class VideoDecoder(Doer):
     # PRIVATE METHODS
 
     # ----------------------------------------------------------------------------------
-    # adds a frame to the rear of the mmap file
+    # Body of the decoder thread.  Frames are grabbed continuously, but only retrieved
+    # (decoded and converted) when they are going to be written on the ring.  For
+    # live cameras the stream never gets stale: frames that do not fit in the ring
+    # are grabbed and dropped.  For video files no frame is dropped: decoding waits
+    # for a free slot, so it runs as fast as the pipeline consumes frames
+    # ----------------------------------------------------------------------------------
+
+    def _decode_ahead(self):
+        reopen_wait = self._beat_period
+        
+        while self._decoding:
+            try:
+                if not self.live_cam and not self._mmap.can_write():
+                    time.sleep(VideoDecoder.ring_full_wait)
+                    continue
+            
+                grabbed = self._stream.grab()
+                self.frame_number += 1
+
+                if not grabbed:
+                    logging.warning("%s: could not grab video stream, opening again in "
+                                    "%.2f seconds", self.video_name, reopen_wait)
+                    time.sleep(reopen_wait)
+                    reopen_wait = min(2 * reopen_wait, VideoDecoder.reopen_max_wait)
+                    self._open()
+                    continue
+
+                reopen_wait = self._beat_period
+                self._capture_statistics()
+                if self._keep_frame():
+                    self._add_to_mmap()
+
+            # the thread should not die silently, the flow manager would wait for
+            # frames forever
+            except Exception:
+                logging.exception("%s: error on the decoder thread, retrying in %.2f "
+                                  "seconds", self.video_name, reopen_wait)
+                time.sleep(reopen_wait)
+                reopen_wait = min(2 * reopen_wait, VideoDecoder.reopen_max_wait)
+        
+    # ----------------------------------------------------------------------------------
+    # Every 100 frames logs the average capture time
+    # ----------------------------------------------------------------------------------
+
+    def _capture_statistics(self):
+        if self.frame_number % 100 == 0:
+            now = time.perf_counter()
+            self._capture_average = (now - self.init_time) / 100
+            logging.debug(
+                "%s: average time video capture per frame for the last 100 frames is: %f",
+                self.video_name, self._capture_average)
+            logging.debug("%s: frames ring %s", self.video_name, self._mmap.stats())
+            if self.live_cam:
+                logging.info("%s: rate control %s", self.video_name,
+                             self._controller.stats())
+            self.init_time = now
+
+    # ----------------------------------------------------------------------------------
+    # True if the frame just grabbed should be written on the ring.  For live cameras
+    # the rate controller is updated with the ring occupancy and the processing
+    # latency reported by the flow_manager, and decides if the frame is kept
+    # ----------------------------------------------------------------------------------
+
+    def _keep_frame(self):
+        if not self.live_cam:
+            return True
+
+        keep_ratio = self._controller.update(self._mmap.occupancy(), self._mmap.latency(),
+                                             MmapFrames.valid_fps(self.fps))
+        self._mmap.set_keep_ratio(keep_ratio)
+
+        if self._controller.keep():
+            return True
+
+        self._mmap.count_dropped()
+        return False
+                
+    # ----------------------------------------------------------------------------------
+    # adds the frame just grabbed to the rear of the mmap file.  The frame is only
+    # retrieved if there is a free slot and is resized (and filtered) directly into
+    # the slot.  If the ring is full the frame is dropped without being decoded
     # ----------------------------------------------------------------------------------
 
-    def _add_to_mmap(self, frame):
-        if self._mmap.write_frame(frame) != 0:
-            self._frame_number_buffer.append((self.frame_number, size))
+    def _add_to_mmap(self):
+        frame_index = self._mmap.claim()
+        if frame_index == -1:
+            return
+
+        (retrieved, frame) = self._stream.retrieve()
+        if not retrieved:
+            self._mmap.cancel(frame_index)
+            return
+        
+        slot = self._mmap.writable_frame_view(frame_index)
+        cv2.resize(frame, self.dim, dst = slot, interpolation = cv2.INTER_AREA)
+            
+        if self._adjust_gamma:
+            cv2.LUT(slot, self._gamma_table, dst = slot)
+
+        self._mmap.publish(frame_index, self.frame_number)
             
     # ----------------------------------------------------------------------------------
     # 'remove' frame from mmap file
@@ -254,8 +373,8 @@ class VideoDecoder(Doer):
             self._stream.release()
 
         # check if the path has a schema such as 'rtsp', if if does, this is a
-        # live_cam and we cannot reduce the drum_beat.  If not a live_cam, the
-        # we should reduce the drum_beat to match the processing speed.
+        # live_cam and we cannot slow down capturing.  If not a live_cam, then
+        # capturing should follow the processing speed.
         url_parse = urlparse(self.path)
         if (url_parse.scheme == ''):
             self.live_cam = False
@@ -265,7 +384,8 @@ class VideoDecoder(Doer):
         self._stream = cv2.VideoCapture(self.path)
 
         if not self._stream.isOpened():
-            logging.warning("Could not open video stream %s on path %s", video_name, self.path)
+            logging.warning("Could not open video stream %s on path %s", self.video_name,
+                            self.path)
         else:
             logging.info("Starting decoding video %s in path %s", self.video_name, self.path)
             
@@ -18,20 +18,21 @@ import mmap
 import math
 
 import time
+import copy
 import collections
 
 import logging
 import numpy as np
-import random
 
 from object_flow.ipc.doer import Doer
 from object_flow.util.display import Display
-from object_flow.util.geom import Geom
 from object_flow.util.stopwatch import Stopwatch
 
 from object_flow.decoder.video_decoder import VideoDecoder
 from object_flow.flow.item import Item
 from object_flow.flow.setting import Setting
+from object_flow.flow.placement import Placement
+from object_flow.flow.matcher import Matcher
 from object_flow.util.mmap_frames import MmapFrames
 from object_flow.util.mmap_bboxes import MmapBboxes
 
@@ -57,9 +58,6 @@ class FlowManager(Doer):
         # id of the next item
         self.next_item_id = 0
 
-        # number of frames that can be stored in the mmaped file
-        self._buffer_max_size = 500
-
         # list of listeners interested to get a message everytime a new frame is
         # loaded
         self._listeners = {}
@@ -69,6 +67,22 @@ class FlowManager(Doer):
 
         self.frame_index = 0
 
+        # detection running on Yolo: frame and version of the items
+        self._detection = None
+        # True when tracking of the current frame is done but the frame cannot move
+        # on before the detections of the previous frame arrive
+        self._waiting_detection = False
+        # processed frames that are not yet consumed
+        self._retired = []
+        # retired frames waiting for the trackers to acknowledge them: number of
+        # trackers that have not acknowledged yet and frames, by token
+        self._acknowledging = {}
+        self._acknowledge_token = 0
+
+        # moving average of the time in seconds to process one frame
+        self._frame_latency = 0.0
+        self._frame_start = time.perf_counter()
+
     # ----------------------------------------------------------------------------------
     # 
     # ----------------------------------------------------------------------------------
@@ -85,17 +99,34 @@ class FlowManager(Doer):
         self.path = cfg.data['io']['input']
 
         self._last_detection = -self.cfg.data['video_analyser']['skip_detection_frames']
+
+        # matches detections with tracked items
+        self._matcher = Matcher.create(self.cfg.data['trackable_objects'])
+        
+        # policy for placing the items of this video on the trackers
+        self._placement = Placement.create(
+            self.cfg.data['placement']['policy'], list(self.trackers.keys()),
+            imbalance = self.cfg.data['placement']['imbalance'],
+            max_moves = self.cfg.data['placement']['max_moves'])
         
         logging.info("%s: initializing flow_manager with %s", self.video_name,
                      self.path)
 
         # hire a new video decoder named 'self.video_name'
         self.vd = self.hire(self.video_name, VideoDecoder, self.video_name,
-                            self.path, buffer_max_size = self._buffer_max_size,
+                            self.path, self.cfg.frame_memory_budget,
+                            self.cfg.frame_buffer_seconds,
+                            mmap_backend = self.cfg.mmap_backend,
+                            decode_ahead = (
+                                self.cfg.data['video_decoder']['decode_ahead'] == 'True'),
+                            target_latency = (
+                                self.cfg.data['video_decoder']['target_latency']),
+                            min_keep_ratio = (
+                                self.cfg.data['video_decoder']['min_keep_ratio']),
                             group = 'decoders')
 
         # open the mmap file for communicating bounding boxes with yolo
-        self._mmap_bbox = MmapBboxes()
+        self._mmap_bbox = MmapBboxes(self.cfg.mmap_backend)
         # open the mmap file for writing
         self.bbox_buf = self._mmap_bbox.open_write(self.video_name, self.video_id)
 
@@ -179,6 +210,11 @@ class FlowManager(Doer):
     def remove_listener(self, name):
         logging.info("listener %s removed from flow_manager %s", name, self.video_name)
         del self._listeners[name]
+
+        # the listener will not release the frame published to it
+        published = self._mmap.published_index()
+        if len(self._listeners) == 0 and published != -1:
+            self._mmap.release(published, MmapFrames.DISPLAY_READER)
         
     # ----------------------------------------------------------------------------------
     # 
@@ -206,11 +242,12 @@ class FlowManager(Doer):
                    self.width, self.height, self.depth, callback = 'register_done')
         
         # open the mmap file with the decoded frames
-        self._mmap = MmapFrames(self.video_name, self.width, self.height, self.depth)
+        self._mmap = MmapFrames(self.video_name, self.width, self.height, self.depth,
+                                self.cfg.mmap_backend)
         self._mmap.open_write2()
         
         self._fix_dimensions()
-        self._setting = Setting(self.cfg, self._buffer_max_size)
+        self._setting = Setting(self.cfg, self._mmap.buffer_max_size)
         
         # register the video with all trackers.  Need to wait for the registration
         # to be done to continues execution
@@ -251,38 +288,24 @@ class FlowManager(Doer):
                     
     # ----------------------------------------------------------------------------------
     # When tracking is done, the trackers calls back this method with the updated
-    # items information
+    # items information: the ids of the items tracked by the tracker, their
+    # confidences and an array with one bounding box per item.  The tracker also
+    # reports its load: total number of items and seconds to update one item
     # ----------------------------------------------------------------------------------
 
-    def tracking_done(self, items_update):
+    def tracking_done(self, tracker, ids, confidences, boxes, num_items, item_latency):
+
+        self._placement.report(tracker, num_items, item_latency)
         
-        if not (items_update == None):
-            self._total_tracked += len(items_update)
+        if len(ids) > 0:
+            self._total_tracked += len(ids)
             
-            del_items = []
-            for item_id, update in items_update.items():
-                confidence = update[0]
-                bounding_box = update[1]
-
-                # check if item has exited the scene
-                if confidence == -1:
-                    exit = True
-                else:
-                    # check and remove all bounding boxes that have exited the setting.
-                    # Those that have not exited, should be updated
-                    exit = self._setting.check_exit(bounding_box)
-
-                # if item exited the scene, remove it from the scene and stop tracking
-                # otherwise, update its bounding box location
-                if exit:
-                    del_items.append(item_id)
-                else:
-                    self._setting.update_item(self.cfg.frame_number, item_id, confidence,
-                                              bounding_box)
-                self._remove_items(del_items)
-
-        # are all trackers done? If all done then we can call the
-        # detection phase
+            # update the items and remove those that have exited the scene
+            del_items = self._setting.update_items(self.cfg.frame_number, ids,
+                                                   confidences, boxes)
+            self._remove_items(del_items)
+
+        # are all trackers done? If all done then the frame can move on
         self.num_trackers -= 1
         if self.num_trackers < 1:
             Stopwatch.stop('tracking')
@@ -290,59 +313,39 @@ class FlowManager(Doer):
             logging.debug("%s: total items is %d; total tracked is %d", self.video_name,
                           self._total_items, self._total_tracked)
             
-            # update the setting
-            self._setting.update()
-
-            # start the detection phase
-            self._detection_phase()
+            self._tracking_finished()
             
     # ----------------------------------------------------------------------------------
-    # Callback method for the 'find_bboxes' call to the Neural Net.  This callback is
-    # registered by method 'process_frame'.
+    # Callback method for the 'find_bboxes' call to the Neural Net, registered by
+    # '_start_detection'.  Yolo replies when the detections of the frame at
+    # 'frame_index' are written on the mmap file.  If tracking of the current frame
+    # is done, the loop was waiting for them to move on
     # ----------------------------------------------------------------------------------
 
-    def boxes_detected(self):
-
-        boxes = []
-        confidences = []
-        classIDs = []
-        
-        # loop until Yolo has finished processing
-        detections = -1
-        while detections == -1:
-            # read the number of detect objects
-            self._mmap_bbox.set_base_address(self.bbox_buf, self.video_id)
-            # detections is an array with 1 element of size np.int32
-            detections = self._mmap_bbox.read_data(self.bbox_buf, 1, np.int32)
+    def boxes_detected(self, frame_index):
 
         Stopwatch.stop('Yolo')
+        self._detection['done'] = True
 
-        logging.debug("%s: number of objects detected: %d", self.video_name,
-                      detections[0])
-
-        # read all the detected objects
-        self._mmap_bbox.set_detection_address(self.bbox_buf, self.video_id)
-        for i in range(detections[0]):
-            box = self._mmap_bbox.read_data(self.bbox_buf, 4, np.int32)
-            confidence = self._mmap_bbox.read_data(self.bbox_buf, 1, np.float)
-            classID = self._mmap_bbox.read_data(self.bbox_buf, 1, np.uint16)
-            
-            boxes.append(box)
-            confidences.append(confidence)
-            classIDs.append(classID)
-            
-            logging.debug("%s: reading mmap file - bbox %s confidence %s classID: %s",
-                          self.video_name, box, confidence, classID)
-            
-        # convert the detected bounding boxes to Items
-        self._setting.detections2items(boxes, confidences, classIDs)
+        if self._waiting_detection:
+            self._waiting_detection = False
+            self._advance()
         
-        # add the newly detected items to the setting. This method will match the
-        # already tracked items with the newly detected ones, adding only the
-        # relevant items
-        self._add_items()
+    # ----------------------------------------------------------------------------------
+    # Callback method for the 'acknowledge' call to the trackers, registered by
+    # '_acknowledge_retired'.  When all trackers have acknowledged 'token', the
+    # frames retired before it can be consumed
+    # ----------------------------------------------------------------------------------
 
-        self._next_frame()
+    def retired_acknowledged(self, token):
+
+        pending = self._acknowledging[token]
+        pending['trackers'] -= 1
+        
+        if pending['trackers'] == 0:
+            del self._acknowledging[token]
+            for frame_index in pending['frames']:
+                self._mmap.consume(frame_index)
         
     # ----------------------------------------------------------------------------------
     # 
@@ -355,23 +358,35 @@ class FlowManager(Doer):
     # ----------------------------------------------------------------------------------
 
     def _process_frame(self):
-        # self.post(self.vd, 'manage_buffer', self._average)
 
         Stopwatch.start('process')
         
-        self.frame_index += 1
-        if self.frame_index == self._buffer_max_size - 1:
-            self.frame_index = 0
+        self.frame_index = self._mmap.next_index(self.frame_index)
+        self._wait_frame()
 
-        fn = 0
-        while fn == 0 or fn < self.cfg.frame_number:
-            fn = self._mmap.read_header(self.frame_index)
+    # ----------------------------------------------------------------------------------
+    # Waits for the decoder to write the frame at 'frame_index'.  The wait is done
+    # with a timeout: if the frame is not yet available, we post a message to
+    # ourselves to try again, so that other messages (stop_playback, add_listener,
+    # etc.) can be processed in the meantime
+    # ----------------------------------------------------------------------------------
 
+    def _wait_frame(self):
+        
+        fn = self._mmap.wait_frame(
+            self.frame_index, self.cfg.frame_number,
+            self.cfg.data['video_analyser']['frame_wait_timeout'])
+
+        if fn == 0:
+            self.post(self.myAddress, '_wait_frame')
+            return
+        
         # if (self.video_name == 'cshopp1'):
         #     logging.warning("%s: processing index %d with frame number: %d",
         #                     self.video_name, self.frame_index, fn)
             
         self.cfg.frame_number = fn
+        self._frame_start = time.perf_counter()
         
         logging.debug("******index %d: reading frame number %d ********",
                      self.frame_index, fn)
@@ -419,65 +434,192 @@ class FlowManager(Doer):
         # detection_phase directly
         else:
             logging.info("+++++++++++++++This should not be printed in this config++++++++++")
-            self._detection_phase()
+            # there was no tracking round, trackers might still have messages for
+            # the retired frames
+            self._acknowledge_retired()
+            self._advance()
 
     # ----------------------------------------------------------------------------------
-    # 
+    # The frame was tracked.  Processing is pipelined: detection of a frame runs on
+    # Yolo while the next frame is being tracked
+    # ----------------------------------------------------------------------------------
+
+    def _tracking_finished(self):
+
+        # trackers reply to messages in order, so they are done with all the frames
+        # retired before this tracking round: those slots can be reused.  Only
+        # called after a tracking round
+        self._consume_retired()
+        self._advance()
+
     # ----------------------------------------------------------------------------------
+    # First the detections of the previous frame, if any, are merged, then detection
+    # of this frame is started, if needed, and we move on to the next frame without
+    # waiting for Yolo.  If Yolo is not done with the previous frame, we return and
+    # 'boxes_detected' calls this method again when the detections arrive, so that
+    # the actor keeps processing other messages in the meantime
+    # ----------------------------------------------------------------------------------
+
+    def _advance(self):
 
-    def _detection_phase(self):
+        if self._detection != None:
+            if not self._detection['done']:
+                self._waiting_detection = True
+                return
+            self._merge_detections()
         
-        # do detection on the frame
-        if (self.cfg.frame_number >
-            self._last_detection + self.cfg.data['video_analyser']['skip_detection_frames']):
-            self._last_detection = self.cfg.frame_number
-            logging.debug("%s: calling Yolo for frame %d", self.video_name,
-                         self._total_frames)
+        # update the setting
+        self._setting.update()
+
+        # items are on their position on this frame, they can be moved to other
+        # trackers starting on it
+        self._rebalance()
+        
+        if self._detection_due():
+            self._start_detection()
+        else:
+            self._retire_frame(self.frame_index)
+
+        self._next_frame()
+
+    # ----------------------------------------------------------------------------------
+    # Detection is done every 'skip_detection_frames'
+    # ----------------------------------------------------------------------------------
+
+    def _detection_due(self):
+        return (self.cfg.frame_number >
+                self._last_detection +
+                self.cfg.data['video_analyser']['skip_detection_frames'])
+    
+    # ----------------------------------------------------------------------------------
+    # Sends the current frame to Yolo.  Yolo calls back 'boxes_detected' when the
+    # detections are available
+    # ----------------------------------------------------------------------------------
+
+    def _start_detection(self):
+        
+        self._last_detection = self.cfg.frame_number
+        logging.debug("%s: calling Yolo for frame %d", self.video_name,
+                      self._total_frames)
             
-            # initialize the colletion of data for Yolo execution
-            Stopwatch.start('Yolo')
+        # initialize the colletion of data for Yolo execution
+        Stopwatch.start('Yolo')
             
-            # write -1 on the header so that we know that we will be waiting for the
-            # next batch of detections
-            self._mmap_bbox.set_base_address(self.bbox_buf, self.video_id)
-            self._mmap_bbox.write_header(self.bbox_buf, np.array([-1]).astype(np.int32))
+        # write -1 on the header so that we know that we will be waiting for the
+        # next batch of detections
+        self._mmap_bbox.clear(self.bbox_buf)
+
+        # keep a version of the items as they are on this frame: detections are
+        # matched against it, as tracking will move the items before the detections
+        # are merged
+        self._detection = {
+            'frame_number': self.cfg.frame_number,
+            'frame_index': self.frame_index,
+            'snapshot': [copy.copy(item) for item in self._setting.items.values()],
+            'done': False}
+        
+        self.phone(self._yolo, 'find_bboxes', self.video_name, self.frame_index,
+                   callback = 'boxes_detected')
+
+    # ----------------------------------------------------------------------------------
+    # Reads the detections of the frame sent to the Neural Net by '_start_detection'
+    # and merges them in the setting.  Detections are matched against the items as
+    # they were on the detected frame and new items start tracking on that frame,
+    # even if tracking has already moved on to the next frame
+    # ----------------------------------------------------------------------------------
+
+    def _merge_detections(self):
 
-            self.post(self._yolo, 'find_bboxes', self.video_name, self.frame_index)
-            self.boxes_detected()
+        detections = self._mmap_bbox.read_detections(self.bbox_buf)
+
+        logging.debug("%s: number of objects detected: %d", self.video_name,
+                      len(detections))
+        logging.debug("%s: reading mmap file - detections %s", self.video_name,
+                      detections)
+
+        detection = self._detection
+        self._detection = None
+        
+        boxes = detections['box']
+        confidences = detections['conf']
+        classIDs = detections['cls']
             
-        else:
-            # This is one problem with callback functions: the '_next_frame' method is
-            # called here and also on the 'boxes_detected' callback method. It's
-            # a bit confusing.
-            self._next_frame()
-    
+        # convert the detected bounding boxes to Items
+        self._setting.detections2items(boxes, confidences, classIDs,
+                                       detection['frame_number'])
+        
+        # add the newly detected items to the setting. This method will match the
+        # tracked items with the newly detected ones, adding only the relevant items
+        self._add_items(detection['snapshot'], detection['frame_number'],
+                        detection['frame_index'])
+
+        # the detected frame is done
+        self._retire_frame(detection['frame_index'])
+
+    # ----------------------------------------------------------------------------------
+    # Processing of the frame at 'frame_index' is done: publish it to the
+    # listeners.  The slot is only consumed after the next tracking round, since
+    # trackers might still need to start tracking new items on it
+    # ----------------------------------------------------------------------------------
+
+    def _retire_frame(self, frame_index):
+        self._publish_frame(frame_index)
+        self._retired.append(frame_index)
+
     # ----------------------------------------------------------------------------------
-    # This method sends to the decoder the 'next_frame' message for it to
-    # decode a new frame.  This closes the processing loop: 1) decoder decodes a frame;
-    # 2) decoder calls 'process_frame' from flow_manager; 3) flow_manager does whatever
-    # it needs to to with the frame; 4) flow_manager calls 'next_frame' (this method);
-    # 5) 'next_frame' calls back onto the decoder (step 1 above)
+    # mark the retired frames as consumed.  The decoder can reuse those slots as soon
+    # as no reader is holding them
+    # ----------------------------------------------------------------------------------
+
+    def _consume_retired(self):
+        for frame_index in self._retired:
+            self._mmap.consume(frame_index)
+        self._retired = []
+
+    # ----------------------------------------------------------------------------------
+    # When no tracking round is done, the retired frames are only consumed after
+    # all the trackers have acknowledged them.  Trackers reply to messages in order,
+    # so when they reply to 'acknowledge' they are done with every message that
+    # uses those frames.  Processing does not wait for the acknowledgement
+    # ----------------------------------------------------------------------------------
+
+    def _acknowledge_retired(self):
+
+        if len(self._retired) == 0:
+            return
+
+        self._acknowledge_token += 1
+        self._acknowledging[self._acknowledge_token] = {
+            'trackers': len(self.trackers),
+            'frames': self._retired}
+        self._retired = []
+        
+        self._trackers_broadcast_with_callback(
+            'acknowledge', self.video_name, self._acknowledge_token,
+            callback = 'retired_acknowledged')
+        
+    # ----------------------------------------------------------------------------------
+    # This method moves the processing loop to the next frame: 1) decoder decodes a
+    # frame; 2) flow_manager waits for it on '_process_frame'; 3) flow_manager does
+    # whatever it needs to to with the frame; 4) flow_manager calls 'next_frame'
+    # (this method); 5) 'next_frame' waits for the next frame (step 2 above)
     # ----------------------------------------------------------------------------------
 
     def _next_frame(self):
 
         Stopwatch.stop('process')
         Stopwatch.report(self.video_name, self._total_frames, main_measure = 'process')
-        
-        # notify all the listeners to this flow_manager that we have finished
-        # processing this frame and are going to process the next one.
-        # TODO: Might not be enough time for all listeners to do something with the
-        # frame before we get the next frame. Not a problem right now since we only
-        # have one listener to this object
-        self._notify_listeners()
-        
-        # set the header of this frame to 0 indicating that this frame was processed
-        self._mmap.write_header(self.frame_index, 0)
-        # copy the current frame to the last position on the buffer that is never
-        # used. This will be used by the 'display' and other listeners to work
-        # with this frame
-        self._mmap.copy_last(self.frame_index)
+        # the decoder's rate control: ring occupancy, latency, frames dropped and
+        # fraction of frames kept
+        if self._total_frames % 100 == 0:
+            logging.info("%s: frames ring %s", self.video_name, self._mmap.stats())
 
+        # report to the decoder how long we take to process a frame (moving average)
+        # so that it can control the rate of frames
+        self._frame_latency = (0.9 * self._frame_latency +
+                               0.1 * (time.perf_counter() - self._frame_start))
+        self._mmap.set_latency(self._frame_latency)
+        
         # process the next frame
         self._process_frame()
         
@@ -520,7 +662,7 @@ class FlowManager(Doer):
                     trackers[tk_key]['items_ids'] = []
 
                 trackers[tk_key]['items_ids'].append(item_id)
-                del self._setting.items[item_id]
+                self._setting.remove_item(item_id)
 
         for tk_key in trackers:
             self.post(trackers[tk_key]['doer_address'], 'stop_tracking_items',
@@ -528,120 +670,140 @@ class FlowManager(Doer):
 
     # ---------------------------------------------------------------------------------
     # Given a list of items to be tracked, send them for tracking to the multiple
-    # trackers. This uses a very simple policy: breaks the items in chunks of 5 and
-    # send every 5 items to a randomly selected tracker from the available trackers.
-    # TODO: Try different policies for distributing items to trackers.
+    # trackers. The tracker of every item is chosen by the placement policy in the
+    # configuration file
     # ---------------------------------------------------------------------------------
 
-    def _distribute2trackers(self, items):
+    def _distribute2trackers(self, items, frame_number, frame_index):
 
         logging.debug("%s: adding to trackers %d items", self.video_name,
                       len(items))
+
+        tracker_items = collections.defaultdict(list)
         
-        chunck_size = 3
+        for item, key in zip(items, self._placement.place(self.video_name, len(items))):
+            # first frame where this item was detected
+            item.first_frame = frame_number
+            # set the id of this item to the next value
+            self.next_item_id += 1
+            item.item_id = self.next_item_id
+            self._setting.add_item(self.next_item_id, item)
+            tracker_items[key].append(item)
+
+        self._send2trackers(tracker_items, frame_index)
         
-        final = [items[i * chunck_size:(i + 1) * chunck_size] for i in
-                 range((len(items) + chunck_size - 1) // chunck_size )]
+    # ---------------------------------------------------------------------------------
+    # Starts tracking the items on the given trackers.  'tracker_items' is a
+    # dictionary with the list of items of every tracker
+    # ---------------------------------------------------------------------------------
 
-        tracker_items = []
+    def _send2trackers(self, tracker_items, frame_index):
         
-        for chunk in final:
-            key = list(self.trackers.keys())[random.randrange(len(self.trackers))]
-            logging.debug("%s: Selected tracker is %s", self.video_name, key)
+        for key, items in tracker_items.items():
+            logging.debug("%s: Selected tracker is %s for %d items", self.video_name,
+                          key, len(items))
             
             tracker = self.trackers[key]
-            
-            for item in chunk:
-                # first frame where this item was detected
-                item.first_frame = self.cfg.frame_number
-                # set the id of this item to the next value
-                self.next_item_id += 1
-                item.item_id = self.next_item_id
-                self._setting.items[self.next_item_id] = item
+            for item in items:
                 item.tracker_address = tracker[0]
-                tracker_items.append(item)
+                item.tracker_name = key
 
-            self.post(tracker[0], 'tracks_list', self.video_name, self.frame_index,
-                      tracker_items)
-            tracker_items = []
+            self.post(tracker[0], 'tracks_list', self.video_name, frame_index, items)
+            
+    # ---------------------------------------------------------------------------------
+    # Moves items of this video between trackers as asked by the placement policy.
+    # Items start being tracked on the new tracker from the current frame
+    # ---------------------------------------------------------------------------------
+
+    def _rebalance(self):
+        
+        video_items = collections.defaultdict(list)
+        for item in self._setting.items.values():
+            video_items[item.tracker_name].append(item)
+
+        moves = self._placement.rebalance(
+            self.video_name, {key: len(items) for key, items in video_items.items()})
+        
+        tracker_items = collections.defaultdict(list)
+        for source, target, count in moves:
+            logging.info("%s: moving %d items from tracker %s to %s", self.video_name,
+                         count, source, target)
+            items = video_items[source][:count]
+            del video_items[source][:count]
+            
+            self.post(self.trackers[source][0], 'stop_tracking_items', self.video_name,
+                      [item.item_id for item in items])
+            tracker_items[target].extend(items)
+
+        self._send2trackers(tracker_items, self.frame_index)
                 
     # ---------------------------------------------------------------------------------
-    # Matches the newly detected items with the already tracked items using either
-    # "iou_match" or "centroid_match" algorithm.
+    # Matches the newly detected items with the 'tracked' items using the matcher
+    # selected in the configuration file.
     # match_row_cols are detected items that were already being tracked
     # unused_cols are new items
     # ---------------------------------------------------------------------------------
 
-    def _match_items(self):
+    def _match_items(self, tracked):
         
         (unused_rows, unused_cols,
-         match_rows_cols) = Geom.iou_match(
-             list(self._setting.items.values()), self._setting.new_inputs,
-             self.cfg.data["trackable_objects"]["iou_match"])
+         match_rows_cols) = self._matcher.match(tracked, self._setting.new_inputs)
 
         logging.debug('number of tracked objects %d; identified %d',
-                     len(self._setting.items), len(self._setting.new_inputs))
+                     len(tracked), len(self._setting.new_inputs))
         logging.debug('tracked but not matched %s', unused_rows)
         logging.debug('new items %s', unused_cols)
         logging.debug('matched tracked x identified %s', match_rows_cols)
-
-        tracked_not_matched = [list(self._setting.items.values())[row] for row in unused_rows]
-        tentative_new = [self._setting.new_inputs[col] for col in unused_cols]
-
-        # now do centroid matching for the itens that did not match according to iou match
-        (u_rows, u_cols,
-         m_r_c) = Geom.centroid_match(tracked_not_matched, tentative_new, 300)
         
-        logging.debug('matched by centroid %s', m_r_c)
-        logging.debug('++++++++++++')
-        
-        # return (unused_rows, unused_cols, match_rows_cols)
-        return (u_rows, u_cols, m_r_c)
-
-    # ---------------------------------------------------------------------------------
-    # Matches the newly detected items with the already tracked items using either
-    # "iou_match" or "centroid_match" algorithm.
-    # match_row_cols are detected items that were already being tracked
-    # unused_cols are new items
-    # ---------------------------------------------------------------------------------
-
-    def _match_items2(self):
-        
-        if self.cfg.data["trackable_objects"]["match"] == "iou_match":
-            (unused_rows,
-             unused_cols,
-             match_rows_cols) = Geom.iou_match(
-                 list(self._setting.items.values()), self._setting.new_inputs,
-                 self.cfg.data["trackable_objects"]["iou_match"])
-        elif self.cfg.data["trackable_objects"]["match"] == "centroid_match":
-            (unused_rows,
-             unused_cols,
-             match_rows_cols) = Geom.centroid_match(
-                 list(self._setting.items.values()), self._setting.new_inputs,
-                 self.cfg.data["trackable_objects"]["centroid_match_max_distance"])
-        else:
-            logging.info("Unknown matching algorithm specified")
-
         return (unused_rows, unused_cols, match_rows_cols)
 
     # ---------------------------------------------------------------------------------
-    #
+    # Adds the new inputs detected on the frame 'frame_number' at 'frame_index' that
+    # do not match any of the 'tracked' items, the items as they were on that frame
     # ---------------------------------------------------------------------------------
 
-    def _add_items(self):
+    def _add_items(self, tracked, frame_number, frame_index):
         
         # if we are currently not tracking any objects we should
         # start tracking them
-        if (len(self._setting.items) == 0):
-            self._distribute2trackers(self._setting.new_inputs)
+        if (len(tracked) == 0):
+            self._distribute2trackers(self._setting.new_inputs, frame_number,
+                                      frame_index)
             return
 
         # match the new items to the already tracked objects using the matching
         # algorithgm in the configuration file
-        (unused_rows, unused_cols, match_rows_cols) = self._match_items()
+        (unused_rows, unused_cols, match_rows_cols) = self._match_items(tracked)
 
         new_inputs = [self._setting.new_inputs[col] for col in unused_cols]
-        self._distribute2trackers(new_inputs)
+        self._distribute2trackers(new_inputs, frame_number, frame_index)
+        
+    # ---------------------------------------------------------------------------------
+    # Publishes the frame to the listeners, if there are any.  The slot is
+    # held for the listeners, that read the frame directly from the ring and release
+    # it.  If the listeners have not yet released the previous frame, this frame is
+    # not published
+    # ---------------------------------------------------------------------------------
+
+    def _publish_frame(self, frame_index):
+
+        # no one is watching: nothing to publish
+        if len(self._listeners) == 0:
+            return
+
+        # listeners are still working on the previously published frame.  Skip
+        # this frame instead of making the decoder wait for them
+        published = self._mmap.published_index()
+        if (published != -1 and
+            self._mmap.is_held(published, MmapFrames.DISPLAY_READER)):
+            logging.debug("%s: listeners busy, frame %d not published", self.video_name,
+                          self.cfg.frame_number)
+            return
+
+        # the slot is held on behalf of the listeners until they release it
+        self._mmap.acquire(frame_index, MmapFrames.DISPLAY_READER)
+        self._mmap.publish_processed(frame_index)
+        self._notify_listeners()
         
     # ---------------------------------------------------------------------------------
     # This method notifies all listeners that we have a new frame processed. It sends
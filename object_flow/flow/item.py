@@ -61,6 +61,7 @@ class Item:
 
         # id of the tracker tracking this item
         self.tracker_address = None
+        self.tracker_name = None
         
         # direction to which the object is moving
         self.dirX = None
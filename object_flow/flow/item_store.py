@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import numpy as np
+
+#==========================================================================================
+# Columnar storage of the state of the items of a Setting.  Every item gets a row on
+# preallocated numpy columns: bounding box, ring buffer with its last centroids,
+# direction, last_update and the state of the item in relation to every counting
+# line.  Rows of removed items go to a free list and are reused; when there are no
+# free rows left, the columns double in size.
+#
+# Items stay in the Setting as Item objects, since they are matched, sent to the
+# trackers and to the listeners, but the store keeps their centroids and counting
+# lines state, that are dropped from the Item.  After every update, 'sync' copies
+# to the Item the attributes that are read by others: bounding box, centroid,
+# confidence and direction.
+#
+# Columns are indexed by row, and the counting line columns by row and line, in the
+# order of 'lines'.  Positions in relation to a line are -1 while unknown (None on
+# the Item), 0 (False) or 1 (True).  Directions are 0 while unknown (None on the
+# Item), 1 for 'East' or 'North' and 2 for 'West' or 'South'
+#==========================================================================================
+
+class ItemStore:
+
+    # number of centroids kept for every item, as on Item.centroids
+    history = 32
+
+    # names of the direction codes
+    dir_x_names = (None, 'East', 'West')
+    dir_y_names = (None, 'North', 'South')
+
+    # columns with one row per item
+    columns = ('ids', 'boxes', 'confidences', 'centroids', 'head', 'length', 'dX',
+               'dY', 'dir_x', 'dir_y', 'last_update', 'top_position',
+               'bottom_position', 'counted_frame', 'split', 'counted', 'top_point',
+               'bottom_point')
+
+    # ---------------------------------------------------------------------------------
+    # @param lines [List] keys of the counting lines
+    # @param capacity [Integer] initial number of rows
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, lines, capacity = 64):
+        self.lines = list(lines)
+        num_lines = len(self.lines)
+
+        # id of the item on every row, -1 on free rows
+        self.ids = np.full(capacity, -1, dtype = np.int64)
+        self.boxes = np.zeros((capacity, 4), dtype = np.int64)
+        self.confidences = np.zeros(capacity, dtype = np.float64)
+
+        # ring buffer of centroids: 'head' is the position of the last centroid and
+        # 'length' the number of centroids in the ring
+        self.centroids = np.zeros((capacity, ItemStore.history, 2), dtype = np.int64)
+        self.head = np.zeros(capacity, dtype = np.int64)
+        self.length = np.zeros(capacity, dtype = np.int64)
+
+        # movement and direction
+        self.dX = np.zeros(capacity, dtype = np.int64)
+        self.dY = np.zeros(capacity, dtype = np.int64)
+        self.dir_x = np.zeros(capacity, dtype = np.int8)
+        self.dir_y = np.zeros(capacity, dtype = np.int8)
+        self.last_update = np.zeros(capacity, dtype = np.int64)
+
+        # state of the item in relation to every counting line
+        self.top_position = np.full((capacity, num_lines), -1, dtype = np.int8)
+        self.bottom_position = np.full((capacity, num_lines), -1, dtype = np.int8)
+        self.counted_frame = np.zeros((capacity, num_lines), dtype = np.int64)
+        self.split = np.zeros((capacity, num_lines), dtype = bool)
+        self.counted = np.zeros((capacity, num_lines), dtype = bool)
+        self.top_point = np.zeros((capacity, num_lines, 2), dtype = np.int64)
+        self.bottom_point = np.zeros((capacity, num_lines, 2), dtype = np.int64)
+
+        # Item object and row of every item
+        self._items = [None] * capacity
+        self._rows = {}
+
+        # free rows, the lowest row is used first
+        self._free = list(range(capacity - 1, -1, -1))
+
+    # ---------------------------------------------------------------------------------
+    # Number of items in the store
+    # ---------------------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self._rows)
+
+    # ---------------------------------------------------------------------------------
+    # Adds the item to the store and returns its row.  The centroids and the counting
+    # lines state of the item move to the store
+    # ---------------------------------------------------------------------------------
+
+    def add(self, item_id, item):
+        if len(self._free) == 0:
+            self._grow()
+
+        row = self._free.pop()
+        self._rows[item_id] = row
+        self._items[row] = item
+
+        self.ids[row] = item_id
+        self.boxes[row] = (item.startX, item.startY, item.endX, item.endY)
+        self.confidences[row] = item.confidence
+
+        # Item.centroids has the last centroid first
+        centroids = list(item.centroids)[::-1]
+        self.centroids[row, :len(centroids)] = centroids
+        self.head[row] = len(centroids) - 1
+        self.length[row] = len(centroids)
+
+        self.dX[row] = item.dX
+        self.dY[row] = item.dY
+        self.dir_x[row] = ItemStore.dir_x_names.index(item.dirX)
+        self.dir_y[row] = ItemStore.dir_y_names.index(item.dirY)
+        self.last_update[row] = item.last_update
+
+        for i, key in enumerate(self.lines):
+            line = item.lines[key]
+            self.top_position[row, i] = ItemStore._position(line['top_line_position'])
+            self.bottom_position[row, i] = ItemStore._position(
+                line['bottom_line_position'])
+            self.counted_frame[row, i] = line['counted_frame']
+            self.split[row, i] = line['split']
+            self.counted[row, i] = line['counted']
+            self.top_point[row, i] = line['top_point']
+            self.bottom_point[row, i] = line['bottom_point']
+
+        item.centroids = None
+        item.lines = None
+
+        return row
+
+    # ---------------------------------------------------------------------------------
+    # Removes the item from the store, its row is freed
+    # ---------------------------------------------------------------------------------
+
+    def remove(self, item_id):
+        row = self._rows.pop(item_id)
+        self.ids[row] = -1
+        self._items[row] = None
+        self._free.append(row)
+
+    # ---------------------------------------------------------------------------------
+    # Rows of the given items, -1 for the items that are not in the store
+    # ---------------------------------------------------------------------------------
+
+    def rows(self, item_ids):
+        return np.array([self._rows.get(item_id, -1) for item_id in item_ids],
+                        dtype = np.int64)
+
+    # ---------------------------------------------------------------------------------
+    # Rows in use, in ascending order
+    # ---------------------------------------------------------------------------------
+
+    def active(self):
+        return np.nonzero(self.ids >= 0)[0]
+
+    # ---------------------------------------------------------------------------------
+    # Updates the rows with the boxes given by the trackers on 'frame_number'.  Does
+    # for all the rows what Item.tracker_update does for one item: adds the centroid
+    # to the ring and, when there are more than 10 centroids, updates the direction
+    # and 'last_update'
+    # ---------------------------------------------------------------------------------
+
+    def update(self, rows, frame_number, confidences, boxes):
+        boxes = np.asarray(boxes, dtype = np.int64).reshape(-1, 4)
+
+        self.confidences[rows] = confidences
+        self.boxes[rows] = boxes
+
+        head = (self.head[rows] + 1) % ItemStore.history
+        length = np.minimum(self.length[rows] + 1, ItemStore.history)
+        self.head[rows] = head
+        self.length[rows] = length
+        # boxes are never negative, so this is the same as int((start + end) / 2.0)
+        self.centroids[rows, head] = (boxes[:, :2] + boxes[:, 2:]) // 2
+
+        moving = length > 10
+        rows, head, length = rows[moving], head[moving], length[moving]
+
+        # movement from the 10th oldest centroid to the last one
+        d = (self.centroids[rows, (head - length + 10) % ItemStore.history] -
+             self.centroids[rows, head])
+        self.dX[rows] = d[:, 0]
+        self.dY[rows] = d[:, 1]
+        self.dir_x[rows] = np.where(d[:, 0] > 0, 1, 2)
+        self.dir_y[rows] = np.where(d[:, 1] > 0, 1, 2)
+
+        # items that moved too little keep the frame where they stopped
+        last_update = self.last_update[rows]
+        still = (np.abs(d) < 10).all(axis = 1)
+        self.last_update[rows] = np.where(
+            still, np.where(last_update == 0, frame_number, last_update), 0)
+
+    # ---------------------------------------------------------------------------------
+    # Copies the bounding box, centroid, confidence and direction of the rows to
+    # their Item objects
+    # ---------------------------------------------------------------------------------
+
+    def sync(self, rows):
+        centroids = self.centroids[rows, self.head[rows]]
+
+        for (row, box, confidence, centroid, dX, dY, dir_x, dir_y,
+             last_update) in zip(rows.tolist(), self.boxes[rows].tolist(),
+                                 self.confidences[rows].tolist(), centroids.tolist(),
+                                 self.dX[rows].tolist(), self.dY[rows].tolist(),
+                                 self.dir_x[rows].tolist(), self.dir_y[rows].tolist(),
+                                 self.last_update[rows].tolist()):
+            item = self._items[row]
+            item.startX, item.startY, item.endX, item.endY = box
+            item.confidence = confidence
+            item.area = (box[2] - box[0] + 1) * (box[3] - box[1] + 1)
+            item.cX, item.cY = centroid
+            item.centroid = (item.cX, item.cY)
+            item.dX, item.dY = dX, dY
+            item.dirX = ItemStore.dir_x_names[dir_x]
+            item.dirY = ItemStore.dir_y_names[dir_y]
+            if dir_x != 0:
+                item.direction = "{}-{}".format(item.dirY, item.dirX)
+            item.last_update = last_update
+
+    # ---------------------------------------------------------------------------------
+    # Ids of the items not updated for more than 'disappear_after' frames
+    # ---------------------------------------------------------------------------------
+
+    def disappeared(self, frame_number, disappear_after):
+        rows = self.active()
+        last_update = self.last_update[rows]
+        gone = (last_update != 0) & (frame_number > last_update + disappear_after)
+        return self.ids[rows[gone]].tolist()
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Doubles the number of rows
+    # ---------------------------------------------------------------------------------
+
+    def _grow(self):
+        size = len(self.ids)
+
+        for name in ItemStore.columns:
+            column = getattr(self, name)
+            grown = np.zeros((2 * size,) + column.shape[1:], dtype = column.dtype)
+            grown[:size] = column
+            setattr(self, name, grown)
+
+        self.ids[size:] = -1
+        self.top_position[size:] = -1
+        self.bottom_position[size:] = -1
+        self._items.extend([None] * size)
+        self._free.extend(range(2 * size - 1, size - 1, -1))
+
+    # ---------------------------------------------------------------------------------
+    # Code of a position in relation to a line
+    # ---------------------------------------------------------------------------------
+
+    def _position(position):
+        return -1 if position == None else int(position)
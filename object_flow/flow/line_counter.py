@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import numpy as np
+
+from object_flow.util.geom import Geom
+
+#==========================================================================================
+# Counts the items crossing the counting lines.  All the items are checked against
+# all the lines at once.  For every item and line:
+#   * the bottom point (endX, endY) of an item that already has a direction has
+#     crossed the line if it changed side and the segment from the bottom point the
+#     item had when it appeared to the current one intersects the line.  The item is
+#     counted as entering or exiting by the side it is now on
+#   * the top point (startX, startY) of an item split by the line and going 'South'
+#     has crossed the line if it changed side and the segment from the top point the
+#     item had when it appeared to the current one intersects the line.  The item is
+#     counted as exiting if it is now on the positive side.  Only on lines with
+#     'count_splits'
+#   * an item is only counted once, unless it crosses again more than 30 frames
+#     after being counted
+#   * an item seen for the first time is split if its top and bottom points are on
+#     different sides of the line
+#
+# The state of the items in relation to the lines is given by arrays of (N, L) for
+# N items and L lines, in the order of the keys of 'counting_lines'.  See
+# LineCounter.state and ItemStore for their meaning.
+#==========================================================================================
+
+class LineCounter:
+
+    # state of every item in relation to every line
+    state = ('top_position', 'bottom_position', 'counted_frame', 'split', 'counted',
+             'top_point', 'bottom_point')
+
+    # an item counted on a line is counted again only after this number of frames
+    recount_after = 30
+
+    # ---------------------------------------------------------------------------------
+    # @param counting_lines [Dict] specification of the counting lines, with their
+    # counters, as set by Setting._set_counters
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, counting_lines):
+        self.keys = list(counting_lines.keys())
+        self.specs = [counting_lines[key] for key in self.keys]
+
+        self.lines = np.array([spec["end_points"] for spec in self.specs],
+                              dtype = np.int64).reshape(-1, 4)
+        self.count_splits = np.array([spec['count_splits'] == 'True'
+                                      for spec in self.specs], dtype = bool)
+
+        # column of the counter of every line, 0 for 'counter1' and 1 for
+        # 'counter2', for items entering and exiting by 'side1'
+        self.enter = np.array([spec["enter_side1"] == "counter2"
+                               for spec in self.specs], dtype = np.int64)
+        self.exit = 1 - self.enter
+
+    # ---------------------------------------------------------------------------------
+    # Counts the items with the given (N, 4) bounding 'boxes' and directions
+    # ('dir_x' and 'dir_y' coded as on ItemStore).  'state' is a dictionary with the
+    # arrays in LineCounter.state, that are updated.  The counters of the lines are
+    # incremented.  Returns the (N, L) array of the items counted on every line
+    # ---------------------------------------------------------------------------------
+
+    def count(self, frame_number, boxes, dir_x, dir_y, state):
+        boxes = np.asarray(boxes, dtype = np.int64).reshape(-1, 4)
+        first_point, second_point = self.lines[:, :2], self.lines[:, 2:]
+
+        new_top = Geom.point_positions(boxes[:, :2], self.lines)
+        new_bottom = Geom.point_positions(boxes[:, 2:], self.lines)
+        known = state['bottom_position'] >= 0
+
+        # bottom line has crossed the counting line and the direction was set
+        moving = (np.asarray(dir_x) != 0) | (np.asarray(dir_y) != 0)
+        crossed = (known & moving[:, None] &
+                   (state['bottom_position'] != new_bottom) &
+                   Geom.segments_intersect(state['bottom_point'], boxes[:, None, 2:],
+                                           first_point, second_point))
+        bottom = self._recount(frame_number, crossed, state)
+
+        # top line of split items going 'South' has crossed the counting line.  Uses
+        # the state left by the bottom line, as an item counted by its bottom line
+        # is no longer split
+        crossed = (known & self.count_splits & state['split'] &
+                   (np.asarray(dir_y) == 2)[:, None] &
+                   (state['top_position'] != new_top) &
+                   Geom.segments_intersect(state['top_point'], boxes[:, None, :2],
+                                           first_point, second_point))
+        top = self._recount(frame_number, crossed, state)
+
+        # new items split by the counting line
+        state['split'] |= ~known & (new_top != new_bottom)
+        state['top_position'] = new_top.astype(np.int8)
+        state['bottom_position'] = new_bottom.astype(np.int8)
+
+        # increment the counters: bottom crossings enter or exit by the side the
+        # bottom is now on, top crossings only exit
+        counters = np.zeros((len(self.specs), 2), dtype = np.int64)
+        items, lines = np.nonzero(bottom)
+        np.add.at(counters, (lines, np.where(new_bottom[items, lines],
+                                             self.exit[lines], self.enter[lines])), 1)
+        items, lines = np.nonzero(top & new_top)
+        np.add.at(counters, (lines, self.exit[lines]), 1)
+
+        for spec, (counter1, counter2) in zip(self.specs, counters.tolist()):
+            spec["counter1"] += counter1
+            spec["counter2"] += counter2
+
+        return bottom | top
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Items and lines of 'crossed' that should be counted: the ones not counted yet
+    # or counted more than 'recount_after' frames ago.  Marks them as counted on
+    # 'frame_number' and no longer split
+    # ---------------------------------------------------------------------------------
+
+    def _recount(self, frame_number, crossed, state):
+        count = crossed & (~state['counted'] |
+                           (frame_number > state['counted_frame'] +
+                            LineCounter.recount_after))
+        state['split'][count] = False
+        state['counted'][count] = True
+        state['counted_frame'][count] = frame_number
+        return count
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import logging
+import collections
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from object_flow.util.geom import Geom
+
+#==========================================================================================
+# Matchers pair the items detected by the neural net with the items already being
+# tracked.  Tracked items are the rows and detected items the columns; 'match'
+# returns the same as Geom.iou_match:
+#   * unused_rows: tracked items that did not match any detected item
+#   * unused_cols: detected items that did not match, these are new items
+#   * match_rows_cols: list of matched (row, col)
+#
+# The matcher is selected by 'match' in the 'trackable_objects' configuration:
+#   * 'iou_match': greedy match by iou, then the items left are greedily matched by
+#     the distance of their centroids, up to 'centroid_fallback_distance'
+#   * 'centroid_match': greedy match by the distance of the centroids, up to
+#     'centroid_match_max_distance'
+#   * 'assignment': optimal assignment (Hungarian) minimizing a cost that combines
+#     iou and distance of the centroids
+#==========================================================================================
+
+class Matcher:
+
+    # ---------------------------------------------------------------------------------
+    # Creates the matcher configured in the 'trackable_objects' section
+    # ---------------------------------------------------------------------------------
+
+    def create(cfg):
+        if cfg['match'] not in Matcher.matchers:
+            logging.warning("Unknown matching algorithm %s, using iou_match",
+                            cfg['match'])
+            return Matcher.matchers['iou_match'](cfg)
+        return Matcher.matchers[cfg['match']](cfg)
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    # ---------------------------------------------------------------------------------
+    # Matches 'tracked' items (rows) with 'detected' items (columns).  Greedy iou
+    # match followed by greedy centroid match of what is left ('iou_match')
+    # ---------------------------------------------------------------------------------
+
+    def match(self, tracked, detected):
+
+        (unused_rows, unused_cols,
+         match_rows_cols) = Geom.iou_match(tracked, detected, self.cfg['iou_match'])
+
+        tracked_not_matched = [tracked[row] for row in unused_rows]
+        tentative_new = sorted(unused_cols)
+
+        # now do centroid matching for the itens that did not match according to iou
+        # match
+        (u_rows, u_cols, m_r_c) = Geom.centroid_match(
+            tracked_not_matched, [detected[col] for col in tentative_new],
+            self.cfg['centroid_fallback_distance'])
+
+        logging.debug('matched by iou %s', match_rows_cols)
+        logging.debug('matched by centroid %s', m_r_c)
+
+        # indexes of the centroid match are on the items left by the iou match
+        return (unused_rows[u_rows], set(tentative_new[col] for col in u_cols),
+                match_rows_cols + [(unused_rows[row], tentative_new[col])
+                                   for row, col in m_r_c])
+
+#==========================================================================================
+# Greedy centroid match
+#==========================================================================================
+
+class CentroidMatcher(Matcher):
+
+    def match(self, tracked, detected):
+        return Geom.centroid_match(tracked, detected,
+                                   self.cfg['centroid_match_max_distance'])
+
+#==========================================================================================
+# Optimal assignment.  The cost of matching a tracked item with a detected one is
+# (1 - iou) when their iou is above 'iou_match' and 1 + distance / gate when their
+# centroids are closer than the gate ('centroid_fallback_distance').  Pairs that
+# satisfy neither can not match, so iou matches are always preferred, as in
+# iou_match, but the total cost is minimized instead of taking rows in order.
+#
+# Only pairs whose centroids fall on neighbouring cells of a grid are ever compared.
+# Pairs that can match form independent groups, every group is solved on its own:
+# in a sparse scene no (N, M) matrix is built.  Groups of at most 'greedy_max_pairs'
+# pairs are matched greedily by ascending cost, which is cheaper than calling the
+# solver and almost always gives the same result
+#==========================================================================================
+
+class AssignmentMatcher(Matcher):
+
+    # cost of a pair that can not match
+    forbidden = 1e6
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def match(self, tracked, detected):
+
+        match_rows_cols = []
+        for rows, cols in self._groups(tracked, detected):
+            cost = self._cost(tracked, detected, rows, cols)
+            if cost.size <= self.cfg['greedy_max_pairs']:
+                pairs = self._greedy(cost)
+            else:
+                pairs = zip(*linear_sum_assignment(cost))
+            match_rows_cols.extend((rows[r], cols[c]) for r, c in pairs
+                                   if cost[r, c] < AssignmentMatcher.forbidden)
+
+        match_rows_cols.sort()
+        matched_rows = [row for row, col in match_rows_cols]
+        matched_cols = [col for row, col in match_rows_cols]
+
+        unused_rows = np.setdiff1d(np.arange(len(tracked)), matched_rows)
+        unused_cols = set(range(len(detected))).difference(matched_cols)
+        return (unused_rows, unused_cols, match_rows_cols)
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Groups of tracked (rows) and detected (cols) items that might match each other.
+    # Items are placed on a grid with cells larger than the gate and than any box, so
+    # that a pair can only match, either by distance or by iou, if its items are on
+    # the same or on neighbouring cells
+    # ---------------------------------------------------------------------------------
+
+    def _groups(self, tracked, detected):
+        if len(tracked) == 0 or len(detected) == 0:
+            return []
+
+        boxes = np.vstack([Geom.boxes(tracked), Geom.boxes(detected)])
+        cell = max(self.cfg['centroid_fallback_distance'],
+                   int((boxes[:, 2:] - boxes[:, :2]).max()) + 2)
+        cells = np.vstack([Geom.centroids(tracked), Geom.centroids(detected)]) // cell
+
+        grid = collections.defaultdict(list)
+        for col in range(len(detected)):
+            x, y = cells[len(tracked) + col]
+            grid[(x, y)].append(col)
+
+        # union-find of the items: tracked item 'i' is node i and detected item 'j' is
+        # node len(tracked) + j
+        parent = list(range(len(tracked) + len(detected)))
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for row in range(len(tracked)):
+            x, y = cells[row]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for col in grid.get((x + dx, y + dy), []):
+                        parent[find(len(tracked) + col)] = find(row)
+
+        groups = collections.defaultdict(lambda: ([], []))
+        for row in range(len(tracked)):
+            groups[find(row)][0].append(row)
+        for col in range(len(detected)):
+            groups[find(len(tracked) + col)][1].append(col)
+
+        return [group for group in groups.values()
+                if len(group[0]) > 0 and len(group[1]) > 0]
+
+    # ---------------------------------------------------------------------------------
+    # Cost matrix of the given rows and cols
+    # ---------------------------------------------------------------------------------
+
+    def _cost(self, tracked, detected, rows, cols):
+        t = [tracked[row] for row in rows]
+        d = [detected[col] for col in cols]
+
+        iou = Geom.iou_matrix(Geom.boxes(t), Geom.boxes(d))
+        distance = Geom.distance_matrix(Geom.centroids(t), Geom.centroids(d))
+        gate = self.cfg['centroid_fallback_distance']
+
+        cost = np.full(iou.shape, AssignmentMatcher.forbidden)
+        near = distance < gate
+        cost[near] = 1 + distance[near] / gate
+        overlap = iou > self.cfg['iou_match']
+        cost[overlap] = 1 - iou[overlap]
+        return cost
+
+    # ---------------------------------------------------------------------------------
+    # Takes the pairs by ascending cost, as long as their row and col are free
+    # ---------------------------------------------------------------------------------
+
+    def _greedy(self, cost):
+        used_rows = set()
+        used_cols = set()
+        pairs = []
+
+        for index in np.argsort(cost, axis = None, kind = 'stable'):
+            row, col = np.unravel_index(index, cost.shape)
+            if row not in used_rows and col not in used_cols:
+                used_rows.add(row)
+                used_cols.add(col)
+                pairs.append((row, col))
+
+        return pairs
+
+Matcher.matchers = {
+    'iou_match': Matcher,
+    'centroid_match': CentroidMatcher,
+    'assignment': AssignmentMatcher
+}
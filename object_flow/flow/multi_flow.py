@@ -51,9 +51,8 @@ class MultiFlow(Doer):
         # if of the flow_manager
         self._next_flow_id = 0
 
-        # Create the memory maped file for communicating bounding boxes
-        self._mmap_bbox = MmapBboxes()
-        self._mmap_bbox.create()
+        # memory maped file for the bounding boxes, created by __initialize__
+        self._mmap_bbox = None
 
     # ----------------------------------------------------------------------------------
     #
@@ -61,19 +60,44 @@ class MultiFlow(Doer):
     
     def __initialize__(self, system_cfg):
         self.system_cfg = system_cfg
+        self.mmap_backend = system_cfg.data['system_info']['mmap_backend']
+
+        # Create the memory maped file for communicating bounding boxes
+        self._mmap_bbox = MmapBboxes(self.mmap_backend)
+        self._mmap_bbox.create()
         
         # load confidence and threshold from the specific neural net algo
         confidence = system_cfg.data['neural_net']['confidence']
         threshold = system_cfg.data['neural_net']['threshold']
+        classes = system_cfg.data['neural_net']['classes']
+
+        # batching of detection requests from different cameras
+        batch_size = system_cfg.data['yolov3_tf2']['batch_size']
+        batch_deadline = system_cfg.data['yolov3_tf2']['batch_deadline']
 
         # start the yolo object detection process
         self._yolo = self.hire('YoloNet', YoloTf2, confidence, threshold,
+                               batch_size = batch_size,
+                               batch_deadline = batch_deadline,
+                               letterbox = (
+                                   system_cfg.data['yolov3_tf2']['letterbox'] == 'True'),
+                               classes = classes,
+                               mmap_backend = self.mmap_backend,
                                group = 'DeepLearners')
 
         # read from conf file how many trackers we want and create the trackers
         self.ntrackers = system_cfg.data['system_info']['num_trackers']
         self.add_trackers(self.ntrackers)
         
+    # ----------------------------------------------------------------------------------
+    # 
+    # ----------------------------------------------------------------------------------
+
+    def terminate(self):
+        super().terminate()
+        if self._mmap_bbox != None:
+            self._mmap_bbox.unlink()
+        
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -124,6 +148,8 @@ class MultiFlow(Doer):
         self.ntrackers -= 1
         self.hire('Tracker_' + str(self.ntrackers), Tracker, id = self.ntrackers,
                   tracker_type = self.system_cfg.data['system_info']['tracker_type'],
+                  mmap_backend = self.mmap_backend,
+                  num_threads = self.system_cfg.data['system_info']['tracker_threads'],
                   group = 'trackers')
             
     # ----------------------------------------------------------------------------------
@@ -144,6 +170,15 @@ class MultiFlow(Doer):
         # the Yolo neural net
         cfg.start_time = self.system_cfg.data['system_info']['start_time']
         cfg.minutes = self.system_cfg.data['system_info']['minutes']
+        cfg.mmap_backend = self.mmap_backend
+        # the memory for frames is split evenly among all the cameras
+        cfg.frame_memory_budget = (
+            self.system_cfg.data['system_info']['frame_memory_budget'] * 1024 * 1024 //
+            max(1, len(self.system_cfg.data['video_cameras'])))
+        cfg.frame_buffer_seconds = (
+            self.system_cfg.data['system_info']['frame_buffer_seconds'])
+        # make room for the detections of the new camera
+        self._mmap_bbox.reserve(self._next_flow_id + 1)
         manager = self.hire(
             cfg.video_name, FlowManager, cfg, self._doers['trackers'],
             self._yolo, self._next_flow_id,
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import bisect
+import hashlib
+import logging
+
+#==========================================================================================
+# Policies for placing the items of a video on the trackers.  Every FlowManager has
+# its own Placement object.  After every tracking round each tracker reports, on its
+# reply to 'update_tracked_items', the total number of items it tracks (for all
+# videos) and how long it took to update one item.  The cost of a tracker is the time it
+# is expected to take on the next round; 'tracking_done' waits for the slowest
+# tracker, so the policies try to keep the costs even.
+#
+# Policies are selected by name with 'Placement.create':
+#   * 'least_loaded': every new item goes to the tracker with the lowest cost.  When
+#     the cost of a tracker grows too much above the others, items of the video are
+#     moved from it to the cheapest tracker
+#   * 'consistent_hash': all the items of a video go to the tracker selected by
+#     hashing the video name on a ring of trackers.  Placement does not depend on
+#     the load, so it is the same on every run and node
+#   * 'locality': all the items of a video go to the same tracker, initially the
+#     cheapest one.  When it gets overloaded the video moves to the cheapest tracker
+#==========================================================================================
+
+class Placement:
+
+    # ---------------------------------------------------------------------------------
+    # Creates the placement policy with the given name
+    # @param policy [String] one of the names in 'Placement.policies'
+    # @param trackers [List] names of the trackers
+    # ---------------------------------------------------------------------------------
+
+    def create(policy, trackers, imbalance = 0.25, max_moves = 3):
+        if policy not in Placement.policies:
+            logging.warning("Unknown placement policy: %s, using least_loaded", policy)
+            policy = 'least_loaded'
+        return Placement.policies[policy](trackers, imbalance, max_moves)
+
+    # ---------------------------------------------------------------------------------
+    # @param imbalance [Float] a tracker is overloaded when its cost is more than
+    # (1 + imbalance) times the cost of the reference tracker
+    # @param max_moves [Integer] maximum number of items of the video moved on one
+    # rebalance, so that all FlowManagers rebalancing at once do not overshoot
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, trackers, imbalance = 0.25, max_moves = 3):
+        self.trackers = list(trackers)
+        self.imbalance = imbalance
+        self.max_moves = max_moves
+
+        # last report of every tracker
+        self.items = {tracker: 0 for tracker in self.trackers}
+        self.item_latency = {tracker: 0.0 for tracker in self.trackers}
+        # items placed on the tracker since its last report
+        self._placed = {tracker: 0 for tracker in self.trackers}
+
+    # ---------------------------------------------------------------------------------
+    # Load reported by a tracker: number of items it tracks and seconds it took to
+    # update one item.  Trackers with no items for the video report no latency
+    # ---------------------------------------------------------------------------------
+
+    def report(self, tracker, num_items, item_latency):
+        self.items[tracker] = num_items
+        self._placed[tracker] = 0
+        if item_latency <= 0:
+            return
+        # moving average, a single slow frame should not move items around
+        if self.item_latency[tracker] == 0:
+            self.item_latency[tracker] = item_latency
+        else:
+            self.item_latency[tracker] = (0.8 * self.item_latency[tracker] +
+                                          0.2 * item_latency)
+
+    # ---------------------------------------------------------------------------------
+    # Expected time in seconds for the tracker to update its items, including the
+    # ones placed on it since its last report
+    # ---------------------------------------------------------------------------------
+
+    def cost(self, tracker, extra = 0):
+        return ((self.items[tracker] + self._placed[tracker] + extra) *
+                self._item_cost(tracker))
+
+    # ---------------------------------------------------------------------------------
+    # Chooses the trackers for 'num_items' new items of the video.  Returns a list with
+    # the name of the tracker of every item
+    # ---------------------------------------------------------------------------------
+
+    def place(self, video_name, num_items):
+        placement = []
+        for i in range(num_items):
+            tracker = self._choose(video_name)
+            self._placed[tracker] += 1
+            placement.append(tracker)
+        return placement
+
+    # ---------------------------------------------------------------------------------
+    # Items of the video that should change tracker.  'video_items' is a dictionary
+    # with the number of items of the video on every tracker.  Returns a list of
+    # (from, to, number of items)
+    # ---------------------------------------------------------------------------------
+
+    def rebalance(self, video_name, video_items):
+        return []
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Tracker for one new item
+    # ---------------------------------------------------------------------------------
+
+    def _choose(self, video_name):
+        return self._cheapest()
+
+    # ---------------------------------------------------------------------------------
+    # Tracker that would take the least time after receiving one more item
+    # ---------------------------------------------------------------------------------
+
+    def _cheapest(self):
+        return min(self.trackers, key = lambda tracker: self.cost(tracker, 1))
+
+    # ---------------------------------------------------------------------------------
+    # True if 'tracker' costs too much more than 'reference', even after moving
+    # 'count' items to 'reference'
+    # ---------------------------------------------------------------------------------
+
+    def _overloaded(self, tracker, reference, count = 1):
+        return (self.cost(tracker) >
+                (1 + self.imbalance) * self.cost(reference, count))
+
+    # ---------------------------------------------------------------------------------
+    # Seconds for the tracker to update one item.  Trackers that have not measured
+    # it yet are estimated by the average of the others.  Before any measure, every
+    # item costs the same
+    # ---------------------------------------------------------------------------------
+
+    def _item_cost(self, tracker):
+        if self.item_latency[tracker] > 0:
+            return self.item_latency[tracker]
+        
+        measured = [latency for latency in self.item_latency.values() if latency > 0]
+        if len(measured) == 0:
+            return 1.0
+        return sum(measured) / len(measured)
+
+#==========================================================================================
+# Every item goes to the cheapest tracker
+#==========================================================================================
+
+class LeastLoaded(Placement):
+
+    # ---------------------------------------------------------------------------------
+    # Moves items of the video from the most expensive tracker that has items of the
+    # video to the cheapest tracker, if the first is overloaded
+    # ---------------------------------------------------------------------------------
+
+    def rebalance(self, video_name, video_items):
+        sources = [tracker for tracker in self.trackers if video_items.get(tracker, 0) > 0]
+        if len(sources) == 0:
+            return []
+
+        source = max(sources, key = self.cost)
+        target = self._cheapest()
+
+        # move half of the difference, at most the items the video has on the source
+        count = min(self.max_moves, video_items[source],
+                    max(1, (self.items[source] - self.items[target]) // 2))
+        if source == target or not self._overloaded(source, target, count):
+            return []
+
+        self._placed[source] -= count
+        self._placed[target] += count
+
+        return [(source, target, count)]
+
+#==========================================================================================
+# All the items of a video go to the same tracker, chosen by hashing the video name.
+# Every tracker has 'replicas' points on the ring, so that the videos are evenly
+# spread and adding a tracker only moves the videos of one arc of the ring
+#==========================================================================================
+
+class ConsistentHash(Placement):
+
+    replicas = 64
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, trackers, imbalance = 0.25, max_moves = 3):
+        super().__init__(trackers, imbalance, max_moves)
+        self._ring = sorted(
+            (ConsistentHash._hash(tracker + ":" + str(i)), tracker)
+            for tracker in self.trackers for i in range(ConsistentHash.replicas))
+        self._points = [point for point, tracker in self._ring]
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # First tracker clockwise from the hash of the video on the ring
+    # ---------------------------------------------------------------------------------
+
+    def _choose(self, video_name):
+        pos = bisect.bisect(self._points, ConsistentHash._hash(video_name))
+        return self._ring[pos % len(self._ring)][1]
+
+    # ---------------------------------------------------------------------------------
+    # Python's hash is salted per process, a stable hash is needed so that every
+    # process places the videos on the same trackers
+    # ---------------------------------------------------------------------------------
+
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+#==========================================================================================
+# All the items of a video go to one tracker, the cheapest one when the first item
+# of the video is placed.  If that tracker gets overloaded, the video moves to the
+# cheapest tracker: new items go there and the old items move gradually
+#==========================================================================================
+
+class Locality(Placement):
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, trackers, imbalance = 0.25, max_moves = 3):
+        super().__init__(trackers, imbalance, max_moves)
+        # tracker and number of items of every video
+        self._home = {}
+        self._size = {}
+
+    # ---------------------------------------------------------------------------------
+    # Moves the items of the video that are not on its tracker
+    # ---------------------------------------------------------------------------------
+
+    def rebalance(self, video_name, video_items):
+        self._size[video_name] = sum(video_items.values())
+        home = self._choose(video_name)
+
+        moves = []
+        for tracker in self.trackers:
+            count = min(self.max_moves, video_items.get(tracker, 0))
+            if tracker != home and count > 0:
+                self._placed[tracker] -= count
+                self._placed[home] += count
+                moves.append((tracker, home, count))
+
+        return moves
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Tracker of the video.  The video moves if its tracker would still be overloaded
+    # after moving all the items of the video to the cheapest tracker
+    # ---------------------------------------------------------------------------------
+
+    def _choose(self, video_name):
+        home = self._home.get(video_name)
+        cheapest = self._cheapest()
+
+        if home == None or (home != cheapest and
+                            self._overloaded(home, cheapest,
+                                             self._size.get(video_name, 0))):
+            if home != None:
+                logging.info("%s: moving from tracker %s to %s", video_name, home,
+                             cheapest)
+            self._home[video_name] = cheapest
+
+        return self._home[video_name]
+
+Placement.policies = {
+    'least_loaded': LeastLoaded,
+    'consistent_hash': ConsistentHash,
+    'locality': Locality
+}
@@ -11,8 +11,13 @@
 
 import itertools
 import logging
+import collections
+
+import numpy as np
 
 from object_flow.flow.item import Item
+from object_flow.flow.item_store import ItemStore
+from object_flow.flow.line_counter import LineCounter
 from object_flow.util.geom import Geom
 from object_flow.flow.csv import CSV
 
@@ -23,6 +28,9 @@ from object_flow.flow.csv import CSV
 
 class Setting:
 
+    # size in pixels of the cells of the spatial index of the items
+    grid_cell = 64
+    
     # ---------------------------------------------------------------------------------
     #
     # ---------------------------------------------------------------------------------
@@ -30,15 +38,29 @@ class Setting:
     def __init__(self, cfg, buffer_size):
         self.cfg = cfg
         self._set_counters()
+        self._counter = LineCounter(cfg.data['counting_lines'])
 
         CSV.initialize(cfg)
         
         # id of the next item
         self.next_item_id = 0
         
-        # dictionary of items in this setting
+        # dictionary of items in this setting.  Items should be added and removed
+        # with 'add_item' and 'remove_item' so that the spatial index is kept updated
         self.items = {}
 
+        # spatial index: ids of the items whose bounding box covers every cell of a
+        # grid of 'grid_cell' pixels, and cells covered by every item
+        self._grid = collections.defaultdict(set)
+        self._item_cells = {}
+
+        # optional columnar storage of the state of the items, see ItemStore.  When
+        # used, updating, counting and checking for disappeared items is done on
+        # all the items at once
+        self._store = None
+        if cfg.data['trackable_objects']['item_store'] == 'True':
+            self._store = ItemStore(cfg.data['counting_lines'].keys())
+
         # Controls in which index in the buffer the item is stored
         self._mmap_indexes = list(range(0, buffer_size - 1))
         self._in_use_indexes = []
@@ -51,10 +73,14 @@ class Setting:
     
     # ---------------------------------------------------------------------------------
     # Add new detected elements to the setting if they are not already tracked and
-    # returns the added elements as Items
+    # returns the added elements as Items.  'frame_number' is the frame on which the
+    # elements were detected, by default the current frame
     # ---------------------------------------------------------------------------------
 
-    def detections2items(self, bboxes, confidences, class_ids):
+    def detections2items(self, bboxes, confidences, class_ids, frame_number = None):
+
+        if frame_number == None:
+            frame_number = self.cfg.frame_number
 
         # Checks if the item should be added/removed from the Setting.  Items should
         # only be in the Setting if they are inside the entry lines.
@@ -66,8 +92,28 @@ class Setting:
         # add the counting lines to all new items
         for item in self.new_inputs:
             for key in self.cfg.data['counting_lines']:
-                item.init_lines(key, self.cfg.frame_number)
+                item.init_lines(key, frame_number)
+
+    # ---------------------------------------------------------------------------------
+    # Adds an item to the setting
+    # ---------------------------------------------------------------------------------
+
+    def add_item(self, item_id, item):
+        self.items[item_id] = item
+        self._index_item(item_id)
+        if self._store != None:
+            self._store.add(item_id, item)
 
+    # ---------------------------------------------------------------------------------
+    # Removes an item from the setting
+    # ---------------------------------------------------------------------------------
+
+    def remove_item(self, item_id):
+        del self.items[item_id]
+        self._unindex_item(item_id)
+        if self._store != None:
+            self._store.remove(item_id)
+        
     # ---------------------------------------------------------------------------------
     # After tracking is done, for each tracked item, update_item is called so that
     # it's bounding_box is adjusted to the tracker's information
@@ -84,6 +130,34 @@ class Setting:
         self.items[item_id].tracker_update(
             frame_number, confidence, bounding_box[0], bounding_box[1],
             bounding_box[2], bounding_box[3])
+
+        if self._cells(self.items[item_id]) != self._item_cells[item_id]:
+            self._unindex_item(item_id)
+            self._index_item(item_id)
+
+    # ---------------------------------------------------------------------------------
+    # Updates the items with the tracking information of a tracker: arrays with the
+    # ids, confidences and bounding boxes of the items.  Items lost by the tracker
+    # (confidence -1) or that have exited the setting are not updated and their ids
+    # are returned, so that they can be removed
+    # ---------------------------------------------------------------------------------
+
+    def update_items(self, frame_number, ids, confidences, boxes):
+
+        if self._store != None:
+            return self._update_rows(frame_number, ids, confidences, boxes)
+
+        exited = []
+        for item_id, confidence, bounding_box in zip(ids.tolist(), confidences,
+                                                     boxes):
+            # check if item has exited the scene: lost by the tracker or out of the
+            # entry lines.  Those that have not exited, should be updated
+            if confidence == -1 or self.check_exit(bounding_box):
+                exited.append(item_id)
+            else:
+                self.update_item(frame_number, item_id, confidence, bounding_box)
+
+        return exited
     
     # ---------------------------------------------------------------------------------
     # Checks all tracked objects and drop those that have similar bounding boxes.
@@ -94,19 +168,30 @@ class Setting:
     def find_overlap(self):
 
         overlapped = []
-        
-        begin = 0
+
         keys = list(self.items.keys())
-        while begin < len(keys):
+        order = {item_id: i for i, item_id in enumerate(keys)}
+        boxes = Geom.boxes(list(self.items.values()))
+        drop_overlap = self.cfg.data['trackable_objects']['drop_overlap']
+        
+        for i, item_id in enumerate(keys):
             # If two tracked objects overlap then mark the last one to be removed, if they
             # are both going the same direction. If they are going different directions,
-            # they are probably not the same object.  Method __has_overlap does this
-            # check
-            overlap = self._has_overlap(self.items[keys[begin]], begin + 1)
-            if (overlap > 0):
-                overlapped.append(overlap)
-                
-            begin += 1
+            # they are probably not the same object.  Only the items that come after
+            # this one and share a cell of the grid with it can overlap it
+            candidates = set()
+            for cell in self._item_cells[item_id]:
+                candidates.update(self._grid[cell])
+            later = sorted(order[other] for other in candidates if order[other] > i)
+            if len(later) == 0:
+                continue
+
+            iou = Geom.iou_matrix(boxes[i], boxes[later])[0]
+            direction = self.items[item_id].direction
+            for j in np.nonzero(iou > drop_overlap)[0]:
+                if self.items[keys[later[j]]].direction == direction:
+                    overlapped.append(keys[later[j]])
+                    break
 
         return overlapped
     
@@ -120,6 +205,13 @@ class Setting:
 
     def check_disappeared(self, frame_number, disappear_after):
 
+        if self._store != None:
+            delete = self._store.disappeared(frame_number, disappear_after)
+            for item_id in delete:
+                self.items[item_id].disappeared = True
+                self.items[item_id].last_frame = self.cfg.frame_number
+            return delete
+
         delete = []
         
         if len(self.items) != 0:
@@ -156,39 +248,82 @@ class Setting:
                 return True
 
         return False
+
+    # ---------------------------------------------------------------------------------
+    # check_exit for every bounding box in the (N, 4) array 'boxes'
+    # ---------------------------------------------------------------------------------
+
+    def check_exits(self, boxes):
+        lines = [spec['end_points'] for spec in self.cfg.data['entry_lines'].values()]
+        if len(lines) == 0 or len(boxes) == 0:
+            return np.zeros(len(boxes), dtype = bool)
+
+        top = Geom.point_positions(boxes[:, :2], lines)
+        bottom = Geom.point_positions(boxes[:, 2:], lines)
+        return (top != bottom).any(axis = 1)
                     
     # ---------------------------------------------------------------------------------
     #
     # ---------------------------------------------------------------------------------
 
     # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # update_items on the item store: all the items are updated at once and only
+    # the items that moved to other cells of the grid are indexed again
+    # ---------------------------------------------------------------------------------
+
+    def _update_rows(self, frame_number, ids, confidences, boxes):
+        boxes = np.asarray(boxes, dtype = np.int64).reshape(-1, 4)
+        exited = (confidences == -1) | self.check_exits(boxes)
+
+        # item might have disappeared after tracking started
+        rows = self._store.rows(ids[~exited].tolist())
+        found = rows >= 0
+        rows, boxes = rows[found], boxes[~exited][found]
+
+        moved = ((self._store.boxes[rows] // Setting.grid_cell) !=
+                 (boxes // Setting.grid_cell)).any(axis = 1)
+
+        self._store.update(rows, frame_number, confidences[~exited][found], boxes)
+        self._store.sync(rows)
+
+        for item_id in self._store.ids[rows[moved]].tolist():
+            self._unindex_item(item_id)
+            self._index_item(item_id)
+
+        return ids[exited].tolist()
     
     # ---------------------------------------------------------------------------------
-    # Check if two trackable objects have an iou grater than a given value. If they
-    # have, return the index of the trackable object that overlaps the given object
+    # Cells of the grid covered by the bounding box of the item
     # ---------------------------------------------------------------------------------
 
-    def _has_overlap(self, item, min_index):
+    def _cells(self, item):
+        return [(x, y)
+                for x in range(int(item.startX) // Setting.grid_cell,
+                               int(item.endX) // Setting.grid_cell + 1)
+                for y in range(int(item.startY) // Setting.grid_cell,
+                               int(item.endY) // Setting.grid_cell + 1)]
 
-        keys = list(self.items.keys())
-        
-        for i in range(min_index, len(keys)):
-            ti = self.items[keys[i]]
-            try: 
-                iou = Geom.iou(item.startX, item.startY, item.endX, item.endY,
-                               ti.startX, ti.startY, ti.endX, ti.endY,)
-            except OverflowError:
-                logging.info("%s: has_overlap overflow: (%d, %d, %d, %d)-(%d, %d, %d, %d)",
-                             self.video_name, 
-                             item.startX, item.startY, item.endX, item.endY,
-                             ti.startX, ti.startY, ti.endX, ti.endY)
-                iou = 0
-            
-            if (iou > self.cfg.data['trackable_objects']['drop_overlap'] and
-                  item.direction == ti.direction):
-                return keys[i]
-            
-        return -1
+    # ---------------------------------------------------------------------------------
+    # Adds the item to the cells it covers
+    # ---------------------------------------------------------------------------------
+
+    def _index_item(self, item_id):
+        cells = self._cells(self.items[item_id])
+        for cell in cells:
+            self._grid[cell].add(item_id)
+        self._item_cells[item_id] = cells
+
+    # ---------------------------------------------------------------------------------
+    # Removes the item from the cells it covered
+    # ---------------------------------------------------------------------------------
+
+    def _unindex_item(self, item_id):
+        for cell in self._item_cells.pop(item_id):
+            self._grid[cell].discard(item_id)
+            if len(self._grid[cell]) == 0:
+                del self._grid[cell]
     
     # ----------------------------------------------------------------------------------
     #
@@ -303,155 +438,10 @@ class Setting:
                 
         return valid_boxes
     
-    # ---------------------------------------------------------------------------------
-    #
-    # ---------------------------------------------------------------------------------
-
-    def _should_count(self, obj_line):
-        
-        if (not obj_line['counted'] or
-            (self.cfg.frame_number > obj_line['counted_frame'] + 30)):
-            # once an object crosses the counting line it is no longer considered
-            # a split object
-            obj_line['split'] = False
-            obj_line['counted'] = True
-            obj_line['counted_frame'] = self.cfg.frame_number
-            return True
-        
-        return False
-                
-    # ---------------------------------------------------------------------------------
-    # Top line of the bounding box has crossed the counting line. This is called
-    # for split objects going 'South': we will count them when the top line crosses
-    # the counting line, since the bottom line will not cross the counting line
-    # ---------------------------------------------------------------------------------
-
-    def _top_crossed(self, item, item_line, spec, new_top):
-        top_point = item_line['top_point']
-        first_point = spec['first_point']
-        second_point = spec['second_point']
-
-        try:
-            if (not Geom.intersect(top_point[0], top_point[1], item.startX,
-                                   item.startY, first_point[0], first_point[1],
-                                   second_point[0], second_point[1])):
-                return
-        
-        except OverflowError:
-            logging.warning(
-                "%s: top_crossed: overflow error: (%d, %d, %d, %d)-(%d, %d)",
-                self.cfg.video_name, top_point[0], top_point[1], item.startX,
-                item.startY, first_point[0], first_point[1],
-                second_point[0], second_point[1])
-            
-        if (self._should_count(item_line)):
-            if new_top:
-                spec[spec["exit_side1"]] += 1
-        
-    # ---------------------------------------------------------------------------------
-    #
-    # ---------------------------------------------------------------------------------
-
-    def _has_top_crossed(self, item, key, spec, new_top):
-        item_line = item.lines[key]
-
-        if (spec['count_splits'] == 'True' and item_line['split'] == True and
-            item.dirY == 'South' and item_line['top_line_position'] != new_top):
-            self._top_crossed(item, item_line, spec, new_top)
-        
-            # debugging information
-            if item.item_id == self.track_item:
-                logging.info("frame_number %d: item %d bottom line has crossed line %s",
-                             self.cfg.frame_number, item.item_id, key)
-                if item_line['split'] == True:
-                    logging.info("item %d is a split item in relation to line %s",
-                                 item.item_id, key)
-            # end debugging information
-
-    
-    # ---------------------------------------------------------------------------------
-    # Bottom line of the bounding box has crossed the counting line
-    # ---------------------------------------------------------------------------------
-
-    def _bottom_crossed(self, item, item_line, spec, new_bottom):
-        bottom_point = item_line['bottom_point']
-        first_point = spec['first_point']
-        second_point = spec['second_point']
-
-        logging.debug("checking bottom_crossed for camera %s", self.cfg.video_name)
-
-        if item.item_id == self.track_item:
-            logging.info("frame_number %d: item %d counting bottom crossed",
-                         self.cfg.frame_number, item.item_id)
-                        
-        try:
-            if (not Geom.intersect(bottom_point[0], bottom_point[1], item.endX,
-                                   item.endY, first_point[0], first_point[1],
-                                   second_point[0], second_point[1])):
-                
-                if item.item_id == self.track_item:
-                    logging.info("frame_number %d: item %d returning without counting",
-                                 self.cfg.frame_number, item.item_id)
-                return
-            
-        except OverflowError:
-            logging.warning(
-                "bottom_crossed: overflow error: (%d, %d, %d, %d)-(%d, %d) for camera %s",
-                bottom_point[0], bottom_point[1], item.endX,
-                item.endY, first_point[0], first_point[1],
-                second_point[0], second_point[1], self.cfg.video_name)
-
-                    
-        if (self._should_count(item_line)):
-            if not new_bottom:
-                spec[spec["enter_side1"]] += 1
-            else:
-                spec[spec["exit_side1"]] += 1
-        
-    # ---------------------------------------------------------------------------------
-    # Checks if the bottom line has crossed the counting line. If this is a new
-    # item, then check to see if this item was split by the counting line. As split
-    # item should be counted, if it is going down the image, when the top line
-    # crosses the counting line
-    # ---------------------------------------------------------------------------------
-
-    def _has_bottom_crossed(self, item, key, spec, new_bottom): 
-        item_line = item.lines[key]
-                        
-        # did the bottom line cross the count line. Bottom has crossed the line
-        # and the direction was set
-        if (item_line["bottom_line_position"] != new_bottom and
-            ((item.dirY != None) or (item.dirX != None))):
-            self._bottom_crossed(item, item_line, spec, new_bottom)
-            
-            # debugging information
-            if item.item_id == self.track_item:
-                logging.info("frame_number %d: item %d bottom line has crossed line %s",
-                             self.cfg.frame_number, item.item_id, key)
-                if item_line['split'] == True:
-                    logging.info("item %d is a split item in relation to line %s",
-                                 item.item_id, key)
-            # end debugging information
-            
-    # ---------------------------------------------------------------------------------
-    # returns the position of the top and bottom lines of the bounding box in relation
-    # to a given line. (startX, startY) is checked as top line and (endX, endY) is
-    # considered as the bottom line
-    # ---------------------------------------------------------------------------------
-
-    def _find_positions(self, item, spec):
-        
-        end_points = spec["end_points"]
-        # find the top position in relation to the given line
-        new_top = self._position_item_line(end_points, item.startX, item.startY, 'top')
-        # find the bottom position in relation to the given line
-        new_bottom = self._position_item_line(end_points, item.endX, item.endY, 'bottom')
-        
-        return(new_top, new_bottom)
-    
     # ---------------------------------------------------------------------------------
     # Count the items crossing the 'counting lines' given in the configuration
-    # file.
+    # file.  All the items are checked against all the lines at once by the
+    # LineCounter
     # ---------------------------------------------------------------------------------
 
     def _count(self):
@@ -459,24 +449,85 @@ class Setting:
         # this value should be set by a service in flow_manager, through a UI
         self.track_item = None
 
-        # for every counting line
-        for key, spec in self.cfg.data["counting_lines"].items():
-            # for every item, see if it has crossed the counting line
-            logging.debug("counting items is respect to line %s", key)
-            for item_id, item in self.items.items():
-                logging.debug("checking item %d", item_id)
-                
-                new_top, new_bottom = self._find_positions(item, spec)
+        if len(self.items) == 0 or len(self._counter.keys) == 0:
+            return
 
-                if (item.lines[key]['bottom_line_position'] != None):
-                    # bottom line has crossed the counting line?
-                    self._has_bottom_crossed(item, key, spec, new_bottom)
-                    
-                    # top line has crossed the counting line?
-                    self._has_top_crossed(item, key, spec, new_top)
-                else:
-                    if new_top != new_bottom:
-                        item.lines[key]['split'] = True
-
-                item.lines[key]['top_line_position'] = new_top
-                item.lines[key]["bottom_line_position"] = new_bottom
+        if self._store != None:
+            store = self._store
+            rows = store.active()
+            ids = store.ids[rows].tolist()
+            state = {name: getattr(store, name)[rows] for name in LineCounter.state}
+            counted = self._counter.count(self.cfg.frame_number, store.boxes[rows],
+                                          store.dir_x[rows], store.dir_y[rows], state)
+            for name in LineCounter.state:
+                getattr(store, name)[rows] = state[name]
+        else:
+            ids = list(self.items.keys())
+            items = list(self.items.values())
+            state = self._lines_state(items)
+            counted = self._counter.count(
+                self.cfg.frame_number, Geom.boxes(items),
+                [ItemStore.dir_x_names.index(item.dirX) for item in items],
+                [ItemStore.dir_y_names.index(item.dirY) for item in items], state)
+            self._set_lines_state(items, state)
+
+        # debugging information
+        if self.track_item in ids:
+            i = ids.index(self.track_item)
+            for j in np.nonzero(counted[i])[0]:
+                logging.info("frame_number %d: item %d counted on line %s",
+                             self.cfg.frame_number, self.track_item,
+                             self._counter.keys[j])
+        # end debugging information
+
+    # ---------------------------------------------------------------------------------
+    # State of the items in relation to the counting lines, as arrays for the
+    # LineCounter
+    # ---------------------------------------------------------------------------------
+
+    def _lines_state(self, items):
+        lines = [[item.lines[key] for key in self._counter.keys] for item in items]
+
+        return {
+            'top_position': np.array(
+                [[-1 if line['top_line_position'] == None else line['top_line_position']
+                  for line in item_lines] for item_lines in lines], dtype = np.int8),
+            'bottom_position': np.array(
+                [[-1 if line['bottom_line_position'] == None else
+                  line['bottom_line_position'] for line in item_lines]
+                 for item_lines in lines], dtype = np.int8),
+            'counted_frame': np.array(
+                [[line['counted_frame'] for line in item_lines] for item_lines in lines],
+                dtype = np.int64),
+            'split': np.array(
+                [[line['split'] for line in item_lines] for item_lines in lines],
+                dtype = bool),
+            'counted': np.array(
+                [[line['counted'] for line in item_lines] for item_lines in lines],
+                dtype = bool),
+            'top_point': np.array(
+                [[line['top_point'] for line in item_lines] for item_lines in lines],
+                dtype = np.int64),
+            'bottom_point': np.array(
+                [[line['bottom_point'] for line in item_lines] for item_lines in lines],
+                dtype = np.int64)}
+
+    # ---------------------------------------------------------------------------------
+    # Writes back to the items the state updated by the LineCounter.  Points are
+    # never changed by counting
+    # ---------------------------------------------------------------------------------
+
+    def _set_lines_state(self, items, state):
+        for item, tops, bottoms, counted_frames, splits, counteds in zip(
+                items, state['top_position'].tolist(),
+                state['bottom_position'].tolist(), state['counted_frame'].tolist(),
+                state['split'].tolist(), state['counted'].tolist()):
+            for key, top, bottom, counted_frame, split, counted in zip(
+                    self._counter.keys, tops, bottoms, counted_frames, splits,
+                    counteds):
+                line = item.lines[key]
+                line['top_line_position'] = top == 1
+                line['bottom_line_position'] = bottom == 1
+                line['counted_frame'] = counted_frame
+                line['split'] = split
+                line['counted'] = counted
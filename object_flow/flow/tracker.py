@@ -14,6 +14,7 @@
 
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -64,10 +65,21 @@ class Tracker(Doer):
     #
     # ----------------------------------------------------------------------------------
 
-    def __initialize__(self, id, tracker_type = 'dlib'):
+    def __initialize__(self, id, tracker_type = 'dlib', mmap_backend = 'file',
+                       num_threads = 1):
         # this tracker id
         self.id = id
         self.tracker_type = tracker_type
+        self.mmap_backend = mmap_backend
+        # id of this tracker when holding slots of the frames ring
+        self._reader_id = MmapFrames.TRACKER_READER + id
+
+        # dlib and opencv trackers release the GIL while updating, so the items of
+        # a frame are updated by a pool of threads shared by all videos
+        self.num_threads = num_threads
+        self._pool = None
+        if num_threads > 1:
+            self._pool = ThreadPoolExecutor(max_workers = num_threads)
             
     # ----------------------------------------------------------------------------------
     # 
@@ -75,7 +87,12 @@ class Tracker(Doer):
 
     def terminate(self):
         super().terminate()
-        self._mmap.close()
+        if self._pool != None:
+            self._pool.shutdown()
+        for video in self.videos.values():
+            # views on the mmap must be released before closing it
+            video['views'].clear()
+            video['frames'].close()
     
     # ----------------------------------------------------------------------------------
     # 
@@ -96,14 +113,23 @@ class Tracker(Doer):
 
     def register_video(self, video_name, video_id, width, height, depth):
         self.videos[video_name] = {}
-        self.videos[video_name]['items'] = {}
+        # items tracked on the video: the id of item 'i' is ids[i], its tracker is
+        # trackers[i] and its last position, as (startX, startY, endX, endY), is
+        # boxes[i]
+        self.videos[video_name]['ids'] = np.empty(0, dtype = np.int64)
+        self.videos[video_name]['trackers'] = []
+        self.videos[video_name]['confidences'] = np.empty(0, dtype = np.float64)
+        self.videos[video_name]['boxes'] = np.empty((0, 4), dtype = np.uint16)
         self.videos[video_name]['video_id'] = video_id
         self.videos[video_name]['width'] = width
         self.videos[video_name]['height'] = height
         self.videos[video_name]['depth'] = depth
         self.videos[video_name]['frame_size'] = width * height * depth
-        self.videos[video_name]['frames'] = MmapFrames(video_name, width, height, depth)
+        self.videos[video_name]['frames'] = MmapFrames(video_name, width, height, depth,
+                                                       self.mmap_backend)
         self.videos[video_name]['frames'].open_read()
+        # views of the frames ring, one per slot, created on first use
+        self.videos[video_name]['views'] = {}
         
     # ----------------------------------------------------------------------------------
     # Starts tracking a list of items in a video frame.  This is the preferred way of
@@ -113,20 +139,26 @@ class Tracker(Doer):
 
     def tracks_list(self, video_name, frame_index, items):
         
-        frame = self._get_frame(video_name, frame_index)
+        frame = self._hold_frame(video_name, frame_index)
         
-        # gets the correct list of video items.
-        video_items = self.videos.get(video_name)['items']
+        video = self.videos[video_name]
         
         for item in items:
             # add this dlib tracker to the list of tracked items by this tracker for the
             # specified video
-            tracker = self._start_tracker(
-                frame, item.startX, item.startY, item.endX, item.endY)
-            video_items.update({item.item_id:tracker})
-            
-            self.videos[video_name]['items'] = video_items
-
+            video['trackers'].append(self._start_tracker(
+                frame, int(item.startX), int(item.startY), int(item.endX),
+                int(item.endY)))
+
+        video['ids'] = np.append(video['ids'], [item.item_id for item in items])
+        video['confidences'] = np.append(video['confidences'], np.zeros(len(items)))
+        video['boxes'] = np.append(
+            video['boxes'],
+            np.array([(item.startX, item.startY, item.endX, item.endY) for item in items],
+                     dtype = np.uint16).reshape(-1, 4), axis = 0)
+
+        self._release_frame(video_name, frame_index)
+        
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -135,50 +167,81 @@ class Tracker(Doer):
 
         Stopwatch.start('update_tracking')
         self._total_frames += 1
-        logging.debug("%s: number of tracked items is %d", str(self.id),
-                      len(self.videos[video_name]['items']))
+
+        video = self.videos[video_name]
+        num_items = len(video['trackers'])
+        logging.debug("%s: number of tracked items is %d", str(self.id), num_items)
         
-        if len(self.videos[video_name]['items']) == 0:
-            return None
+        if num_items == 0:
+            return self._tracking_reply(video, 0.0)
         
-        frame = self._get_frame(video_name, frame_index)
-        width = self.videos[video_name]['width']
-        height = self.videos[video_name]['height']
+        start = time.perf_counter()
+        frame = self._hold_frame(video_name, frame_index)
+
+        confidences = np.empty(num_items, dtype = np.float64)
+        positions = np.empty((num_items, 4), dtype = np.float64)
         
-        video_items = self.videos[video_name]['items']
-        detections = {}
+        if self._pool == None or num_items == 1:
+            self._update_trackers(frame, video['trackers'], confidences, positions,
+                                  0, num_items)
+        else:
+            # one chunk of items per thread.  Every thread writes the results of its
+            # chunk in place, so results are in the order of the items
+            bounds = np.linspace(0, num_items, min(self.num_threads, num_items) + 1,
+                                 dtype = np.int64).tolist()
+            futures = [self._pool.submit(self._update_trackers, frame,
+                                         video['trackers'], confidences, positions,
+                                         begin, end)
+                       for begin, end in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+
+        self._release_frame(video_name, frame_index)
+
+        positions = self._fix_positions(positions, video['width'], video['height'])
         
-        for item_id, tracker in video_items.items():
-            confidence, pos = self._update_tracker(frame, tracker, width, height)
-            if (any(x < 0 for x in pos) or any (x > 65535 for x in pos)):
-                confidence = -1
-                pos = [0, 0, 0, 0]
-            else:
-                pos = np.array(pos, dtype=np.uint16)
-                
-            detections[item_id] = (confidence, pos)
+        # positions that cannot be represented are lost items
+        lost = ((positions < 0) | (positions > 65535)).any(axis = 1)
+        confidences[lost] = -1
+        positions[lost] = 0
 
+        video['confidences'] = confidences
+        video['boxes'] = positions.astype(np.uint16)
+        
         Stopwatch.stop('update_tracking') 
         # Stopwatch.report(str(self.id), self._total_frames)       
         
-        return detections
+        return self._tracking_reply(video, (time.perf_counter() - start) / num_items)
 
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
 
     def stop_tracking(self, video_name, item_id):
-        video_items = self.videos[video_name]['items']
-        del video_items[item_id]
+        self.stop_tracking_items(video_name, [item_id])
     
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
 
     def stop_tracking_items(self, video_name, items_ids):
-        for item_id in items_ids:
-            del self.videos[video_name]['items'][item_id]
+        video = self.videos[video_name]
+        keep = ~np.isin(video['ids'], items_ids)
+        
+        video['ids'] = video['ids'][keep]
+        video['trackers'] = [tracker for tracker, k in zip(video['trackers'], keep) if k]
+        video['confidences'] = video['confidences'][keep]
+        video['boxes'] = video['boxes'][keep]
             
+    # ----------------------------------------------------------------------------------
+    # Messages are processed in order: when this message is answered, the messages
+    # sent before it by the FlowManager of the video, and the frames they use, are
+    # done.  Returns the given 'token'
+    # ----------------------------------------------------------------------------------
+
+    def acknowledge(self, video_name, token):
+        return token
+    
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -199,8 +262,29 @@ class Tracker(Doer):
 
     def _get_frame(self, video_name, frame_index):
 
-        header, frame = self.videos[video_name]['frames'].read_data(frame_index)
-        return frame
+        # the view of a slot is always the same and sees whatever frame is written
+        # on the slot, so it is read only once
+        views = self.videos[video_name]['views']
+        if frame_index not in views:
+            header, views[frame_index] = (
+                self.videos[video_name]['frames'].read_data(frame_index))
+        return views[frame_index]
+    
+    # ----------------------------------------------------------------------------------
+    # Holds the slot of the frames ring, so that the decoder does not overwrite it,
+    # and returns the frame
+    # ----------------------------------------------------------------------------------
+
+    def _hold_frame(self, video_name, frame_index):
+        self.videos[video_name]['frames'].acquire(frame_index, self._reader_id)
+        return self._get_frame(video_name, frame_index)
+    
+    # ----------------------------------------------------------------------------------
+    #
+    # ----------------------------------------------------------------------------------
+
+    def _release_frame(self, video_name, frame_index):
+        self.videos[video_name]['frames'].release(frame_index, self._reader_id)
     
     # ----------------------------------------------------------------------------------
     #
@@ -221,39 +305,57 @@ class Tracker(Doer):
         
         return tracker
                 
+    # ----------------------------------------------------------------------------------
+    # Reply to 'update_tracked_items': the name of this tracker, the items of the
+    # video and the load of this tracker (number of items of all videos and seconds
+    # taken to update one item of the video), used for placing new items
+    # ----------------------------------------------------------------------------------
+
+    def _tracking_reply(self, video, item_latency):
+        num_items = sum(len(v['ids']) for v in self.videos.values())
+        return (self.name, video['ids'], video['confidences'], video['boxes'],
+                num_items, item_latency)
+                
+    # ----------------------------------------------------------------------------------
+    # Updates the trackers from 'begin' to 'end' (excluded) writing their confidences
+    # and positions on the given arrays.  Runs on the thread pool
+    # ----------------------------------------------------------------------------------
+
+    def _update_trackers(self, frame, trackers, confidences, positions, begin, end):
+        for i in range(begin, end):
+            confidences[i], positions[i] = self._update_tracker(frame, trackers[i])
+            
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
 
-    def _update_tracker(self, frame, tracker, width, height):
+    def _update_tracker(self, frame, tracker):
 
         if self.tracker_type == 'dlib':
             confidence = tracker.update(frame)
             position = tracker.get_position()
-            
-            # make sure that the values are positive integers in the range (0, 0)
-            # (width, height)
-            pl = int(position.left())
-            if pl < 0:
-                pl = 0
-                
-            pt = int(position.top())
-            if pt < 0:
-                pt = 0
-                
-            pr = int(position.right())
-            if pr > width:
-                pr = width
-                
-            pb = int(position.bottom())
-            if pb > height:
-                pb = height
-
-            position = [pl, pt, pr, pb]
+            position = (position.left(), position.top(), position.right(),
+                        position.bottom())
         # if not a dlib tracker, it is a cv2 tracker
         else:
             confidence, position = tracker.update(frame)
             position = (position[0], position[1], position[0] + position[2],
                         position[1] + position[3])
 
-        return (confidence, [int(value) for value in position])
+        return (confidence, position)
+                    
+    # ----------------------------------------------------------------------------------
+    # Converts the positions returned by the trackers, one row per item, to integers.
+    # dlib positions are also clipped to the range (0, 0) (width, height)
+    # ----------------------------------------------------------------------------------
+
+    def _fix_positions(self, positions, width, height):
+
+        positions = np.trunc(positions)
+        
+        if self.tracker_type == 'dlib':
+            np.maximum(positions[:, :2], 0, out = positions[:, :2])
+            np.minimum(positions[:, 2], width, out = positions[:, 2])
+            np.minimum(positions[:, 3], height, out = positions[:, 3])
+
+        return positions
@@ -42,6 +42,8 @@ class Doer(Actor):
         
         self._doers = {}
         self._doers['default'] = {}
+        # set by 'defer_reply' while processing an 'ask' message
+        self._reply_deferred = False
         
     # ----------------------------------------------------------------------------------
     # After a Doer has initialized, going throuhg '_set_id_' and '__initialize__' the
@@ -148,6 +150,27 @@ class Doer(Actor):
         memo = Memo(method, *args, memo_type = 'tell', **kwargs)
         self.send(self.last_message_sender, memo)
                 
+    # ----------------------------------------------------------------------------------
+    # Called while processing an 'ask' message whose answer is not yet available, for
+    # instance because it depends on other messages.  No reply is sent when the
+    # method returns; the returned token should be given to 'reply_deferred' to
+    # answer the message later
+    # ----------------------------------------------------------------------------------
+
+    def defer_reply(self):
+        self._reply_deferred = True
+        return (self.last_message, self.last_message_sender)
+                
+    # ----------------------------------------------------------------------------------
+    # Answers an 'ask' message deferred by 'defer_reply'
+    # @param token [Tuple] token returned by 'defer_reply'
+    # @param return_value value sent to the callback
+    # ----------------------------------------------------------------------------------
+
+    def reply_deferred(self, token, return_value):
+        message, sender = token
+        self._response(return_value, message, sender)
+                
     # ----------------------------------------------------------------------------------
     #
     # ----------------------------------------------------------------------------------
@@ -214,6 +237,7 @@ class Doer(Actor):
 
         self.last_message = message
         self.last_message_sender = sender
+        self._reply_deferred = False
 
         if isinstance(message, Memo):
             # logging.debug("%s, %s: got a Memo: %s", self.name, self.group, message._method)
@@ -223,14 +247,15 @@ class Doer(Actor):
             ret = method(*message._args, **message._kwargs)
 
             # if it's as 'ask' message, then we should reply to it
-            if message._memo_type == 'ask':
+            if message._memo_type == 'ask' and not self._reply_deferred:
                 # logging.debug("%s, %s, %s, %s", Util.br_time(), "all", os.getpid(), 
                 #               "receiveMessage sending response")
-                self._response(ret)
+                self._response(ret, message, sender)
             elif message._memo_type == 'hire':
                 # logging.debug("%s, %s, %s, %s", Util.br_time(), "all", os.getpid(), 
                 #               "receiveMessage hiring done")
-                self._response((self.name, self.group, self.myAddress))
+                self._response((self.name, self.group, self.myAddress), message,
+                               sender)
 
         elif isinstance(message, ActorExitRequest):
             self.actor_exit_request(message, sender)
@@ -297,24 +322,23 @@ class Doer(Actor):
             logging.info("doer: %s is not in the group: %s", whom, group)
 
     # ----------------------------------------------------------------------------------
-    # Sends a message to the sender of the last message, unless the message has a
-    # reply to field. In this case, the response should be sent to the reply_to
-    # address
+    # Sends a message to the sender of the message, unless the message has a reply
+    # to field. In this case, the response should be sent to the reply_to address
     # ----------------------------------------------------------------------------------
 
-    def _response(self, return_value):
+    def _response(self, return_value, message, sender):
 
-        callback = self.last_message._callback
+        callback = message._callback
         
         if isinstance(return_value, tuple):
             memo = Memo(callback, *return_value, memo_type = 'reply')
         else:
             memo = Memo(callback, return_value, memo_type = 'reply')
                         
-        if self.last_message._reply_to != None:
-            recipient = self.last_message._reply_to
+        if message._reply_to != None:
+            recipient = message._reply_to
         else:
-            recipient = self.last_message_sender
+            recipient = sender
             
         self.send(recipient, memo)
         
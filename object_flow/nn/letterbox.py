@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import logging
+
+import cv2
+import numpy as np
+
+#==========================================================================================
+# Letterbox prepares the frames of one video for the neural net.  A frame of
+# width x height is resized to fit a size x size input and written, already
+# converted to RGB and normalized to [0, 1], in a float32 buffer given by the caller.
+# With 'letterbox' the aspect ratio of the frame is preserved and the borders are
+# filled with gray (0.5); otherwise the frame is stretched to size x size.
+# Boxes found by the neural net, normalized to [0, 1] on the size x size input,
+# are mapped back to frame coordinates by 'unmap'.
+#==========================================================================================
+
+class Letterbox:
+
+    # value of the padding pixels
+    pad_value = 0.5
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, width, height, size = 416, letterbox = False):
+
+        self.width = width
+        self.height = height
+        self.size = size
+        self.letterbox = letterbox
+
+        # scale factors from frame coordinates to input coordinates
+        if letterbox:
+            self.kw = self.kh = min(size / width, size / height)
+        else:
+            self.kw = size / width
+            self.kh = size / height
+
+        self.new_width = min(size, int(round(width * self.kw)))
+        self.new_height = min(size, int(round(height * self.kh)))
+
+        # position of the resized frame in the input
+        self.left = (size - self.new_width) // 2
+        self.top = (size - self.new_height) // 2
+
+        # resized frame, before conversion to float
+        self._resized = np.empty((self.new_height, self.new_width, 3), dtype = np.uint8)
+
+    # ---------------------------------------------------------------------------------
+    # Writes the frame into 'dst', a float32 array of shape (size, size, 3).  The
+    # frame is resized into a preallocated buffer and then converted to RGB and
+    # normalized in one single pass
+    # ---------------------------------------------------------------------------------
+
+    def transform(self, frame, dst):
+
+        cv2.resize(frame, (self.new_width, self.new_height), dst = self._resized)
+
+        if self.letterbox:
+            bottom = self.top + self.new_height
+            right = self.left + self.new_width
+            dst[:self.top] = Letterbox.pad_value
+            dst[bottom:] = Letterbox.pad_value
+            dst[self.top:bottom, :self.left] = Letterbox.pad_value
+            dst[self.top:bottom, right:] = Letterbox.pad_value
+
+        np.multiply(self._resized[..., ::-1], np.float32(1 / 255),
+                    out = dst[self.top:self.top + self.new_height,
+                              self.left:self.left + self.new_width])
+
+        return dst
+
+    # ---------------------------------------------------------------------------------
+    # Maps boxes (N, 4) given as (x1, y1, x2, y2) normalized to the neural net input
+    # back to frame coordinates.  Coordinates are clipped to the frame
+    # ---------------------------------------------------------------------------------
+
+    def unmap(self, boxes):
+
+        boxes = np.asarray(boxes, dtype = np.float32) * self.size
+
+        frame_boxes = np.empty_like(boxes)
+        frame_boxes[:, 0::2] = (boxes[:, 0::2] - self.left) / self.kw
+        frame_boxes[:, 1::2] = (boxes[:, 1::2] - self.top) / self.kh
+
+        np.clip(frame_boxes[:, 0::2], 0, self.width, out = frame_boxes[:, 0::2])
+        np.clip(frame_boxes[:, 1::2], 0, self.height, out = frame_boxes[:, 1::2])
+
+        return frame_boxes
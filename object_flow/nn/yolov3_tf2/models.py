@@ -261,6 +261,18 @@ def YoloV3Tiny(size=None, channels=3, anchors=yolo_tiny_anchors,
     return Model(inputs, outputs, name='yolov3_tiny')
 
 
+def YoloV3Inference(model, size=416):
+    # compiled inference entry point: avoids the data adapter and callbacks built
+    # by keras 'predict' on every call.  Images are already resized, converted to
+    # RGB and normalized to [0, 1] by object_flow.nn.letterbox.Letterbox
+    @tf.function(input_signature=[
+        tf.TensorSpec(shape=[None, size, size, 3], dtype=tf.float32)])
+    def inference(images):
+        return model(images, training=False)
+
+    return inference
+
+
 def YoloLoss(anchors, classes=80, ignore_thresh=0.5):
     def yolo_loss(y_true, y_pred):
         # 1. transform all pred outputs
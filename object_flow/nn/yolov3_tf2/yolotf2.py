@@ -15,6 +15,7 @@
 import os
 import logging
 import time
+from datetime import timedelta
 
 import tensorflow as tf
 import numpy as np
@@ -22,9 +23,10 @@ import cv2
 
 from object_flow.ipc.doer import Doer
 from object_flow.nn.yolov3_tf2.models import YoloV3
-from object_flow.nn.yolov3_tf2.dataset import transform_images
+from object_flow.nn.yolov3_tf2.models import YoloV3Inference
 from object_flow.util.mmap_frames import MmapFrames
 from object_flow.util.mmap_bboxes import MmapBboxes
+from object_flow.nn.letterbox import Letterbox
 
 # from object_flow.nn.yolov3_tf2.models import YoloV3Tiny
 
@@ -62,6 +64,12 @@ class YoloTf2(Doer):
         logging.info("loading weights from file 'object_flow/nn/resources/checkpoints/yolov3.tf'")
         self.yolo.load_weights('object_flow/nn/resources/checkpoints/yolov3.tf')
         logging.info("weights loaded")
+
+        # compiled inference function.  Calling it once traces the graph, so that
+        # the first detection does not pay for it
+        self._inference = YoloV3Inference(self.yolo, 416)
+        self._inference(tf.zeros((1, 416, 416, 3), dtype=tf.float32))
+        logging.info("inference function compiled")
             
         class_names = [c.strip() for c in open(names_path).readlines()]
         logging.info("classes loaded")
@@ -77,15 +85,39 @@ class YoloTf2(Doer):
     #
     # ---------------------------------------------------------------------------------
 
-    def __initialize__(self, confidence, threshold):
+    def __initialize__(self, confidence, threshold, batch_size = 1, batch_deadline = 0,
+                       letterbox = False, classes = [0], mmap_backend = 'file'):
         logging.info("Yolo, setting confidence to %f", confidence)
         logging.info("Yolo, setting threshold to %f", threshold)
+        logging.info("Yolo, batching up to %d frames for %d milliseconds", batch_size,
+                     batch_deadline)
         
         self.min_confidence = confidence
         self.threshold = threshold
+
+        # only objects of these classes are reported.  By default only class 0,
+        # person
+        logging.info("Yolo, detecting classes %s", classes)
+        self.classes = np.array(classes, dtype = np.uint16)
+
+        # find_bboxes requests from all videos are collected and processed in one
+        # single batch, either when 'batch_size' requests are pending or when the
+        # first pending request has waited for 'batch_deadline' milliseconds
+        self.batch_size = batch_size
+        self.batch_deadline = timedelta(milliseconds = batch_deadline)
+        self._pending = []
+        # number of the batch being collected.  Deadline timers carry the number of
+        # their batch, so that timers of batches already flushed are ignored
+        self._batch = 0
+
+        # preallocated input of the neural net.  Every frame of the batch is
+        # resized, converted and normalized directly into its row
+        self.letterbox = letterbox
+        self._input = np.empty((batch_size, 416, 416, 3), dtype = np.float32)
         
         # mmap file for writing detected object's bounding boxes
-        self._mmap_bbox = MmapBboxes()
+        self.mmap_backend = mmap_backend
+        self._mmap_bbox = MmapBboxes(mmap_backend)
         
     # ----------------------------------------------------------------------------------
     # 
@@ -93,7 +125,9 @@ class YoloTf2(Doer):
 
     def terminate(self):
         super().terminate()
-        self._mmap.close()
+        for video in self.videos.values():
+            video['frames'].close()
+            self._mmap_bbox.close(video['bboxes'])
     
     # ----------------------------------------------------------------------------------
     # 
@@ -113,64 +147,150 @@ class YoloTf2(Doer):
         self.videos[video_name]['depth'] = depth
         self.videos[video_name]['frame_size'] = width * height * depth
         # mmap file for accessing video frames
-        self.videos[video_name]['frames'] = MmapFrames(video_name, width, height, depth)
+        self.videos[video_name]['frames'] = MmapFrames(video_name, width, height, depth,
+                                                       self.mmap_backend)
         self.videos[video_name]['frames'].open_read()
+        # region of the video in the bboxes table, kept open for all detections
+        self.videos[video_name]['bboxes'] = self._mmap_bbox.open_write(video_name,
+                                                                       video_id)
+        # preprocessing of the frames for the neural net
+        self.videos[video_name]['letterbox'] = Letterbox(width, height, 416,
+                                                         self.letterbox)
         
     # ---------------------------------------------------------------------------------
-    #
+    # Should be called with 'phone'.  Detections are written on the bounding box block
+    # of the video and the reply, the 'frame_index', is only sent when they are
+    # available, possibly after other requests are batched with this one
     # ---------------------------------------------------------------------------------
 
     def find_bboxes(self, video_name, frame_index):
 
-        frame_number, frame = self.videos[video_name]['frames'].read_data(frame_index)
-        video_id = self.videos[video_name]['video_id']
-        width = self.videos[video_name]['width']
-        height = self.videos[video_name]['height']
-        
-        # resize the image to 416 x 416 (seems to be the dimention required by yolo)
-        # to RGB
-        frame = cv2.resize(frame, (416, 416))
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        imge = transform_images(tf.expand_dims(frame, 0), 416)
-
-        bboxes, scores, classes, nums = self.yolo.predict(imge)
-        bboxes, objectness, classes, nums = bboxes[0], scores[0], classes[0], nums[0]
-
-        wh = np.flip(frame.shape[0:2])
-
-        # Constants needed to resize the identified bboxes to the original frame size
-        kw = width/416
-        kh = height/416
-
-        # open the mmap file for writing detections
-        buf = self._mmap_bbox.open_write(video_name, video_id)
-        # moves the memory map index to start writing bounding boxes information
-        self._mmap_bbox.set_detection_address(buf, video_id)
-
-        num_elmts = 0
-        for i in range(nums):
-            # taking only class 0 person... needs to be configurable
-            if classes[i] == 0:
-                if objectness[i] > self.min_confidence:
-                    num_elmts += 1
-                    x1y1 = tuple((np.array(bboxes[i][0:2]) * wh).astype(np.int32))
-                    x2y2 = tuple((np.array(bboxes[i][2:4]) * wh).astype(np.int32))
-                    
-                    box = [x1y1[0], x1y1[1], x2y2[0], x2y2[1]]
-                    box = (box * np.array([kw, kh, kw, kh])).astype(np.int32)
-                    confidence = np.array([objectness[i]]).astype(np.float)
-                    obj_class = np.array([classes[i]]).astype(np.uint16)
-
-                    self._mmap_bbox.write_detection(
-                        buf, box, confidence, obj_class)
-                    
-                    logging.debug("writing detection with box %s confidence %s classID %s",
-                                 box, confidence, obj_class)
-
-        # write the number of detected object on the header of the block
-        self._mmap_bbox.set_base_address(buf, video_id)
-        logging.debug("number of objects detected %d", num_elmts)
-        self._mmap_bbox.write_header(buf, np.array([num_elmts]).astype(np.int32))
+        self._pending.append((video_name, frame_index, self.defer_reply()))
+
+        # when every registered video is waiting there is no reason to wait for the
+        # deadline
+        if len(self._pending) >= min(self.batch_size, len(self.videos)):
+            self._flush()
+        elif len(self._pending) == 1:
+            self.wakeupAfter(self.batch_deadline, payload = self._batch)
+
+    # ----------------------------------------------------------------------------------
+    # The batch deadline has expired: run detection on what is pending
+    # ----------------------------------------------------------------------------------
+
+    def wakeup(self):
+        # the timer of a batch that was already flushed when it got full
+        if self.last_message.payload != self._batch:
+            return
         
-        self._mmap_bbox.close(buf)
+        if len(self._pending) > 0:
+            self._flush()
+
+    # ----------------------------------------------------------------------------------
+    # 
+    # ----------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+    
+    # ---------------------------------------------------------------------------------
+    # Detects the objects of all pending requests and replies to every one of them.
+    # If detection fails, the requests are answered with no detections: the flow
+    # managers are waiting for the reply to move on
+    # ---------------------------------------------------------------------------------
+
+    def _flush(self):
+
+        batch = self._pending
+        self._pending = []
+        self._batch += 1
+
+        try:
+            self._detect(batch)
+        except Exception:
+            logging.exception("Yolo, detection failed on a batch of %d frames, "
+                              "replying with no detections", len(batch))
+            for video_name, frame_index, token in batch:
+                self._write_no_detections(video_name)
+
+        for video_name, frame_index, token in batch:
+            self.reply_deferred(token, frame_index)
+
+    # ---------------------------------------------------------------------------------
+    # Runs the neural net once for all the requests of the batch and writes the
+    # detections of every request to the bounding box block of its video
+    # ---------------------------------------------------------------------------------
+
+    def _detect(self, batch):
+
+        logging.debug("running yolo on a batch of %d frames", len(batch))
         
+        if len(batch) > len(self._input):
+            self._input = np.empty((len(batch), 416, 416, 3), dtype = np.float32)
+            
+        for b, (video_name, frame_index, token) in enumerate(batch):
+            self._read_frame(video_name, frame_index, self._input[b])
+
+        bboxes, scores, classes, nums = [output.numpy() for output in
+                                         self._inference(self._input[:len(batch)])]
+
+        for b, (video_name, frame_index, token) in enumerate(batch):
+            self._write_detections(video_name, bboxes[b], scores[b], classes[b],
+                                   nums[b])
+
+    # ---------------------------------------------------------------------------------
+    # Writes an empty list of detections for the video.  A block that can not be
+    # written keeps the header cleared by the flow manager, which also reads as no
+    # detections
+    # ---------------------------------------------------------------------------------
+
+    def _write_no_detections(self, video_name):
+        try:
+            self._mmap_bbox.write_detections(
+                self.videos[video_name]['bboxes'],
+                np.empty(0, dtype = MmapBboxes.record_dtype))
+        except Exception:
+            logging.exception("Yolo, could not write detections of video %s",
+                              video_name)
+
+    # ---------------------------------------------------------------------------------
+    # Reads the frame from the video's mmap file and writes it in 'dst' resized to
+    # 416 x 416 (seems to be the dimention required by yolo), in RGB and normalized
+    # ---------------------------------------------------------------------------------
+
+    def _read_frame(self, video_name, frame_index, dst):
+        
+        frames = self.videos[video_name]['frames']
+        frames.acquire(frame_index, MmapFrames.YOLO_READER)
+        try:
+            frame_number, frame = frames.read_data(frame_index)
+            self.videos[video_name]['letterbox'].transform(frame, dst)
+        finally:
+            frames.release(frame_index, MmapFrames.YOLO_READER)
+        
+    # ---------------------------------------------------------------------------------
+    # Writes the detections of one frame to the mmap file of the video
+    # ---------------------------------------------------------------------------------
+
+    def _write_detections(self, video_name, bboxes, objectness, classes, nums):
+        
+        nums = int(nums)
+
+        # keep only the detections of the selected classes with enough confidence
+        mask = (np.isin(classes[:nums], self.classes) &
+                (objectness[:nums] > self.min_confidence))
+
+        # map the identified bboxes back to the original frame size
+        boxes = self.videos[video_name]['letterbox'].unmap(bboxes[:nums][mask])
+        
+        detections = np.empty(len(boxes), dtype = MmapBboxes.record_dtype)
+        detections['box'] = boxes
+        detections['conf'] = objectness[:nums][mask]
+        detections['cls'] = classes[:nums][mask]
+
+        logging.debug("writing detections %s", detections)
+
+        # write the detections and the number of detected objects on the block of
+        # the video
+        num_elmts = self._mmap_bbox.write_detections(
+            self.videos[video_name]['bboxes'], detections)
+        logging.debug("number of objects detected %d", num_elmts)
@@ -53,12 +53,16 @@ class Display(Doer):
     # ----------------------------------------------------------------------------------
 
     def base_image(self, items):
-        if self._stop:
-            return
-
-        self.items = items
-        # header, self.frame = self._mmap.read_data(frame_index)
-        header, self.frame = self._mmap.read_last()
+        # the frame published by the flow_manager is held for us until we release it
+        frame_index = self._mmap.published_index()
+        
+        if not self._stop:
+            self.items = items
+            header, frame = self._mmap.read_data(frame_index)
+            # overlays are drawn on the frame, so we need our own copy
+            self.frame = frame.copy()
+            
+        self._mmap.release(frame_index, MmapFrames.DISPLAY_READER)
         
     # ----------------------------------------------------------------------------------
     # overlay the bounding boxes on the frame. If centroids = True then add also the
@@ -170,7 +174,8 @@ class Display(Doer):
         self.depth = depth
         self.frame_size = width * height * depth
 
-        self._mmap = MmapFrames(self.video_name, width, height, depth)
+        self._mmap = MmapFrames(self.video_name, width, height, depth,
+                                self.cfg.mmap_backend)
         self._mmap.open_read()
         
     # ----------------------------------------------------------------------------------
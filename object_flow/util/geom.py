@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import numpy as np
+
+#==========================================================================================
+# Geometry of bounding boxes, points and lines.  Methods work on whole sets at once:
+# boxes are (N, 4) arrays of (startX, startY, endX, endY), points are (N, 2) arrays
+# and lines or segments are (N, 4) arrays with their two end points.  Every
+# computation is done with int64/float64, so boxes can come as uint16 from the
+# trackers.
+#
+# The scalar methods (iou, point_position, intersect) take plain coordinates and
+# give the same results as the set methods on one element.
+#==========================================================================================
+
+class Geom:
+
+    # ----------------------------------------------------------------------------------
+    # (N, 4) array with the bounding boxes of the items
+    # ----------------------------------------------------------------------------------
+
+    def boxes(items):
+        boxes = np.empty((len(items), 4), dtype = np.int64)
+        for i, item in enumerate(items):
+            boxes[i] = (item.startX, item.startY, item.endX, item.endY)
+        return boxes
+
+    # ----------------------------------------------------------------------------------
+    # (N, 2) array with the centroids of the items
+    # ----------------------------------------------------------------------------------
+
+    def centroids(items):
+        centroids = np.empty((len(items), 2), dtype = np.int64)
+        for i, item in enumerate(items):
+            centroids[i] = item.centroid
+        return centroids
+
+    # ---------------------------------------------------------------------------------
+    # Intersection over union of every box in 'boxes1' with every box in 'boxes2'.
+    # Returns a (N, M) matrix.  Boxes are inclusive of their end coordinates
+    # ---------------------------------------------------------------------------------
+
+    def iou_matrix(boxes1, boxes2):
+        b1 = np.asarray(boxes1, dtype = np.int64).reshape(-1, 1, 4)
+        b2 = np.asarray(boxes2, dtype = np.int64).reshape(1, -1, 4)
+
+        # determine the (x, y)-coordinates of the intersection rectangles
+        x_start = np.maximum(b1[..., 0], b2[..., 0])
+        y_start = np.maximum(b1[..., 1], b2[..., 1])
+        x_end = np.minimum(b1[..., 2], b2[..., 2])
+        y_end = np.minimum(b1[..., 3], b2[..., 3])
+
+        inter_area = (np.maximum(0, x_end - x_start + 1) *
+                      np.maximum(0, y_end - y_start + 1))
+        area1 = (b1[..., 2] - b1[..., 0] + 1) * (b1[..., 3] - b1[..., 1] + 1)
+        area2 = (b2[..., 2] - b2[..., 0] + 1) * (b2[..., 3] - b2[..., 1] + 1)
+
+        return inter_area / (area1 + area2 - inter_area).astype(np.float64)
+
+    # ---------------------------------------------------------------------------------
+    # Euclidean distance between every point in 'points1' and every point in
+    # 'points2'.  Returns a (N, M) matrix
+    # ---------------------------------------------------------------------------------
+
+    def distance_matrix(points1, points2):
+        p1 = np.asarray(points1, dtype = np.float64).reshape(-1, 1, 2)
+        p2 = np.asarray(points2, dtype = np.float64).reshape(1, -1, 2)
+        return np.sqrt(((p1 - p2) ** 2).sum(axis = 2))
+
+    # ----------------------------------------------------------------------------------
+    # Side of every line on which every point is.  'lines' are given by two points
+    # (first_point, second_point).  Returns a (N, L) boolean matrix, True on one side
+    # of the line and False on the other (or on the line)
+    # ----------------------------------------------------------------------------------
+
+    def point_positions(points, lines):
+        p = np.asarray(points, dtype = np.int64).reshape(-1, 1, 2)
+        l = np.asarray(lines, dtype = np.int64).reshape(1, -1, 4)
+        return ((l[..., 2] - l[..., 0]) * (p[..., 1] - l[..., 1]) -
+                (l[..., 3] - l[..., 1]) * (p[..., 0] - l[..., 0])) > 0
+
+    # ----------------------------------------------------------------------------------
+    # True if the points (p1, p2, p3) are in counter clockwise order.  Points are
+    # arrays of (..., 2) that broadcast with each other
+    # ----------------------------------------------------------------------------------
+
+    def ccw_array(p1, p2, p3):
+        return ((p3[..., 1] - p1[..., 1]) * (p2[..., 0] - p1[..., 0]) >
+                (p2[..., 1] - p1[..., 1]) * (p3[..., 0] - p1[..., 0]))
+
+    # ----------------------------------------------------------------------------------
+    # Whether every segment in 'segments1' intersects every segment in 'segments2'.
+    # Returns a (N, M) boolean matrix
+    # ----------------------------------------------------------------------------------
+
+    def intersections(segments1, segments2):
+        s1 = np.asarray(segments1, dtype = np.int64).reshape(-1, 1, 4)
+        s2 = np.asarray(segments2, dtype = np.int64).reshape(1, -1, 4)
+        return Geom.segments_intersect(s1[..., :2], s1[..., 2:], s2[..., :2],
+                                       s2[..., 2:])
+
+    # ----------------------------------------------------------------------------------
+    # Whether segment (a, b) intersects segment (c, d), element by element.  Points
+    # are arrays of (..., 2) that broadcast with each other
+    # ----------------------------------------------------------------------------------
+
+    def segments_intersect(a, b, c, d):
+        a, b = np.asarray(a, dtype = np.int64), np.asarray(b, dtype = np.int64)
+        c, d = np.asarray(c, dtype = np.int64), np.asarray(d, dtype = np.int64)
+        return ((Geom.ccw_array(a, c, d) != Geom.ccw_array(b, c, d)) &
+                (Geom.ccw_array(a, b, c) != Geom.ccw_array(a, b, d)))
+
+    # ---------------------------------------------------------------------------------
+    # matches the input objects with the trackable objects by verifying the ones that
+    # have higher intersection over union score.
+    # Puts elements of set1 in the rows of a matrix ans elements of set2 as the
+    # columns.  Unused_rows are all elements in set1 that do not match elements in
+    # set2.
+    # ---------------------------------------------------------------------------------
+
+    def iou_match(set1, set2, match_value):
+        iou_array = Geom.iou_matrix(Geom.boxes(set1), Geom.boxes(set2))
+        return Geom._greedy_match(iou_array, iou_array > match_value,
+                                  iou_array.argmax(axis = 1) if len(set2) > 0 else [])
+
+    # ---------------------------------------------------------------------------------
+    # matches the input objects with trackable objects by verifying the ones for which
+    # the centroid is closer
+    # ---------------------------------------------------------------------------------
+
+    def centroid_match(set1, set2, max_dist):
+        c_array = Geom.distance_matrix(Geom.centroids(set1), Geom.centroids(set2))
+        return Geom._greedy_match(c_array, c_array < max_dist,
+                                  c_array.argmin(axis = 1) if len(set2) > 0 else [])
+
+    # ----------------------------------------------------------------------------------
+    # Returns False in one side of the line and true on the other.  The line is
+    # given by the two bounding points: first_point and second_point
+    # ----------------------------------------------------------------------------------
+
+    def point_position(fp0, fp1, sp0, sp1, x, y):
+        fp0, fp1, sp0, sp1, x, y = int(fp0), int(fp1), int(sp0), int(sp1), int(x), int(y)
+        return ((sp0 - fp0) * (y - fp1) - (sp1 - fp1) * (x - fp0)) > 0
+
+    # ----------------------------------------------------------------------------------
+    #
+    # ----------------------------------------------------------------------------------
+
+    def ccw(p10, p11, p20, p21, p30, p31):
+        # return (C.y-A.y)*(B.x-A.x) > (B.y-A.y)*(C.x-A.x)
+        return ((p31 - p11) * (p20 - p10) > (p21 - p11) * (p30 - p10))
+
+    # ----------------------------------------------------------------------------------
+    #
+    # ----------------------------------------------------------------------------------
+
+    def intersect(p10, p11, p20, p21, p30, p31, p40, p41):
+        p10, p11, p20, p21 = int(p10), int(p11), int(p20), int(p21)
+        p30, p31, p40, p41 = int(p30), int(p31), int(p40), int(p41)
+        # return Geom.ccw(A,C,D) != Geom.ccw(B,C,D) and Geom.ccw(A,B,C) != Geom.ccw(A,B,D)
+        return (Geom.ccw(p10, p11, p30, p31, p40, p41) !=
+                Geom.ccw(p20, p21, p30, p31, p40, p41) and
+                Geom.ccw(p10, p11, p20, p21, p30, p31) !=
+                Geom.ccw(p10, p11, p20, p21, p40, p41))
+
+    # ---------------------------------------------------------------------------------
+    # Calculates the intersection over union of this bounding box with another
+    # given bounding box
+    # ---------------------------------------------------------------------------------
+
+    def iou(box_startX, box_startY, box_endX, box_endY, obox_startX, obox_startY,
+            obox_endX, obox_endY):
+        box_startX, box_startY = int(box_startX), int(box_startY)
+        box_endX, box_endY = int(box_endX), int(box_endY)
+        obox_startX, obox_startY = int(obox_startX), int(obox_startY)
+        obox_endX, obox_endY = int(obox_endX), int(obox_endY)
+
+        # determine the (x, y)-coordinates of the intersection rectangle
+        x_start = max(box_startX, obox_startX)
+        y_start = max(box_startY, obox_startY)
+        x_end = min(box_endX, obox_endX)
+        y_end = min(box_endY, obox_endY)
+
+        # compute the area of intersection rectangle
+        inter_area = max(0, x_end - x_start + 1) * max(0, y_end - y_start + 1)
+
+        box_area = ((box_endX - box_startX + 1) * (box_endY - box_startY + 1))
+        obox_area = ((obox_endX - obox_startX + 1) * (obox_endY - obox_startY + 1))
+
+        # compute the intersection over union by taking the intersection
+        # area and dividing it by the sum of prediction + ground-truth
+        # areas - the interesection area
+        return inter_area / float(box_area + obox_area - inter_area)
+
+    # ----------------------------------------------------------------------------------
+    #
+    # ----------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Every row with at least one acceptable column is matched to its best column
+    # ('best', one per row), unless the column was already taken by a previous row.
+    # Returns the rows without a match, the columns without a match and the list
+    # of matched (row, col)
+    # ---------------------------------------------------------------------------------
+
+    def _greedy_match(scores, acceptable, best):
+        rows = np.unique(np.nonzero(acceptable)[0])
+        cols = []
+        match_rows_cols = []
+
+        for row in rows:
+            col = best[row]
+            if col in cols:
+                continue
+            cols.append(col)
+            match_rows_cols.append((row, col))
+
+        unused_rows = np.setdiff1d(np.arange(scores.shape[0]), rows)
+        unused_cols = set(range(0, scores.shape[1])).difference(cols)
+        return unused_rows, unused_cols, match_rows_cols
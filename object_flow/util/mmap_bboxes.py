@@ -21,141 +21,216 @@ import numpy as np
 
 import logging
 
+from object_flow.util import shm
+
+#==========================================================================================
+# MmapBboxes is the table of detections shared between Yolo and the FlowManagers.
+# The file starts with a header region declaring the layout of the table, followed
+# by one region per video:
+#
+#   * header: number of video regions (capacity), size of a region, size of a
+#     record and maximum number of records per video
+#   * region of video 'video_id': number of detections followed by the records
+#
+# Regions are aligned to the allocation granularity so that every process maps only
+# the region of the video it handles.  The table grows when more cameras are added
+# than its capacity.
+#==========================================================================================
+
 class MmapBboxes:
 
+    # fields of the header
+    CAPACITY = 0
+    REGION_SIZE = 1
+    RECORD_SIZE = 2
+    MAX_BBOXES = 3
+    META_FIELDS = 8
+
+    # initial number of video regions
+    initial_capacity = 8
+
+    # layout of one detection: four integers for the box, the confidence and the
+    # classID.  Records are aligned, so that the block of detections of a video can
+    # be accessed as a numpy array directly on the mmap, without copies
+    record_dtype = np.dtype([('box', '<i4', 4), ('conf', '<f4'), ('cls', '<u2')],
+                            align = True)
+
     # ---------------------------------------------------------------------------------
     #
     # ---------------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self, backend = 'file'):
 
-        self.mmap_path = "log/mmap_bboxes"
+        self.mmap_path = shm.shared_path("mmap_bboxes", backend)
         self.page_size = 4000
         # size in bytes of one bbox
-        # Yolo: four integers, each with 4 bytes + 1 float for confidences (8 bytes),
-        # + 1 int for classID (2 bytes)
-        self.yolo_block_size = 4 * 4 + 1 * 8 + 1 * 2
+        # Yolo: four integers, each with 4 bytes + 1 float for confidences (4 bytes),
+        # + 1 int for classID (2 bytes) + padding, see 'record_dtype'
+        self.yolo_block_size = MmapBboxes.record_dtype.itemsize
         # Tracker: 1 bit for termination (1 byte) = 1 * 1 + 4 integers * 4 bytes for
         # bounding boxes 
         self.tracker_block_size = 1 * 1 + 4 * 4
         
         self.max_bboxes = 50
         # header has the number of of bounding boxes stored in the buffer
-        # 1 integer
-        self.header_size = 1 * 4
+        # 1 integer, padded so that the records are aligned
+        self.header_size = MmapBboxes.record_dtype.alignment
 
         # maximum size in bytes of bounding boxes for one video
         self.bboxes_size = self.header_size + self.max_bboxes * self.yolo_block_size
 
-        self._alloc = mmap.ALLOCATIONGRANULARITY
+        # size of the header of the table and of the region of every video, aligned
+        # so that they can be mapped independently
+        self.table_header_size = self._align(MmapBboxes.META_FIELDS * 8)
+        self.region_size = self._align(self.bboxes_size)
+        self.capacity = 0
         
     # ---------------------------------------------------------------------------------
-    # Open mmap file for writing
+    # Creates the file with room for 'capacity' videos.  Should only be called by the
+    # owner of the table, that keeps the file open to grow it
     # ---------------------------------------------------------------------------------
  
-    def create(self):
+    def create(self, capacity = None):
         self._fd = os.open(self.mmap_path, os.O_CREAT | os.O_RDWR | os.O_TRUNC)
-        os.write(self._fd, b'\x00' * mmap.ALLOCATIONGRANULARITY)
+        self.reserve(capacity if capacity != None else MmapBboxes.initial_capacity)
+
+    # ---------------------------------------------------------------------------------
+    # Closes and removes the file created by 'create'
+    # ---------------------------------------------------------------------------------
+
+    def unlink(self):
+        os.close(self._fd)
+        shm.unlink(self.mmap_path)
         
     # ---------------------------------------------------------------------------------
-    # Open mmap file for writing. Assumes that the file was already created
+    # Makes sure that the table has a region for at least 'num_videos' videos.  The
+    # capacity is doubled when the table grows, so that adding cameras one by one
+    # does not resize the file every time
     # ---------------------------------------------------------------------------------
 
-    def open_write(self, video_name, video_id):
+    def reserve(self, num_videos):
+        if num_videos <= self.capacity:
+            return
+
+        capacity = max(num_videos, 2 * self.capacity)
+        logging.info("bboxes table: growing capacity from %d to %d videos",
+                     self.capacity, capacity)
+
+        # new regions are filled with zeros
+        os.ftruncate(self._fd, self.table_header_size + capacity * self.region_size)
+
+        header = mmap.mmap(self._fd, self.table_header_size, access = mmap.ACCESS_WRITE)
+        meta = np.ndarray((MmapBboxes.META_FIELDS,), dtype = np.int64, buffer = header)
+        meta[MmapBboxes.CAPACITY] = capacity
+        meta[MmapBboxes.REGION_SIZE] = self.region_size
+        meta[MmapBboxes.RECORD_SIZE] = self.yolo_block_size
+        meta[MmapBboxes.MAX_BBOXES] = self.max_bboxes
+        del meta
+        header.close()
         
-        self._fd = os.open(self.mmap_path, os.O_RDWR)
-        # pg_length = self.bboxes_size * (video_id + 1)
-        alloc = (self.bboxes_size * video_id) % self._alloc
-        self._alloc = (alloc + 1) * mmap.ALLOCATIONGRANULARITY
+        self.capacity = capacity
         
-        return mmap.mmap(self._fd, mmap.ALLOCATIONGRANULARITY,
-                         access = mmap.ACCESS_WRITE,
-                         offset = alloc * mmap.ALLOCATIONGRANULARITY)
-    
+    # ---------------------------------------------------------------------------------
+    # Maps the region of the video for writing.  Assumes that the file was already
+    # created with room for the video
+    # ---------------------------------------------------------------------------------
 
+    def open_write(self, video_name, video_id):
         # It seems that there is no way to share memory between processes in
         # Windows, so we use mmap.ACCESS_WRITE that will store the frame on
         # the file. I had hoped that we could share memory.  In Linux, documentation
         # says that memory sharing is possible
-        # return mmap.mmap(self._fd, 0, access = mmap.ACCESS_WRITE)
+        return self._map_region(video_id, os.O_RDWR, mmap.ACCESS_WRITE)
     
     # ---------------------------------------------------------------------------------
-    # Open mmap file for reading only
+    # Maps the region of the video for reading only
     # ---------------------------------------------------------------------------------
 
     def open_read(self, video_name, video_id):
-
-        # open the mmap file whith the decoded frame. 
-        # number of pages is calculated from the image size
-        # ceil((width x height x 3) / 4k (page size) + k), where k is a small
-        # value to make sure that all image overhead are accounted for. 
-        # pg_length = self.bboxes_size * (video_id + 1)
-        self._fd = os.open(self.mmap_path, os.O_RDONLY)
-        
-        return mmap.mmap(self._fd, 0, access = mmap.ACCESS_READ)
+        return self._map_region(video_id, os.O_RDONLY, mmap.ACCESS_READ)
         
     # ---------------------------------------------------------------------------------
-    # Closes the mmap object
+    # Closes the mmap object.  Numpy views on the region should be released before
     # ---------------------------------------------------------------------------------
 
     def close(self, buf):
         buf.close()
-        os.close(self._fd)
         
     # ---------------------------------------------------------------------------------
-    # read the header and advance the pointer in the file to the next byte
+    # Header of the block of the video: a numpy view on the mmap with the number of
+    # detections.  -1 means that detections were requested but not yet written
     # ---------------------------------------------------------------------------------
 
-    def set_base_address(self, buf, video_id):
-        pos = (video_id * self.bboxes_size)
-        logging.debug("base position set to %d", pos)
-        
-        buf.seek(pos)
+    def header_view(self, buf):
+        return np.ndarray((1,), dtype = np.int32, buffer = buf, offset = 0)
 
     # ---------------------------------------------------------------------------------
-    # read the header and advance the pointer in the file to the next byte
+    # Detections of the video: a numpy view on the mmap with 'max_bboxes' records
+    # of 'record_dtype'
     # ---------------------------------------------------------------------------------
 
-    def set_detection_address(self, buf, video_id, box_index = 0):
-        pos = ((video_id * self.bboxes_size) + # base address
-               self.header_size +              # header
-               (box_index * self.yolo_block_size))  # number of bounding boxes
-        logging.debug("detection position set to %d", pos)
-        
-        buf.seek(pos)
+    def records_view(self, buf):
+        return np.ndarray((self.max_bboxes,), dtype = MmapBboxes.record_dtype,
+                          buffer = buf, offset = self.header_size)
 
     # ---------------------------------------------------------------------------------
-    # reads the header and frame at the given index from the mmap file
+    # Marks the detections of the video as requested but not yet available
     # ---------------------------------------------------------------------------------
 
-    def read_data(self, buf, num_elmts, dtype):
-        return np.frombuffer(
-            buf.read(num_elmts * np.dtype(dtype).itemsize), dtype=dtype)
-    
+    def clear(self, buf):
+        self.header_view(buf)[0] = -1
+
     # ---------------------------------------------------------------------------------
-    # Write 0 to actually mapped file in memory
+    # Reads the detections of the video.  Returns a copy of the records, since the
+    # block is overwritten by the next detection
     # ---------------------------------------------------------------------------------
 
-    def set0(self, buf):
-        # os.write(self._fd, b'\x00' * mmap.PAGESIZE * self._npage)
-        buf.write(b'\x00' * self.bboxes_size)
-        
+    def read_detections(self, buf):
+        num_elmts = self.header_view(buf)[0]
+        return self.records_view(buf)[:max(num_elmts, 0)].copy()
+
     # ---------------------------------------------------------------------------------
-    # Write header
+    # Write all the detections of a frame, an array of 'record_dtype', and then the
+    # number of detections in the header, so that readers never see a partially
+    # written block.  At most 'max_bboxes' detections are written.  Returns the
+    # number of detections written
     # ---------------------------------------------------------------------------------
 
-    def write_header(self, buf, num_elmts):
-        size = buf.write(num_elmts)
-    
+    def write_detections(self, buf, records):
+        num_elmts = min(len(records), self.max_bboxes)
+        self.records_view(buf)[:num_elmts] = records[:num_elmts]
+        self.header_view(buf)[0] = num_elmts
+        logging.debug("writing %d boxes", num_elmts)
+        return num_elmts
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # Size rounded up to the allocation granularity
+    # ---------------------------------------------------------------------------------
+
+    def _align(self, size):
+        return (math.ceil(size / mmap.ALLOCATIONGRANULARITY) *
+                mmap.ALLOCATIONGRANULARITY)
+
     # ---------------------------------------------------------------------------------
-    # Write the bounding box information. When migration to Cython, bbox is an
-    # array of 4 ints of type int32, confidence is one float of type float and
-    # classID is one int of type uint16
+    # Maps the region of the video.  The file descriptor is not needed after the
+    # mapping is created
     # ---------------------------------------------------------------------------------
 
-    def write_detection(self, buf, bbox, confidence, classID):
-        size = buf.write(bbox)
-        size += buf.write(confidence)
-        size += buf.write(classID)
-        logging.debug("writing box %s of size %d", bbox, size)
-        return size
+    def _map_region(self, video_id, flags, access):
+        fd = os.open(self.mmap_path, flags)
+        try:
+            capacity = int(np.frombuffer(os.read(fd, 8), dtype = np.int64)[0])
+            if video_id >= capacity:
+                raise ValueError("bboxes table has no region for video %d (capacity %d)" %
+                                 (video_id, capacity))
+            return mmap.mmap(fd, self.region_size, access = access,
+                             offset = self.table_header_size +
+                             video_id * self.region_size)
+        finally:
+            os.close(fd)
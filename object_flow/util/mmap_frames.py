@@ -21,186 +21,488 @@ import numpy as np
 
 import logging
 
+from object_flow.util.notifier import Notifier
+from object_flow.util import shm
+
+#==========================================================================================
+# MmapFrames is a ring of frames shared between one producer (the VideoDecoder), one
+# consumer (the FlowManager) and many readers (Trackers, Yolo, Display).  The file
+# starts with a header region followed by the frame slots:
+#
+#   * meta: buffer size, frame size, the producer/consumer cursors and the published
+#     frame.  Readers take the buffer size from here, so only the producer needs to
+#     know how deep the ring is.  Also the statistics of the ring: processing latency
+#     of the consumer, frames dropped by the producer's rate control, frames lost
+#     because the ring was full and the fraction of frames being kept
+#   * slot_seq: frame number stored in every slot
+#   * slot_state: FREE -> WRITING -> READY -> CONSUMED -> WRITING...
+#   * slot_refs: one byte per (slot, reader).  A reader only writes its own byte, so
+#     holding and releasing a slot does not need any lock
+#
+# Every field of the header has only one writer at each state transition: the
+# producer moves a slot from FREE/CONSUMED to WRITING and then to READY, the consumer
+# moves it from READY to CONSUMED and readers only touch their own reference byte.
+# The producer will only reuse a slot that is CONSUMED and not held by any reader.
+# Every new frame is signaled through a Notifier, so that the consumer can block
+# waiting for a frame instead of polling the header.
+#
+# Frames are accessed through numpy views backed directly by the mmap, so reading a
+# frame does not copy it.  A view is only valid while the slot is held (or, for the
+# producer, claimed) and all views should be released before the file is closed.
+#
+# The consumer publishes the index of the last fully processed frame for listeners
+# such as the Display.  The published slot is held for the listener until it
+# releases it, so listeners read the frame in place and no copy of it is needed.
+#==========================================================================================
+
 class MmapFrames:
 
+    # slot states
+    FREE = 0
+    WRITING = 1
+    READY = 2
+    CONSUMED = 3
+
+    # fields of the meta block of the header
+    CAPACITY = 0
+    FRAME_SIZE = 1
+    PRODUCER = 2
+    CONSUMER = 3
+    SEQUENCE = 4
+    PUBLISHED = 5
+    LATENCY = 6
+    DROPPED = 7
+    LAGGED = 8
+    KEEP_RATIO = 9
+    META_FIELDS = 16
+
+    # maximum number of readers that can hold a slot.  Every reader has a fixed id:
+    # Yolo, Display and then one id for every tracker
+    MAX_READERS = 32
+    YOLO_READER = 0
+    DISPLAY_READER = 1
+    TRACKER_READER = 2
+
+    # bounds of the ring depth when it is derived from a memory budget
+    MIN_DEPTH = 8
+    MAX_DEPTH = 500
+
     # ---------------------------------------------------------------------------------
-    #
+    # 'buffer_max_size' is the number of frames in the ring.  It is only needed by
+    # the producer: when opening an existing file it is read from its header
     # ---------------------------------------------------------------------------------
 
-    def __init__(self, video_name, width, height, depth):
+    def __init__(self, video_name, width, height, depth, backend = 'file',
+                 buffer_max_size = None):
 
         self.video_name = video_name
-        self.mmap_path = "log/mmap_" + self.video_name
+        self.backend = backend
+        self.mmap_path = shm.shared_path("mmap_" + self.video_name, backend)
         self.width = width
         self.height = height
         self.depth = depth
         self.frame_size = width * height * depth
-        
-        self.buffer_max_size = 500
-        self.page_size = 4000
-        self.header_size = 8
 
-        self._buffer_rear = 0
-        
+        if buffer_max_size != None:
+            self._layout(buffer_max_size)
+
+    # ---------------------------------------------------------------------------------
+    # Number of frames in the ring so that it takes at most 'memory_budget' bytes and
+    # holds at most 'seconds' of video at 'fps' frames per second.  The depth is kept
+    # between MIN_DEPTH and MAX_DEPTH
+    # ---------------------------------------------------------------------------------
+
+    def ring_depth(frame_size, fps, memory_budget, seconds):
+        depth = min(memory_budget // frame_size,
+                    math.ceil(MmapFrames.valid_fps(fps) * seconds))
+        return int(max(MmapFrames.MIN_DEPTH, min(MmapFrames.MAX_DEPTH, depth)))
+
+    # ---------------------------------------------------------------------------------
+    # Frame rate reported by the stream or 30 if it is not valid: some streams do not
+    # report their frame rate
+    # ---------------------------------------------------------------------------------
+
+    def valid_fps(fps):
+        if not fps or fps <= 0 or fps > 120:
+            return 30
+        return fps
+
     # ---------------------------------------------------------------------------------
-    # Open mmap file for reading only
+    # Open mmap file for reading only.  The header is always mapped for writing
+    # since readers need to hold and release slots
     # ---------------------------------------------------------------------------------
 
     def open_read(self):
+        self._fd = os.open(self.mmap_path, os.O_RDWR)
+        self._layout(self._read_capacity())
+        self._map(mmap.ACCESS_READ)
+        self._notifier = None
 
-        # open the mmap file whith the decoded frame. 
-        # number of pages is calculated from the image size
-        # ceil((width x height x 3) / 4k (page size) + k), where k is a small
-        # value to make sure that all image overhead are accounted for. 
-        self._npage = ((math.ceil(self.frame_size / self.page_size) + 10) *
-                       self.buffer_max_size + 1)
-        self._fd = os.open(self.mmap_path, os.O_RDONLY)
-        self._buf = mmap.mmap(self._fd, mmap.PAGESIZE * self._npage,
-                              access = mmap.ACCESS_READ)
-        
     # ---------------------------------------------------------------------------------
-    # Open mmap file for writing
+    # Open mmap file for writing.  This creates the file and should only be called
+    # by the producer of frames
     # ---------------------------------------------------------------------------------
 
     def open_write(self):
-        
         self._fd = os.open(self.mmap_path, os.O_CREAT | os.O_RDWR | os.O_TRUNC)
-        self._npage = ((math.ceil(self.frame_size / self.page_size) + 10) *
-                       self.buffer_max_size + 1)
-        # It seems that there is no way to share memory between processes in
-        # Windows, so we use mmap.ACCESS_WRITE that will store the frame on
-        # the file. I had hoped that we could share memory.  In Linux, documentation
-        # says that memory sharing is possible
-        self._buf = mmap.mmap(self._fd, mmap.PAGESIZE * self._npage,
-                              access = mmap.ACCESS_WRITE)
-    
+        self._notifier = Notifier("frames_" + self.video_name,
+                                  mmap_backend = self.backend).open(create = True)
+
     # ---------------------------------------------------------------------------------
-    # Open mmap file for writing
+    # Open mmap file for writing.  Assumes that the file was already created
     # ---------------------------------------------------------------------------------
 
     def open_write2(self):
-        
         self._fd = os.open(self.mmap_path, os.O_RDWR)
-        self._npage = ((math.ceil(self.frame_size / self.page_size) + 10) *
-                       self.buffer_max_size + 1)
-        # It seems that there is no way to share memory between processes in
-        # Windows, so we use mmap.ACCESS_WRITE that will store the frame on
-        # the file. I had hoped that we could share memory.  In Linux, documentation
-        # says that memory sharing is possible
-        self._buf = mmap.mmap(self._fd, mmap.PAGESIZE * self._npage,
-                              access = mmap.ACCESS_WRITE)
-    
+        self._layout(self._read_capacity())
+        self._map(mmap.ACCESS_WRITE)
+        self._notifier = Notifier("frames_" + self.video_name,
+                                  mmap_backend = self.backend).open()
+
     # ---------------------------------------------------------------------------------
-    # Closes the mmap object
+    # Closes the mmap object.  The numpy views on the header need to be released
+    # before the mmap can be closed
     # ---------------------------------------------------------------------------------
 
     def close(self):
+        del self._meta, self._slot_seq, self._slot_state, self._slot_refs, self._frames
+        self._header.close()
         self._buf.close()
-        
+        os.close(self._fd)
+        if self._notifier != None:
+            self._notifier.close()
+
     # ---------------------------------------------------------------------------------
-    # Write 0 to actually mapped file in memory
+    # Removes the file and the notifier.  Should only be called by the producer, after
+    # closing
+    # ---------------------------------------------------------------------------------
+
+    def unlink(self):
+        shm.unlink(self.mmap_path)
+        Notifier("frames_" + self.video_name, mmap_backend = self.backend).unlink()
+
+    # ---------------------------------------------------------------------------------
+    # Sets the size of the file and initializes the header.  The file is extended
+    # with ftruncate, so pages are only allocated (filled with zeros) when first
+    # touched
     # ---------------------------------------------------------------------------------
 
     def set0(self):
-        os.write(self._fd, b'\x00' * mmap.PAGESIZE * self._npage)
-        
+        os.ftruncate(self._fd, self.header_size + self.data_size)
+        # the file could only be mapped after it has its final size
+        self._map(mmap.ACCESS_WRITE)
+
+        self._meta[MmapFrames.CAPACITY] = self.buffer_max_size
+        self._meta[MmapFrames.FRAME_SIZE] = self.frame_size
+        self._meta[MmapFrames.PUBLISHED] = -1
+        self._meta[MmapFrames.KEEP_RATIO] = 1000
+
     # ---------------------------------------------------------------------------------
-    # read the header and advance the pointer in the file to the next byte
+    # Index in the ring that follows the given index
     # ---------------------------------------------------------------------------------
 
-    def set_pointer(self, frame_index):
-        self._buf.seek(frame_index * (self.frame_size + self.header_size))
+    def next_index(self, frame_index):
+        frame_index += 1
+        if frame_index == self.buffer_max_size:
+            frame_index = 0
+        return frame_index
 
     # ---------------------------------------------------------------------------------
-    # read the header and advance the pointer in the file to the next byte
+    # Read-only numpy view of the frame at the given index.  No data is copied
+    # ---------------------------------------------------------------------------------
+
+    def frame_view(self, frame_index):
+        view = self._frames[frame_index]
+        view.flags.writeable = False
+        return view
+
+    # ---------------------------------------------------------------------------------
+    # Writable numpy view of the frame at the given index, so that the producer can
+    # write a frame directly into its slot.  Only available if the file was opened
+    # for writing
+    # ---------------------------------------------------------------------------------
+
+    def writable_frame_view(self, frame_index):
+        return self._frames[frame_index]
+
+    # ---------------------------------------------------------------------------------
+    # Returns the frame number stored at the given index if the frame is ready to be
+    # consumed, 0 otherwise
     # ---------------------------------------------------------------------------------
 
     def read_header(self, frame_index):
-        self.set_pointer(frame_index)
-        header = self._buf.read(self.header_size)
-        frame_number = int.from_bytes(header, byteorder = 'big')
-        
-        return frame_number
+        if self._slot_state[frame_index] != MmapFrames.READY:
+            return 0
+
+        return int(self._slot_seq[frame_index])
 
     # ---------------------------------------------------------------------------------
-    # reads the header and frame at the given index from the mmap file
+    # Waits at most 'timeout' seconds for a frame with number at least
+    # 'frame_number' to be ready at the given index.  Returns the frame number or 0
+    # if no frame arrived in time
+    # ---------------------------------------------------------------------------------
+
+    def wait_frame(self, frame_index, frame_number, timeout):
+        fn = self.read_header(frame_index)
+        if fn == 0 or fn < frame_number:
+            self._notifier.wait(timeout)
+            fn = self.read_header(frame_index)
+
+        if fn == 0 or fn < frame_number:
+            return 0
+
+        return fn
+
+    # ---------------------------------------------------------------------------------
+    # reads the header and frame at the given index from the mmap file.  The frame is
+    # a read-only view on the mmap
     # ---------------------------------------------------------------------------------
 
     def read_data(self, frame_index):
-        
-        self.set_pointer(frame_index)
-        header = self._buf.read(self.header_size)
-        frame_number = int.from_bytes(header, byteorder = 'big')
-        b2 = np.frombuffer(self._buf.read(self.frame_size), dtype=np.uint8)
-        frame = b2.reshape((self.height, self.width, self.depth))
+        return (int(self._slot_seq[frame_index]), self.frame_view(frame_index))
 
-        return (frame_number, frame)
-    
     # ---------------------------------------------------------------------------------
-    #
+    # Reader 'reader_id' holds the slot: the producer will not overwrite it until
+    # released
     # ---------------------------------------------------------------------------------
 
-    def copy_last(self, frame_index):
-        frame_number, frame = self.read_data(frame_index)
-        self._write_frame(self.buffer_max_size, frame, frame_number)
-        
+    def acquire(self, frame_index, reader_id):
+        self._slot_refs[frame_index, reader_id] = 1
+
+    # ---------------------------------------------------------------------------------
+    # Reader 'reader_id' releases the slot
+    # ---------------------------------------------------------------------------------
+
+    def release(self, frame_index, reader_id):
+        self._slot_refs[frame_index, reader_id] = 0
+
+    # ---------------------------------------------------------------------------------
+    # True if reader 'reader_id' is holding the slot
+    # ---------------------------------------------------------------------------------
+
+    def is_held(self, frame_index, reader_id):
+        return self._slot_refs[frame_index, reader_id] != 0
+
+    # ---------------------------------------------------------------------------------
+    # Number of readers holding the slot
+    # ---------------------------------------------------------------------------------
+
+    def ref_count(self, frame_index):
+        return int(np.count_nonzero(self._slot_refs[frame_index]))
+
+    # ---------------------------------------------------------------------------------
+    # The consumer has finished processing the frame at the given index.  The slot
+    # can be reused by the producer as soon as no reader holds it
+    # ---------------------------------------------------------------------------------
+
+    def consume(self, frame_index):
+        self._slot_state[frame_index] = MmapFrames.CONSUMED
+        self._meta[MmapFrames.CONSUMER] = frame_index
+
+    # ---------------------------------------------------------------------------------
+    # Number of frames written and not yet consumed
+    # ---------------------------------------------------------------------------------
+
+    def occupancy(self):
+        return int(np.count_nonzero(self._slot_state == MmapFrames.READY))
+
+    # ---------------------------------------------------------------------------------
+    # Time in seconds the consumer takes to process one frame.  Set by the consumer
+    # ---------------------------------------------------------------------------------
+
+    def set_latency(self, latency):
+        self._meta[MmapFrames.LATENCY] = int(latency * 1000000)
+
     # ---------------------------------------------------------------------------------
     #
     # ---------------------------------------------------------------------------------
 
-    def read_last(self):
-        return self.read_data(self.buffer_max_size)
-    
+    def latency(self):
+        return self._meta[MmapFrames.LATENCY] / 1000000
+
+    # ---------------------------------------------------------------------------------
+    # The producer dropped a frame to control the rate of the pipeline
+    # ---------------------------------------------------------------------------------
+
+    def count_dropped(self):
+        self._meta[MmapFrames.DROPPED] += 1
+
+    # ---------------------------------------------------------------------------------
+    # Fraction of the captured frames the producer is writing on the ring
+    # ---------------------------------------------------------------------------------
+
+    def set_keep_ratio(self, keep_ratio):
+        self._meta[MmapFrames.KEEP_RATIO] = int(keep_ratio * 1000)
+
+    # ---------------------------------------------------------------------------------
+    # Statistics of the ring
+    # ---------------------------------------------------------------------------------
+
+    def stats(self):
+        return {'occupancy': self.occupancy(),
+                'latency': self.latency(),
+                'dropped': int(self._meta[MmapFrames.DROPPED]),
+                'lagged': int(self._meta[MmapFrames.LAGGED]),
+                'keep_ratio': self._meta[MmapFrames.KEEP_RATIO] / 1000}
+
+    # ---------------------------------------------------------------------------------
+    # Publishes the frame at the given index as the last processed frame.  Should be
+    # called by the consumer after the slot was held for the listeners
+    # ---------------------------------------------------------------------------------
+
+    def publish_processed(self, frame_index):
+        self._meta[MmapFrames.PUBLISHED] = frame_index
+
+    # ---------------------------------------------------------------------------------
+    # Index of the last processed frame or -1 if no frame was published
+    # ---------------------------------------------------------------------------------
+
+    def published_index(self):
+        return int(self._meta[MmapFrames.PUBLISHED])
+
+    # ---------------------------------------------------------------------------------
+    # Claims the next slot of the ring for writing.  Returns the index of the slot or
+    # -1 if the slot has not yet been processed or is still held by a reader, in which
+    # case the frame should be dropped.  The frame is written on the view given by
+    # 'writable_frame_view' and made visible to the consumer by 'publish'
+    # ---------------------------------------------------------------------------------
+
+    def claim(self):
+        next_index = self.next_index(int(self._meta[MmapFrames.PRODUCER]))
+
+        if not self._slot_free(next_index):
+            self._meta[MmapFrames.LAGGED] += 1
+            return -1
+
+        self._slot_state[next_index] = MmapFrames.WRITING
+        return next_index
+
+    # ---------------------------------------------------------------------------------
+    # True if the next slot of the ring can be claimed
+    # ---------------------------------------------------------------------------------
+
+    def can_write(self):
+        return self._slot_free(self.next_index(int(self._meta[MmapFrames.PRODUCER])))
+
     # ---------------------------------------------------------------------------------
-    # Write the frame header
+    # Gives back a claimed slot without publishing a frame on it
     # ---------------------------------------------------------------------------------
 
-    def write_header(self, frame_index, value):
-        val = value.to_bytes(8, byteorder = 'big')
-        
-        self.set_pointer(frame_index)
-        self._buf.write(val)
-    
+    def cancel(self, frame_index):
+        self._slot_state[frame_index] = MmapFrames.FREE
+
     # ---------------------------------------------------------------------------------
-    # Write the frame
+    # The frame in the claimed slot was completely written: the slot becomes READY
+    # and the consumer is notified
     # ---------------------------------------------------------------------------------
 
-    def _write_frame(self, index, frame, frame_number):
-        self.write_header(index, frame_number)
-        size = self._buf.write(frame)
-        return size
-        
+    def publish(self, frame_index, frame_number):
+        logging.debug("%s: publishing mmap position %d", self.video_name, frame_index)
+
+        self._slot_seq[frame_index] = frame_number
+        self._slot_state[frame_index] = MmapFrames.READY
+
+        # move last element of buffer to the next index
+        self._meta[MmapFrames.PRODUCER] = frame_index
+        self._meta[MmapFrames.SEQUENCE] += 1
+        self._notifier.notify()
+
     # ---------------------------------------------------------------------------------
-    # Write the frame
+    # Write the frame on the next slot of the ring.  Returns the number of bytes
+    # written or 0 if the frame was dropped
     # ---------------------------------------------------------------------------------
 
     def write_frame(self, frame, frame_number):
-        # fn = frame_number.to_bytes(8, byteorder = 'big')
-        
-        next_index = self._buffer_rear + 1
-        if next_index == self.buffer_max_size - 1:
-            next_index = 0
-
-        # if next frame in the buffer has not yet been processed, then just drop
-        # the frame
-        val = self.read_header(next_index)
-        if val != 0:
+
+        # if next frame in the buffer has not yet been processed or is still held by
+        # a reader, then just drop the frame
+        frame_index = self.claim()
+        if frame_index == -1:
             return 0
 
-        # check to see if the frame was already processed.  If not, wait to write
-        # the frame.  This will block the video_decoder.
-        # val = -1
-        # while val != 0:
-        #     val = self.read_header(next_index)
+        self._frames[frame_index] = frame
+        self.publish(frame_index, frame_number)
 
-        # move last element of buffer to the next index
-        self._buffer_rear = next_index
-        
-        logging.debug("%s: writting to mmap position %d", self.video_name,
-                      self._buffer_rear)
-        
-        # write the frame to the mmap file.
-        self.write_header(next_index, frame_number)
-        size = self._buf.write(frame)
-        return size
-    
+        return self.frame_size
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    # A slot can be written if it was never used or if it was consumed and no reader
+    # is holding it
+    # ---------------------------------------------------------------------------------
+
+    def _slot_free(self, frame_index):
+        state = self._slot_state[frame_index]
+        return ((state == MmapFrames.FREE or state == MmapFrames.CONSUMED) and
+                not self._slot_refs[frame_index].any())
+
+    # ---------------------------------------------------------------------------------
+    # Exact layout of the file for a ring of 'buffer_max_size' frames: the header
+    # region followed by the frames, with no padding between frames
+    # ---------------------------------------------------------------------------------
+
+    def _layout(self, buffer_max_size):
+        self.buffer_max_size = buffer_max_size
+        self.num_slots = buffer_max_size
+
+        # size of the header region.  It is rounded up to the allocation granularity
+        # so that the frames can be mapped independently from the header
+        meta_size = MmapFrames.META_FIELDS * 8
+        table_size = self.num_slots * (8 + 8 + MmapFrames.MAX_READERS)
+        self.header_size = (math.ceil((meta_size + table_size) /
+                                      mmap.ALLOCATIONGRANULARITY) *
+                            mmap.ALLOCATIONGRANULARITY)
+
+        self.data_size = self.num_slots * self.frame_size
+
+    # ---------------------------------------------------------------------------------
+    # Reads the number of frames in the ring from the header of the file
+    # ---------------------------------------------------------------------------------
+
+    def _read_capacity(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        meta = np.frombuffer(os.read(self._fd, MmapFrames.META_FIELDS * 8),
+                             dtype = np.int64)
+        if meta[MmapFrames.FRAME_SIZE] != self.frame_size:
+            logging.warning("%s: frame size in the mmap file is %d, expected %d",
+                            self.video_name, meta[MmapFrames.FRAME_SIZE],
+                            self.frame_size)
+        return int(meta[MmapFrames.CAPACITY])
+
+    # ---------------------------------------------------------------------------------
+    # Maps the header for writing and the frames with the given access.  Creates
+    # numpy views on the header tables
+    # ---------------------------------------------------------------------------------
+
+    def _map(self, access):
+        self._header = mmap.mmap(self._fd, self.header_size, access = mmap.ACCESS_WRITE)
+
+        # It seems that there is no way to share memory between processes in
+        # Windows, so we use mmap.ACCESS_WRITE that will store the frame on
+        # the file. I had hoped that we could share memory.  In Linux, documentation
+        # says that memory sharing is possible
+        self._buf = mmap.mmap(self._fd, self.data_size, access = access,
+                              offset = self.header_size)
+
+        offset = 0
+        self._meta = np.ndarray((MmapFrames.META_FIELDS,), dtype = np.int64,
+                                buffer = self._header, offset = offset)
+        offset += MmapFrames.META_FIELDS * 8
+        self._slot_seq = np.ndarray((self.num_slots,), dtype = np.int64,
+                                    buffer = self._header, offset = offset)
+        offset += self.num_slots * 8
+        self._slot_state = np.ndarray((self.num_slots,), dtype = np.int64,
+                                      buffer = self._header, offset = offset)
+        offset += self.num_slots * 8
+        self._slot_refs = np.ndarray((self.num_slots, MmapFrames.MAX_READERS),
+                                     dtype = np.uint8, buffer = self._header,
+                                     offset = offset)
+
+        # all the frames, with no copy.  Read-only if the file was opened for reading
+        self._frames = np.ndarray((self.num_slots, self.height, self.width, self.depth),
+                                  dtype = np.uint8, buffer = self._buf)
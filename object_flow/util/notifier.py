@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import os
+import time
+import select
+import logging
+
+from object_flow.util import shm
+
+# named semaphores are only available if posix_ipc is installed
+try:
+    import posix_ipc
+except ImportError:
+    posix_ipc = None
+
+#==========================================================================================
+# A Notifier lets a process block until another process signals it, instead of
+# polling shared memory in a busy loop.  Notifiers are identified by name, so that
+# unrelated processes (actors) can open the same notifier.  Notifications are only
+# a hint that something has changed: after 'wait' returns the waiting process should
+# always check the shared memory again.
+#
+# Three backends are available:
+#   * 'semaphore': a POSIX named semaphore (requires posix_ipc)
+#   * 'fifo': a named pipe; the waiter blocks on 'select'.  The pipe is created with
+#     the other shared files, see 'shm.shared_path'
+#   * 'poll': waits by sleeping for a short period.  Used when no other backend is
+#     available, for instance on Windows
+#==========================================================================================
+
+class Notifier:
+
+    # sleep period of the 'poll' backend in seconds
+    poll_period = 0.002
+
+    # ---------------------------------------------------------------------------------
+    # @param mmap_backend [String] backend of the shared files ('file' or 'shm'),
+    # the 'fifo' backend creates its pipe in the same place
+    # ---------------------------------------------------------------------------------
+
+    def __init__(self, name, backend = None, mmap_backend = 'file'):
+        self.name = name
+        self.backend = backend if backend != None else Notifier.default_backend()
+        self.mmap_backend = mmap_backend
+
+        self._sem = None
+        self._fd = None
+
+    # ---------------------------------------------------------------------------------
+    # Best backend available in this system
+    # ---------------------------------------------------------------------------------
+
+    def default_backend():
+        if posix_ipc != None:
+            return 'semaphore'
+        elif hasattr(os, 'mkfifo'):
+            return 'fifo'
+        else:
+            return 'poll'
+
+    # ---------------------------------------------------------------------------------
+    # Opens the notifier.  If 'create' is True any notifier left with the same name
+    # by a previous execution is removed first
+    # ---------------------------------------------------------------------------------
+
+    def open(self, create = False):
+        if create:
+            self.unlink()
+
+        if self.backend == 'semaphore':
+            self._sem = posix_ipc.Semaphore("/object_flow_" + self.name,
+                                            posix_ipc.O_CREAT, initial_value = 0)
+        elif self.backend == 'fifo':
+            try:
+                os.mkfifo(self._fifo_path())
+            except FileExistsError:
+                pass
+            # opening for read and write never blocks and keeps the pipe alive even
+            # when the other process has not opened it yet
+            self._fd = os.open(self._fifo_path(), os.O_RDWR | os.O_NONBLOCK)
+
+        return self
+
+    # ---------------------------------------------------------------------------------
+    # Wakes up the process waiting on this notifier
+    # ---------------------------------------------------------------------------------
+
+    def notify(self):
+        if self.backend == 'semaphore':
+            self._sem.release()
+        elif self.backend == 'fifo':
+            try:
+                os.write(self._fd, b'\x00')
+            except BlockingIOError:
+                # pipe is full: the waiter has many pending notifications already
+                pass
+
+    # ---------------------------------------------------------------------------------
+    # Blocks until notified or until 'timeout' seconds have passed. Returns True if
+    # a notification was received
+    # ---------------------------------------------------------------------------------
+
+    def wait(self, timeout):
+        if self.backend == 'semaphore':
+            try:
+                self._sem.acquire(timeout)
+                return True
+            except posix_ipc.BusyError:
+                return False
+        elif self.backend == 'fifo':
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if not readable:
+                return False
+            # consume all pending notifications
+            try:
+                os.read(self._fd, 4096)
+            except BlockingIOError:
+                pass
+            return True
+        else:
+            time.sleep(min(timeout, Notifier.poll_period))
+            return False
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def close(self):
+        if self._sem != None:
+            self._sem.close()
+            self._sem = None
+        if self._fd != None:
+            os.close(self._fd)
+            self._fd = None
+
+    # ---------------------------------------------------------------------------------
+    # Removes the notifier from the system
+    # ---------------------------------------------------------------------------------
+
+    def unlink(self):
+        try:
+            if self.backend == 'semaphore':
+                posix_ipc.unlink_semaphore("/object_flow_" + self.name)
+            elif self.backend == 'fifo':
+                os.unlink(self._fifo_path())
+        except (FileNotFoundError,
+                posix_ipc.ExistentialError if posix_ipc else FileNotFoundError):
+            pass
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    # PRIVATE METHODS
+
+    # ---------------------------------------------------------------------------------
+    #
+    # ---------------------------------------------------------------------------------
+
+    def _fifo_path(self):
+        return shm.shared_path("fifo_" + self.name, self.mmap_backend)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# encoding: utf-8
+# encoding: iso-8859-1
+# encoding: win-1252
+
+##########################################################################################
+# @author Rodrigo Botafogo
+#
+# Copyright (C) 2019 Rodrigo Botafogo - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Written by Rodrigo Botafogo <rodrigo.a.botafogo@gmail.com>, 2019
+##########################################################################################
+
+import os
+import logging
+
+#==========================================================================================
+# Location of the files shared between processes (frames and bounding boxes).  Two
+# backends are available, selected by 'mmap_backend' in the system configuration:
+#   * 'file': regular files in the 'log' directory
+#   * 'shm': files in POSIX shared memory (/dev/shm).  Pages live only in memory and
+#     are never written back to disk.  Falls back to 'file' if /dev/shm does not
+#     exist, for instance on Windows
+#==========================================================================================
+
+SHM_DIR = "/dev/shm"
+
+# directory of the shared files of the 'file' backend, relative to the working
+# directory.  Created when needed
+FILE_DIR = "log"
+
+# ---------------------------------------------------------------------------------
+# Path of the shared file with the given name for the backend
+# ---------------------------------------------------------------------------------
+
+def shared_path(name, backend = 'file'):
+    if backend == 'shm':
+        if os.path.isdir(SHM_DIR):
+            return os.path.join(SHM_DIR, "object_flow_" + name)
+        logging.warning("%s not available, sharing %s through a file", SHM_DIR, name)
+
+    os.makedirs(FILE_DIR, exist_ok = True)
+    return os.path.join(FILE_DIR, name)
+
+# ---------------------------------------------------------------------------------
+# Removes the shared file
+# ---------------------------------------------------------------------------------
+
+def unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -1,6 +1,8 @@
-from distutils.core import setup
-from Cython.Build import cythonize
+from setuptools import setup, find_packages
 
+# geometry used to be a Cython extension (geom.pyx).  It is now plain numpy in
+# object_flow/util/geom.py, so there is nothing to compile
 setup(
-    ext_modules = cythonize("object_flow/util/geom.pyx")
+    name = 'object_flow',
+    packages = find_packages(include = ['object_flow', 'object_flow.*'])
 )